@@ -1,21 +1,187 @@
 """
 API Key Rotator for OpenAI
 Handles API key management and rotation.
+
+Keys are loaded from OPENAI_API_KEYS (comma-separated), OPENAI_API_KEY and
+OPENAI_API_KEY_1..N. Each call to get_api_key() picks the least-loaded healthy
+key based on a sliding 60s window of requests (RPM) and tokens (TPM); a key that
+returns 429 cools down for the Retry-After period. Requests and tokens are
+charged by llm_clients.KeyUsageCallback as calls start and finish.
+
+With LLM_PROVIDER=simulator the pool holds LLM_SIM_KEYS (default 1) synthetic keys
+instead, so simulated 429s exercise the same cooldown and rotation.
 """
 import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger("zenark.api_keys")
+
+WINDOW_SECONDS = 60.0
+
+
+def _load_keys() -> List[str]:
+    """Collect configured keys (deduplicated, in declaration order)."""
+    if os.getenv("LLM_PROVIDER", "openai").lower() == "simulator":
+        return [f"sk-simulator-{i}" for i in range(1, max(1, int(os.getenv("LLM_SIM_KEYS", "1"))) + 1)]
+    keys: List[str] = []
+    keys.extend(k.strip() for k in os.getenv("OPENAI_API_KEYS", "").split(","))
+    keys.append(os.getenv("OPENAI_API_KEY", ""))
+    index = 1
+    while os.getenv(f"OPENAI_API_KEY_{index}"):
+        keys.append(os.getenv(f"OPENAI_API_KEY_{index}", ""))
+        index += 1
+    return list(dict.fromkeys(k for k in keys if k))
+
+
+def mask_key(api_key: str) -> str:
+    """Short, non-secret identifier for logs and stats."""
+    return f"...{api_key[-4:]}" if api_key else ""
+
+
+class KeyState:
+    """Sliding-window usage and health for one API key"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.requests: Deque[float] = deque()
+        self.tokens: Deque[Tuple[float, int]] = deque()
+        self.tokens_in_window = 0
+        self.total_requests = 0
+        self.total_tokens = 0
+        self.rate_limited = 0
+        self.cooldown_until = 0.0
+
+    def prune(self, now: float) -> None:
+        cutoff = now - WINDOW_SECONDS
+        while self.requests and self.requests[0] < cutoff:
+            self.requests.popleft()
+        while self.tokens and self.tokens[0][0] < cutoff:
+            self.tokens_in_window -= self.tokens.popleft()[1]
+
+    def load(self, rpm_limit: int, tpm_limit: int) -> float:
+        """Fraction of the tighter of the RPM/TPM budgets already used in the window."""
+        return max(len(self.requests) / rpm_limit, self.tokens_in_window / tpm_limit)
+
+
+class APIKeyPool:
+    """Least-loaded selection across N keys with per-key RPM/TPM tracking and 429 cooldown"""
+
+    def __init__(self, keys: List[str], rpm_limit: int = 500, tpm_limit: int = 200000, default_cooldown: float = 20.0):
+        if not keys:
+            raise ValueError("OPENAI_API_KEY not found in environment variables")
+        self.rpm_limit = max(1, rpm_limit)
+        self.tpm_limit = max(1, tpm_limit)
+        self.default_cooldown = default_cooldown
+        self._states: Dict[str, KeyState] = {k: KeyState(k) for k in keys}
+        self._lock = threading.Lock()
+
+    def acquire(self) -> str:
+        """
+        Pick the least-loaded key that is not cooling down. Picking a key does not count as
+        a request: record_request() charges the RPM window when a call actually starts.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for state in self._states.values():
+                state.prune(now)
+            healthy = [s for s in self._states.values() if s.cooldown_until <= now]
+            if healthy:
+                state = min(healthy, key=lambda s: s.load(self.rpm_limit, self.tpm_limit))
+            else:
+                # Every key is cooling down: use the one that recovers first
+                state = min(self._states.values(), key=lambda s: s.cooldown_until)
+            return state.api_key
+
+    def record_request(self, api_key: str) -> None:
+        """Count one started LLM call against the key's RPM window."""
+        with self._lock:
+            state = self._states.get(api_key)
+            if state is None:
+                return
+            state.requests.append(time.monotonic())
+            state.total_requests += 1
+
+    def record_tokens(self, api_key: str, tokens: int) -> None:
+        """Add completed-call token usage to the key's TPM window."""
+        if tokens <= 0:
+            return
+        with self._lock:
+            state = self._states.get(api_key)
+            if state is None:
+                return
+            state.tokens.append((time.monotonic(), tokens))
+            state.tokens_in_window += tokens
+            state.total_tokens += tokens
+
+    def record_rate_limit(self, api_key: str, retry_after: Optional[float] = None) -> None:
+        """Put a key into cooldown after a 429 (Retry-After seconds, or the default)."""
+        with self._lock:
+            state = self._states.get(api_key)
+            if state is None:
+                return
+            state.rate_limited += 1
+            cooldown = retry_after if retry_after and retry_after > 0 else self.default_cooldown
+            state.cooldown_until = max(state.cooldown_until, time.monotonic() + cooldown)
+        logger.warning(f"⏳ API key {mask_key(api_key)} rate limited; cooling down for {cooldown:.0f}s")
+
+    def available_keys(self) -> int:
+        """Number of keys not currently cooling down."""
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for s in self._states.values() if s.cooldown_until <= now)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            keys = []
+            for state in self._states.values():
+                state.prune(now)
+                keys.append({
+                    "key": mask_key(state.api_key),
+                    "rpm": len(state.requests),
+                    "tpm": state.tokens_in_window,
+                    "load": round(state.load(self.rpm_limit, self.tpm_limit), 4),
+                    "total_requests": state.total_requests,
+                    "total_tokens": state.total_tokens,
+                    "rate_limited": state.rate_limited,
+                    "cooldown_remaining": round(max(0.0, state.cooldown_until - now), 1)
+                })
+        return {"rpm_limit": self.rpm_limit, "tpm_limit": self.tpm_limit, "keys": keys}
+
+
+_pool: Optional[APIKeyPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_key_pool() -> APIKeyPool:
+    """Global key pool (built lazily from the environment)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = APIKeyPool(
+                    _load_keys(),
+                    rpm_limit=int(os.getenv("OPENAI_KEY_RPM_LIMIT", "500")),
+                    tpm_limit=int(os.getenv("OPENAI_KEY_TPM_LIMIT", "200000")),
+                    default_cooldown=float(os.getenv("OPENAI_KEY_COOLDOWN_SECONDS", "20"))
+                )
+                logger.info(f"🔑 API key pool initialized with {len(_pool._states)} key(s)")
+    return _pool
+
+
 def get_api_key():
     """
-    Get the OpenAI API key from environment variables.
-    
+    Get the least-loaded healthy OpenAI API key.
+
     Returns:
         str: The OpenAI API key
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY not found in environment variables")
-    return api_key
+    return get_key_pool().acquire()
@@ -5,33 +5,42 @@ Generates personalized wellness reports using OpenAI GPT-4
 
 import os
 import json
+import asyncio
 import datetime
+from typing import Any, Optional
 from bson import ObjectId
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
-from api_key_rotator import get_api_key
+from llm_clients import get_llm, new_llm
 
 load_dotenv()
 
 def generate_autogen_report(conversation_text: str, name: str) -> dict:
+    """
+    Synchronous wrapper around agenerate_autogen_report().
+    Runs its own event loop, so it uses a dedicated client instead of the shared
+    (scheduled) registry clients that belong to the API server's loop.
+    """
+    llm = new_llm("gpt-4o-mini", temperature=0.7)
+    return asyncio.run(agenerate_autogen_report(conversation_text, name, llm=llm))
+
+
+async def agenerate_autogen_report(conversation_text: str, name: str, llm: Optional[Any] = None) -> dict:
     """
     Generate a comprehensive 3-part mental health report.
     
     Args:
         conversation_text: Full conversation transcript
         name: Student's name
+        llm: Chat model to use (defaults to the shared registry client)
         
     Returns:
         dict: Report with TherapistAgent and DataAnalystAgent insights
     """
     
     try:
-        llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0.7,
-            openai_api_key=get_api_key()
-        )
+        if llm is None:
+            llm = get_llm("gpt-4o-mini", temperature=0.7)
         
         # ============================================
         # PARALLEL EXECUTION - All 3 agents at once
@@ -188,8 +197,6 @@ CRITICAL RULES:
 - Use ONLY the structure above, no extra text"""
 
         # Run all 3 agents in parallel using asyncio
-        import asyncio
-        
         async def generate_all_agents():
             """Nested async function to run all 3 agents in parallel"""
             
@@ -222,7 +229,7 @@ CRITICAL RULES:
             )
         
         # Run the async function
-        therapist_content, analyst_content, planner_content = asyncio.run(generate_all_agents())
+        therapist_content, analyst_content, planner_content = await generate_all_agents()
         
         # ============================================
         # AGGREGATE REPORT
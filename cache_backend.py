@@ -0,0 +1,394 @@
+"""
+Cache Backend Layer
+Two-tier cache shared by every gunicorn worker:
+- L1: bounded in-process LRU with a short TTL (no network hop, bounded staleness)
+- L2: shared Redis-compatible server (Redis, Valkey, KeyDB, Dragonfly) via redis.asyncio,
+      or the in-process `memory://` stand-in for tests and single-worker development
+
+Keys are namespaced ("zenark:<namespace>:<key>"), values are JSON, and each
+namespace keeps its own L1/L2 hit counters. L2 failures count as misses and never
+fail a request. After an L2 error the server is skipped (L1 only) for
+CACHE_L2_RETRY_SECONDS by every namespace, then a single call probes it again, so an
+unreachable server costs one connect timeout per period instead of one per lookup.
+
+Settings (env):
+    CACHE_L2_URL            redis://host:6379/0 | memory:// | unset (L1 only)
+    CACHE_L1_MAX_ENTRIES    per namespace (default 10000)
+    CACHE_L1_TTL_SECONDS    L1 lifetime, bounds cross-worker staleness (default 30)
+    CACHE_KEY_PREFIX        (default "zenark")
+    CACHE_L2_RETRY_SECONDS  how long L2 is skipped after an error (default 5)
+"""
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger("zenark.cache_backend")
+
+T = TypeVar("T")
+
+KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "zenark")
+L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "10000"))
+L1_TTL_SECONDS = float(os.getenv("CACHE_L1_TTL_SECONDS", "30"))
+L2_RETRY_SECONDS = float(os.getenv("CACHE_L2_RETRY_SECONDS", "5"))
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry. Used as L1, and as the `memory://` L2 stand-in."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+
+    def _live(self, key: str) -> Optional[Tuple[Any, float]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._live(key)
+        return entry[0] if entry is not None else None
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    async def delete_prefix(self, prefix: str) -> int:
+        doomed = [k for k in self._entries if k.startswith(prefix)]
+        for k in doomed:
+            del self._entries[k]
+        return len(doomed)
+
+    async def push_list(self, key: str, items: List[str], max_len: int, ttl: float) -> bool:
+        entry = self._live(key)
+        if entry is None:  # Like RedisBackend: only extend a list that exists
+            return False
+        await self.set(key, (list(entry[0]) + items)[-max_len:], ttl)
+        return True
+
+    async def get_list(self, key: str) -> Optional[List[str]]:
+        entry = self._live(key)
+        return list(entry[0]) if entry is not None else None
+
+    async def set_list(self, key: str, items: List[str], ttl: float) -> None:
+        await self.set(key, list(items), ttl)
+
+    async def close(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared L2 on any Redis-protocol server (redis-py asyncio client, pooled)"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis  # Optional dependency: only needed when CACHE_L2_URL is a redis URL
+
+        self.url = url
+        self._client = redis.from_url(url, decode_responses=True, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await self._client.set(key, value, px=int(ttl * 1000))
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(key)
+
+    async def delete_prefix(self, prefix: str) -> int:
+        deleted = 0
+        async for key in self._client.scan_iter(match=f"{prefix}*", count=500):
+            deleted += await self._client.delete(key)
+        return deleted
+
+    async def push_list(self, key: str, items: List[str], max_len: int, ttl: float) -> bool:
+        # Only extend a list that exists: a partial list must never look like a full history.
+        # RPUSHX checks existence inside the MULTI, so the key cannot expire between check and append.
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.rpushx(key, *items)
+            pipe.ltrim(key, -max_len, -1)
+            pipe.pexpire(key, int(ttl * 1000))
+            length, _, _ = await pipe.execute()
+        return bool(length)
+
+    async def get_list(self, key: str) -> Optional[List[str]]:
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.exists(key)
+            pipe.lrange(key, 0, -1)
+            exists, items = await pipe.execute()
+        return items if exists else None
+
+    async def set_list(self, key: str, items: List[str], ttl: float) -> None:
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if items:
+                pipe.rpush(key, *items)
+                pipe.pexpire(key, int(ttl * 1000))
+            await pipe.execute()
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+class L2CircuitBreaker:
+    """Skips an L2 server for `retry_seconds` after an error; the first call after that probes it"""
+
+    def __init__(self, retry_seconds: float = L2_RETRY_SECONDS):
+        self.retry_seconds = retry_seconds
+        self.open_until = 0.0  # 0 = closed
+        self.trips = 0
+        self.skipped = 0
+
+    def allow(self) -> bool:
+        if not self.open_until:
+            return True
+        now = time.monotonic()
+        if now < self.open_until:
+            self.skipped += 1
+            return False
+        # Half-open: this call probes the server, everyone else keeps skipping until it reports
+        self.open_until = now + self.retry_seconds
+        return True
+
+    def success(self) -> None:
+        if self.open_until:
+            logger.info("✅ L2 cache reachable again")
+            self.open_until = 0.0
+
+    def failure(self) -> None:
+        if not self.open_until:
+            self.trips += 1
+            logger.warning(f"⚠️ L2 cache unavailable, using L1 only for {self.retry_seconds:.0f}s")
+        self.open_until = time.monotonic() + self.retry_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        return {"open": bool(self.open_until), "trips": self.trips, "skipped": self.skipped}
+
+
+# One breaker per L2 server, shared by every namespace that uses it
+_breakers: Dict[int, L2CircuitBreaker] = {}
+
+
+def breaker_for(l2: Any) -> L2CircuitBreaker:
+    return _breakers.setdefault(id(l2), L2CircuitBreaker())
+
+
+_shared_l2: Optional[Any] = None
+_l2_resolved = False
+
+
+def shared_l2() -> Optional[Any]:
+    """The process-wide L2 backend from CACHE_L2_URL (None = L1 only)."""
+    global _shared_l2, _l2_resolved
+    if _l2_resolved:
+        return _shared_l2
+    _l2_resolved = True
+    url = os.getenv("CACHE_L2_URL", "").strip()
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        _shared_l2 = MemoryBackend(max_entries=L1_MAX_ENTRIES * 10)
+    else:
+        try:
+            _shared_l2 = RedisBackend(url)
+        except ImportError:
+            logger.warning("⚠️ CACHE_L2_URL is set but the 'redis' package is not installed; using L1 only")
+            return None
+    logger.info(f"✅ Shared L2 cache: {url.split('@')[-1]}")
+    return _shared_l2
+
+
+class TieredCache:
+    """One namespace of the two-tier cache (JSON values, L1 then L2, write to both)"""
+
+    _instances: List["TieredCache"] = []
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: float,
+        l1_ttl: float = L1_TTL_SECONDS,
+        l1_max_entries: int = L1_MAX_ENTRIES,
+        l2: Optional[Any] = None
+    ):
+        self.namespace = namespace
+        self.prefix = f"{KEY_PREFIX}:{namespace}:"
+        self.ttl = ttl
+        self.l1_ttl = min(l1_ttl, ttl)
+        self.l1 = MemoryBackend(l1_max_entries)
+        self.l2 = l2
+        self.breaker = breaker_for(l2) if l2 is not None else None
+        # Lists whose L2 copy missed an append (error or open breaker): deleted once L2 answers again
+        self._unsynced: "OrderedDict[str, None]" = OrderedDict()
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.l2_errors = 0
+        TieredCache._instances.append(self)
+
+    @classmethod
+    def shared(cls, namespace: str, ttl: float, **kwargs: Any) -> "TieredCache":
+        """Namespace backed by the process-wide L2 from CACHE_L2_URL."""
+        return cls(namespace, ttl, l2=shared_l2(), **kwargs)
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    async def _l2_call(self, op: Callable[[], Awaitable[T]]) -> Optional[T]:
+        """Run one L2 operation; None on error or while the breaker is open."""
+        if self.breaker is None or not self.breaker.allow():
+            return None
+        try:
+            result = await op()
+        except Exception as e:
+            self.l2_errors += 1
+            self.breaker.failure()
+            logger.warning(f"L2 cache error in '{self.namespace}': {e}")
+            return None
+        self.breaker.success()
+        return result
+
+    async def get(self, key: str) -> Optional[Any]:
+        full_key = self._key(key)
+        raw = await self.l1.get(full_key)
+        if raw is not None:
+            self.l1_hits += 1
+            CACHE_LOOKUPS.labels(namespace=self.namespace, result="l1_hit").inc()
+            return json.loads(raw)
+        if self.l2 is not None:
+            raw = await self._l2_call(lambda: self.l2.get(full_key))
+            if raw is not None:
+                self.l2_hits += 1
+                CACHE_LOOKUPS.labels(namespace=self.namespace, result="l2_hit").inc()
+                await self.l1.set(full_key, raw, self.l1_ttl)
+                return json.loads(raw)
+        self.misses += 1
+        CACHE_LOOKUPS.labels(namespace=self.namespace, result="miss").inc()
+        return None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        full_key = self._key(key)
+        raw = json.dumps(value, ensure_ascii=False, default=str)
+        await self.l1.set(full_key, raw, min(self.l1_ttl, ttl or self.ttl))
+        if self.l2 is not None:
+            await self._l2_call(lambda: self.l2.set(full_key, raw, ttl or self.ttl))
+
+    async def delete(self, key: str) -> None:
+        full_key = self._key(key)
+        await self.l1.delete(full_key)
+        if self.l2 is not None:
+            await self._l2_call(lambda: self.l2.delete(full_key))
+
+    async def clear(self) -> int:
+        """Drop the whole namespace (other workers' L1 copies expire within l1_ttl)."""
+        deleted = await self.l1.delete_prefix(self.prefix)
+        if self.l2 is not None:
+            deleted = await self._l2_call(lambda: self.l2.delete_prefix(self.prefix)) or deleted
+        return deleted
+
+    # Lists live in L2 only: they are appended by any worker, so a per-worker copy would go stale
+    async def _drop_unsynced(self) -> bool:
+        """Delete L2 lists that missed an append here, so no worker reads them as complete. False if L2 is down."""
+        async def delete(full_key: str) -> bool:
+            await self.l2.delete(full_key)
+            return True
+
+        while self._unsynced:
+            full_key = next(iter(self._unsynced))
+            if not await self._l2_call(lambda: delete(full_key)):
+                return False
+            self._unsynced.pop(full_key, None)
+        return True
+
+    async def get_list(self, key: str) -> Optional[List[Any]]:
+        if self.l2 is None:
+            return None
+        items = None
+        if await self._drop_unsynced():
+            items = await self._l2_call(lambda: self.l2.get_list(self._key(key)))
+        if items is None:
+            self.misses += 1
+            CACHE_LOOKUPS.labels(namespace=self.namespace, result="miss").inc()
+            return None
+        self.l2_hits += 1
+        CACHE_LOOKUPS.labels(namespace=self.namespace, result="l2_hit").inc()
+        return [json.loads(item) for item in items]
+
+    async def set_list(self, key: str, items: List[Any]) -> None:
+        if self.l2 is not None:
+            encoded = [json.dumps(item, ensure_ascii=False, default=str) for item in items]
+            await self._l2_call(lambda: self.l2.set_list(self._key(key), encoded, self.ttl))
+
+    async def push_list(self, key: str, items: List[Any], max_len: int) -> None:
+        if self.l2 is None or not items:
+            return
+        full_key = self._key(key)
+        encoded = [json.dumps(item, ensure_ascii=False, default=str) for item in items]
+        if await self._drop_unsynced():
+            if await self._l2_call(lambda: self.l2.push_list(full_key, encoded, max_len, self.ttl)) is not None:
+                return
+        # The append did not happen: the shared list is now incomplete and must not be served
+        self._unsynced[full_key] = None
+        self._unsynced.move_to_end(full_key)
+        while len(self._unsynced) > self.l1.max_entries:
+            self._unsynced.popitem(last=False)
+
+    def cached(self, key_builder: Callable[..., str]) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+        """Decorator caching an async function's JSON-serializable result under key_builder(*args, **kwargs)."""
+        def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+            @wraps(func)
+            async def wrapper(*args: Any, **kwargs: Any) -> T:
+                key = key_builder(*args, **kwargs)
+                hit = await self.get(key)
+                if hit is not None:
+                    return hit
+                result = await func(*args, **kwargs)
+                if result is not None:
+                    await self.set(key, result)
+                return result
+            return wrapper
+        return decorator
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.l1_hits + self.l2_hits + self.misses
+        return {
+            "l1_size": len(self.l1),
+            "l2": "shared" if self.l2 is not None else None,
+            "ttl_seconds": self.ttl,
+            "l1_ttl_seconds": self.l1_ttl,
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
+            "l2_errors": self.l2_errors,
+            "l2_breaker": self.breaker.stats() if self.breaker is not None else None,
+            "hit_ratio": round((self.l1_hits + self.l2_hits) / lookups, 4) if lookups else 0.0
+        }
+
+
+def namespace_stats() -> Dict[str, Any]:
+    return {c.namespace: c.stats() for c in TieredCache._instances}
+
+
+async def close_caches() -> None:
+    for c in TieredCache._instances:
+        await c.l1.close()
+    if _shared_l2 is not None:
+        await _shared_l2.close()
@@ -0,0 +1,179 @@
+"""
+Bucketed Chat Message Storage
+Stores session messages in fixed-size buckets keyed by (session_id, seq) so
+chat_sessions documents stay small and readers fetch only the buckets they need.
+
+chat_sessions keeps the session metadata (userId, timestamp, tool_history,
+message_count); chat_buckets holds the messages:
+    {session_id, seq, userId, count, first_ts, last_ts, messages: [{role, content, timestamp, i}]}
+where `i` is the message's position in the session and seq = i // BUCKET_SIZE.
+message_count is the number of positions handed out to live commits.
+
+Legacy inline messages are migrated to the reserved negative positions
+-len(legacy)..-1 (negative seqs), so they sort in front of live messages without
+renumbering or touching any bucket a live commit writes. While a session still has
+its inline array, readers ignore the negative buckets, so a session caught mid-migration
+is never read twice. The migration is safe to run while traffic is live and to
+re-run after an interruption:
+    python chat_buckets.py [--dry-run] [--limit N]
+"""
+
+import os
+import argparse
+import logging
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+load_dotenv()
+
+logger = logging.getLogger("zenark.chat_buckets")
+
+BUCKET_SIZE = int(os.getenv("CHAT_BUCKET_SIZE", "100"))
+BUCKETS_COLLECTION = "chat_buckets"
+
+
+def bucket_updates(
+    session_id: str,
+    user_id: Any,
+    start_index: int,
+    messages: List[Dict[str, Any]],
+    bucket_size: int = BUCKET_SIZE
+) -> List[UpdateOne]:
+    """
+    Build the bucket upserts that append `messages` starting at session position `start_index`.
+    Messages that straddle a bucket boundary are split across buckets.
+    """
+    groups: Dict[int, List[Dict[str, Any]]] = {}
+    for offset, msg in enumerate(messages):
+        index = start_index + offset
+        groups.setdefault(index // bucket_size, []).append({**msg, "i": index})
+
+    ops = []
+    for seq, msgs in groups.items():
+        update: Dict[str, Any] = {
+            # $sort keeps position order even if two commits for one session race
+            "$push": {"messages": {"$each": msgs, "$sort": {"i": 1}}},
+            "$inc": {"count": len(msgs)}
+        }
+        timestamps = [m["timestamp"] for m in msgs if m.get("timestamp")]
+        if timestamps:
+            update["$min"] = {"first_ts": min(timestamps)}
+            update["$max"] = {"last_ts": max(timestamps)}
+        if user_id is not None:
+            update["$set"] = {"userId": user_id}
+        ops.append(UpdateOne({"session_id": session_id, "seq": seq}, update, upsert=True))
+    return ops
+
+
+async def load_session_messages(
+    buckets_col,
+    session_doc: Dict[str, Any],
+    max_chars: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Return a session's messages in order (async, Motor): legacy inline messages first, then buckets by seq.
+    Negative (migrated) buckets are skipped while the inline array is still present: they
+    hold copies of it until migrate_session drops the array.
+    Stops fetching buckets once `max_chars` of content has been collected.
+    """
+    legacy: List[Dict[str, Any]] = list(session_doc.get("messages") or [])
+    messages = list(legacy)
+    chars = sum(len(m.get("content") or "") for m in messages)
+    if buckets_col is None or (max_chars is not None and chars >= max_chars):
+        return messages
+
+    query: Dict[str, Any] = {"session_id": session_doc.get("session_id")}
+    if legacy:
+        query["seq"] = {"$gte": 0}
+    cursor = buckets_col.find(query, {"messages": 1}).sort("seq", 1)
+    async for bucket in cursor:
+        for msg in sorted(bucket.get("messages", []), key=lambda m: m.get("i", 0)):
+            messages.append(msg)
+            chars += len(msg.get("content") or "")
+        if max_chars is not None and chars >= max_chars:
+            break
+    return messages
+
+
+def migrate_session(chats_col, buckets_col, doc: Dict[str, Any], dry_run: bool = False) -> int:
+    """
+    Move one legacy session's inline messages into buckets (sync, pymongo).
+    Live commits only write seq >= 0 and $inc message_count, neither of which is touched here.
+    Returns the number of messages migrated (0 if an inline write raced the migration).
+    """
+    legacy = doc.get("messages") or []
+    if not legacy:
+        return 0
+    if dry_run:
+        return len(legacy)
+
+    session_id = doc.get("session_id")
+    fallback_ts = doc.get("timestamp")
+    messages = [
+        {
+            "role": m.get("role"),
+            "content": m.get("content"),
+            "timestamp": m.get("timestamp") or fallback_ts
+        }
+        for m in legacy
+    ]
+    # Negative seqs belong to the migration alone: clear leftovers of an interrupted run, then rewrite
+    buckets_col.delete_many({"session_id": session_id, "seq": {"$lt": 0}})
+    buckets_col.bulk_write(bucket_updates(session_id, doc.get("userId"), -len(messages), messages), ordered=False)
+
+    # Only drop the inline array if no inline write landed while we were migrating
+    result = chats_col.update_one(
+        {"_id": doc["_id"], "messages": {"$size": len(legacy)}},
+        {"$unset": {"messages": ""}}
+    )
+    if result.modified_count == 0:
+        # The inline array changed: undo, so readers never see these messages twice; a re-run picks it up
+        buckets_col.delete_many({"session_id": session_id, "seq": {"$lt": 0}})
+        logger.warning(f"⚠️ Session {session_id} changed during migration, skipped")
+        return 0
+    return len(legacy)
+
+
+def migrate_all(dry_run: bool = False, limit: Optional[int] = None) -> None:
+    """Migrate every chat_sessions document that still has an inline messages array."""
+    mongo_uri = os.getenv("MONGO_DB_OFFICIAL")
+    db_name = os.getenv("MONGO_DB_NAME_OFFICIAL")
+    if not mongo_uri or not db_name:
+        raise ValueError("MONGO_DB_OFFICIAL and MONGO_DB_NAME_OFFICIAL must be set")
+
+    client = MongoClient(mongo_uri, tls=True, tlsAllowInvalidCertificates=True)
+    try:
+        db = client[db_name]
+        chats_col = db["chat_sessions"]
+        buckets_col = db[BUCKETS_COLLECTION]
+        buckets_col.create_index([("session_id", 1), ("seq", 1)], unique=True)
+        buckets_col.create_index([("userId", 1), ("last_ts", -1)])
+
+        cursor = chats_col.find({"messages.0": {"$exists": True}})
+        if limit:
+            cursor = cursor.limit(limit)
+
+        sessions = 0
+        messages = 0
+        for doc in cursor:
+            moved = migrate_session(chats_col, buckets_col, doc, dry_run=dry_run)
+            sessions += 1
+            messages += moved
+            if sessions % 100 == 0:
+                logger.info(f"🔄 Migrated {sessions} sessions ({messages} messages)")
+
+        action = "Would migrate" if dry_run else "Migrated"
+        logger.info(f"✅ {action} {sessions} sessions ({messages} messages) into {BUCKETS_COLLECTION}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Migrate inline chat_sessions messages into chat_buckets")
+    parser.add_argument("--dry-run", action="store_true", help="Count sessions/messages without writing")
+    parser.add_argument("--limit", type=int, default=None, help="Migrate at most N sessions")
+    args = parser.parse_args()
+    migrate_all(dry_run=args.dry_run, limit=args.limit)
@@ -0,0 +1,127 @@
+"""
+Dataset Retrieval Engine
+BM25 top-k search over the conversation datasets (POS_DATA / NEG_DATA). The term
+matrix is built once at startup and stored column-wise (term → documents with
+precomputed BM25 weights) in flat NumPy arrays, so a query only touches the
+postings of its own terms.
+
+Usage:
+    index = BM25Index(NEG_DATA, fields=["empathic_question", "empathic_response"], filter_fields=["category"])
+    hits = index.search("I can't sleep before exams", k=3, filters={"category": NEG_CATEGORIES})
+    hits = index.search(text, k=3, tokens=features["tokens"])  # Reuse the message's TextFeatures tokens
+"""
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from text_features import tokenize
+
+logger = logging.getLogger("zenark.dataset_index")
+
+
+@dataclass
+class SearchHit:
+    item: Dict[str, Any]
+    score: float
+
+
+class BM25Index:
+    """Okapi BM25 over selected text fields of a list of dataset records"""
+
+    def __init__(
+        self,
+        items: Sequence[Any],
+        fields: Sequence[str],
+        filter_fields: Iterable[str] = (),
+        k1: float = 1.5,
+        b: float = 0.75
+    ):
+        self.items: List[Dict[str, Any]] = [item for item in items if isinstance(item, dict)]
+        self.fields = list(fields)
+        n = len(self.items)
+
+        # Term frequencies per document
+        vocab: Dict[str, int] = {}
+        doc_terms: List[Dict[int, int]] = []
+        lengths = np.zeros(n, dtype=np.float64)
+        for i, item in enumerate(self.items):
+            tf: Dict[int, int] = {}
+            tokens = tokenize(" ".join(v for v in (item.get(f) for f in self.fields) if isinstance(v, str)))
+            for token in tokens:
+                term_id = vocab.setdefault(token, len(vocab))
+                tf[term_id] = tf.get(term_id, 0) + 1
+            doc_terms.append(tf)
+            lengths[i] = len(tokens)
+        self.vocab = vocab
+
+        # Column-major sparse matrix: indptr[t]:indptr[t+1] slices docs/weights for term t
+        rows = np.fromiter((i for i, tf in enumerate(doc_terms) for _ in tf), dtype=np.int32)
+        cols = np.fromiter((t for tf in doc_terms for t in tf), dtype=np.int32)
+        freqs = np.fromiter((c for tf in doc_terms for c in tf.values()), dtype=np.float64)
+        order = np.argsort(cols, kind="stable")
+        rows, cols, freqs = rows[order], cols[order], freqs[order]
+        doc_freq = np.bincount(cols, minlength=len(vocab)).astype(np.float64)
+
+        avg_len = lengths.mean() if n and lengths.mean() > 0 else 1.0
+        idf = np.log(1.0 + (n - doc_freq + 0.5) / (doc_freq + 0.5))
+        norm = k1 * (1.0 - b + b * lengths[rows] / avg_len)
+        self.indptr = np.concatenate([[0], np.cumsum(doc_freq)]).astype(np.int64)
+        self.indices = rows
+        self.weights = idf[cols] * freqs * (k1 + 1.0) / (freqs + norm)
+
+        # Field values for filtering, stored as integer codes per field
+        self._filter_codes: Dict[str, np.ndarray] = {}
+        self._filter_vocab: Dict[str, Dict[str, int]] = {}
+        for f in filter_fields:
+            values: Dict[str, int] = {}
+            self._filter_codes[f] = np.array(
+                [values.setdefault(str(item.get(f, "")), len(values)) for item in self.items], dtype=np.int32
+            )
+            self._filter_vocab[f] = values
+        logger.info(f"📚 BM25 index built: {n} items, {len(vocab)} terms, fields={self.fields}")
+
+    def _mask(self, filters: Dict[str, Any]) -> np.ndarray:
+        mask = np.ones(len(self.items), dtype=bool)
+        for field, allowed in filters.items():
+            codes = self._filter_codes.get(field)
+            if codes is None:
+                raise KeyError(f"Field '{field}' was not indexed for filtering")
+            allowed = {allowed} if isinstance(allowed, str) else set(allowed)
+            vocab = self._filter_vocab[field]
+            keep = np.zeros(len(vocab) + 1, dtype=bool)
+            keep[[vocab[v] for v in allowed if v in vocab]] = True
+            mask &= keep[codes]
+        return mask
+
+    def scores(self, text: str, tokens: Optional[Sequence[str]] = None) -> np.ndarray:
+        scores = np.zeros(len(self.items), dtype=np.float64)
+        query = tokenize(text) if tokens is None else tokens
+        for token in query:  # Repeated query terms count again, as in BM25 query weighting
+            term_id = self.vocab.get(token)
+            if term_id is not None:
+                start, end = self.indptr[term_id], self.indptr[term_id + 1]
+                scores[self.indices[start:end]] += self.weights[start:end]
+        return scores
+
+    def search(
+        self,
+        text: str,
+        k: int = 3,
+        filters: Optional[Dict[str, Any]] = None,
+        tokens: Optional[Sequence[str]] = None
+    ) -> List[SearchHit]:
+        """
+        Top-k matching items (score > 0), best first; `filters` maps field → allowed value(s).
+        `tokens` are the query's precomputed text_features tokens (the text is tokenized otherwise).
+        """
+        if not self.items or k <= 0:
+            return []
+        scores = self.scores(text, tokens)
+        if filters:
+            scores[~self._mask(filters)] = 0.0
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [SearchHit(self.items[i], float(scores[i])) for i in top if scores[i] > 0]
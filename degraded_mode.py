@@ -0,0 +1,139 @@
+"""
+Degraded Response Mode
+When the outbound LLM path is saturated (deep scheduler queue, high call latency
+or every API key cooling down), conversation handlers answer from the curated
+dataset records (empathic_response + next_question) instead of waiting on a
+generation. Routing falls back to regex/emotion rules in the same mode.
+
+Settings (env):
+    DEGRADED_MODE             auto | on | off        (default auto)
+    DEGRADED_MAX_QUEUE_DEPTH  queued LLM requests    (default 50)
+    DEGRADED_MAX_LATENCY_S    p95 LLM call seconds   (default 8)
+    DEGRADED_HOLD_SECONDS     minimum time to stay degraded once tripped (default 30)
+"""
+import os
+import time
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from request_queue import RequestQueue
+
+logger = logging.getLogger("zenark.degraded_mode")
+
+# Short acknowledgement in the user's language (romanized, matching handler guidance)
+LANGUAGE_OPENERS = {
+    'hindi': "Main samajh sakta hoon.",
+    'marathi': "Mala samajtay.",
+    'punjabi': "Main samajh sakda haan.",
+    'bengali': "Ami bujhte parchi.",
+    'gujarati': "Hun samji shaku chhu.",
+    'tamil': "Enakku puriyudhu.",
+    'telugu': "Naaku ardham avutundi.",
+    'kannada': "Nanage arthavaagutte.",
+    'malayalam': "Enikku manassilaakunnu.",
+}
+
+
+class DegradedModeMonitor:
+    """Decides whether handlers should skip the LLM, with a hold period to avoid flapping"""
+
+    def __init__(
+        self,
+        queue: RequestQueue,
+        available_keys: Callable[[], int],
+        mode: str = "auto",
+        max_queue_depth: int = 50,
+        max_latency_s: float = 8.0,
+        hold_seconds: float = 30.0
+    ):
+        self.queue = queue
+        self.available_keys = available_keys
+        self.mode = mode
+        self.max_queue_depth = max_queue_depth
+        self.max_latency_s = max_latency_s
+        self.hold_seconds = hold_seconds
+        self.reason: Optional[str] = None
+        self._until = 0.0
+        self.activations = 0
+        self.degraded_responses = 0
+
+    @classmethod
+    def from_env(cls, queue: RequestQueue, available_keys: Callable[[], int]) -> "DegradedModeMonitor":
+        return cls(
+            queue,
+            available_keys,
+            mode=os.getenv("DEGRADED_MODE", "auto").lower(),
+            max_queue_depth=int(os.getenv("DEGRADED_MAX_QUEUE_DEPTH", "50")),
+            max_latency_s=float(os.getenv("DEGRADED_MAX_LATENCY_S", "8")),
+            hold_seconds=float(os.getenv("DEGRADED_HOLD_SECONDS", "30"))
+        )
+
+    def _trigger(self) -> Optional[str]:
+        depth = self.queue.depth()
+        if depth >= self.max_queue_depth:
+            return f"queue depth {depth}"
+        latency = self.queue.latency_p95()
+        if latency >= self.max_latency_s:
+            return f"p95 latency {latency:.1f}s"
+        try:
+            if self.available_keys() == 0:
+                return "no API keys available"
+        except ValueError:
+            return "no API keys configured"
+        return None
+
+    def active(self) -> bool:
+        if self.mode == "on":
+            self.reason = "forced"
+            return True
+        if self.mode == "off":
+            return False
+        now = time.monotonic()
+        reason = self._trigger()
+        if reason:
+            if now >= self._until:
+                self.activations += 1
+                logger.warning(f"🛟 Degraded mode ON ({reason}): answering from curated dataset responses")
+            self.reason = reason
+            self._until = now + self.hold_seconds
+            return True
+        if self.reason and now >= self._until:
+            logger.info("✅ Degraded mode OFF: LLM path healthy again")
+            self.reason = None
+        return self.reason is not None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "active": self.reason is not None,
+            "reason": self.reason,
+            "activations": self.activations,
+            "degraded_responses": self.degraded_responses,
+            "max_queue_depth": self.max_queue_depth,
+            "max_latency_s": self.max_latency_s
+        }
+
+
+def compose_retrieval_reply(
+    records: Sequence[Dict[str, Any]],
+    text: str,
+    history_snippets: List[str],
+    language: Optional[str] = None
+) -> Optional[str]:
+    """
+    Build a reply from the best retrieved record that was not already used recently.
+    Drops the follow-up question when the user asked one themselves.
+    """
+    recent = " ".join(history_snippets[-10:])
+    for record in records:
+        response = record.get("empathic_response")
+        if not isinstance(response, str) or not response or response in recent:
+            continue
+        parts = [LANGUAGE_OPENERS[language]] if language in LANGUAGE_OPENERS else []
+        parts.append(response)
+        follow_up = record.get("next_question")
+        if isinstance(follow_up, str) and follow_up and not text.rstrip().endswith("?") and follow_up not in recent:
+            parts.append(follow_up)
+        return " ".join(parts)
+    return None
+
@@ -3,12 +3,11 @@ Exam Buddy Module
 Provides specialized study coaching for Indian competitive exams (JEE, NEET, etc.)
 """
 
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, SystemMessagePromptTemplate, HumanMessagePromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from api_key_rotator import get_api_key
+from llm_clients import new_llm
 import logging
 import re
 from typing import Optional, Dict, Any, List
@@ -102,6 +101,7 @@ def get_conversation_summary(conversation: List[Dict[str, Any]]) -> str:
 
         if not formatted:
             return ""
+        transcript = "\n".join(formatted)
 
         # Create a prompt for summarization
         prompt = f"""
@@ -110,7 +110,7 @@ def get_conversation_summary(conversation: List[Dict[str, Any]]) -> str:
         Keep the summary concise but informative (2-3 paragraphs max).
 
         Conversation:
-        {"\n".join(formatted)}
+        {transcript}
 
         Summary:
         """
@@ -203,8 +203,8 @@ def create_exam_buddy_chain():
     Returns:
         RunnableWithMessageHistory chain with guardrails
     """
-    # Initialize LLM with API key rotation
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.7, openai_api_key=get_api_key())
+    # Initialize LLM with API key rotation (or the offline simulator, LLM_PROVIDER=simulator)
+    llm = new_llm("gpt-4o-mini", temperature=0.7)
 
     # Enhanced system prompt with guardrails
     system_prompt = """You are a friendly and knowledgeable study coach specialized in helping Indian teenage students prepare for competitive exams like JEE Main, NEET, IIT, NIT, etc.
@@ -362,11 +362,7 @@ Conversation History:
 Summary:"""
 
         # Get the summary from the LLM
-        llm = ChatOpenAI(
-            temperature=0.3,
-            model_name="gpt-3.5-turbo",
-            openai_api_key=get_api_key()
-        )
+        llm = new_llm("gpt-3.5-turbo", temperature=0.3)
 
         summary = llm.invoke(prompt)
         return summary.content.strip()
@@ -0,0 +1,249 @@
+"""
+Graph Checkpointer
+Checkpointing policy for the compiled LangGraph (GRAPH_CHECKPOINTER env):
+
+    direct   (default) generate_response calls router_node → tool_dispatch directly, like
+             /chat/stream; the graph is still compiled, checkpoint-free, for other callers
+    none     run the compiled graph without a checkpointer. Nothing reads graph checkpoints:
+             every turn passes the full state and conversation state lives in MongoDB.
+    bounded  BoundedMemorySaver: in-memory checkpoints with LRU/TTL eviction of whole
+             threads and byte accounting (for inspecting recent runs while debugging)
+    memory   unbounded MemorySaver (previous behaviour; grows with every session)
+
+Bounded settings (env):
+    CHECKPOINT_MAX_THREADS   (default 1000)
+    CHECKPOINT_MAX_BYTES     serialized bytes across threads (default 64 MB)
+    CHECKPOINT_TTL_SECONDS   idle time before a thread is dropped (default 900)
+
+Per-turn overhead benchmark (same graph shape and state size as /chat):
+    python graph_checkpointer.py bench
+"""
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata
+from langgraph.checkpoint.memory import InMemorySaver, MemorySaver
+
+logger = logging.getLogger("zenark.graph_checkpointer")
+
+
+class _ThreadUsage:
+    __slots__ = ("bytes", "last_used", "blob_keys", "write_sizes")
+
+    def __init__(self):
+        self.bytes = 0
+        self.last_used = time.monotonic()
+        self.blob_keys: Set[Tuple[Any, ...]] = set()
+        self.write_sizes: Dict[Tuple[Any, ...], int] = {}
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    InMemorySaver that forgets whole threads: least recently used first once
+    `max_threads` or `max_bytes` (serialized size) is exceeded, and any thread
+    idle for `ttl_seconds`. Keys are tracked per thread so eviction is O(thread).
+    """
+
+    def __init__(self, max_threads: int = 1000, max_bytes: int = 64 << 20, ttl_seconds: float = 900.0):
+        super().__init__()
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._threads: "OrderedDict[str, _ThreadUsage]" = OrderedDict()
+        self.total_bytes = 0
+        self.evictions = 0
+
+    def _usage(self, thread_id: str) -> _ThreadUsage:
+        usage = self._threads.get(thread_id)
+        if usage is None:
+            usage = self._threads[thread_id] = _ThreadUsage()
+        usage.last_used = time.monotonic()
+        self._threads.move_to_end(thread_id)
+        return usage
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        result = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        usage = self._usage(thread_id)
+        added = 0
+        for channel, version in new_versions.items():
+            key = (thread_id, checkpoint_ns, channel, version)
+            if key not in usage.blob_keys:
+                usage.blob_keys.add(key)
+                added += len(self.blobs[key][1])
+        saved, meta, _ = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+        added += len(saved[1]) + len(meta[1])
+        usage.bytes += added
+        self.total_bytes += added
+        self._enforce(keep=thread_id)
+        return result
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        super().put_writes(config, writes, task_id, task_path)
+        thread_id = config["configurable"]["thread_id"]
+        key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+        usage = self._usage(thread_id)
+        # Writes for a checkpoint can be replaced per task: re-measure that checkpoint's entry
+        size = sum(len(w[2][1]) for w in self.writes.get(key, {}).values())
+        added = size - usage.write_sizes.get(key, 0)
+        usage.write_sizes[key] = size
+        usage.bytes += added
+        self.total_bytes += added
+        self._enforce(keep=thread_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        usage = self._threads.pop(thread_id, None)
+        if usage is None:
+            super().delete_thread(thread_id)
+            return
+        self.storage.pop(thread_id, None)
+        for key in usage.write_sizes:
+            self.writes.pop(key, None)
+        for key in usage.blob_keys:
+            self.blobs.pop(key, None)
+        self.total_bytes -= usage.bytes
+
+    def _enforce(self, keep: str) -> None:
+        """Drop expired threads, then LRU threads while over budget (never the one being written)."""
+        now = time.monotonic()
+        while self._threads:
+            thread_id, usage = next(iter(self._threads.items()))
+            if thread_id == keep:
+                break
+            over_budget = len(self._threads) > self.max_threads or self.total_bytes > self.max_bytes
+            if not over_budget and now - usage.last_used <= self.ttl_seconds:
+                break
+            self.delete_thread(thread_id)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threads": len(self._threads),
+            "bytes": self.total_bytes,
+            "max_threads": self.max_threads,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "evictions": self.evictions
+        }
+
+
+GRAPH_CHECKPOINTER = os.getenv("GRAPH_CHECKPOINTER", "direct").lower()
+
+
+def make_checkpointer(policy: str = GRAPH_CHECKPOINTER) -> Optional[InMemorySaver]:
+    """Checkpointer for graph.compile() according to GRAPH_CHECKPOINTER (None = checkpoint-free)."""
+    if policy == "memory":
+        logger.warning("⚠️ Unbounded MemorySaver: checkpoints are kept for every session until restart")
+        return MemorySaver()
+    if policy == "bounded":
+        return BoundedMemorySaver(
+            max_threads=int(os.getenv("CHECKPOINT_MAX_THREADS", "1000")),
+            max_bytes=int(os.getenv("CHECKPOINT_MAX_BYTES", str(64 << 20))),
+            ttl_seconds=float(os.getenv("CHECKPOINT_TTL_SECONDS", "900"))
+        )
+    if policy not in ("none", "direct"):
+        logger.warning(f"Unknown GRAPH_CHECKPOINTER '{policy}', running checkpoint-free")
+    return None
+
+
+def checkpointer_stats(checkpointer: Optional[InMemorySaver]) -> Dict[str, Any]:
+    if checkpointer is None:
+        return {"policy": "direct" if GRAPH_CHECKPOINTER == "direct" else "none"}
+    if isinstance(checkpointer, BoundedMemorySaver):
+        return {"policy": "bounded", **checkpointer.stats()}
+    return {"policy": "memory", "threads": len(checkpointer.storage)}
+
+
+def _benchmark(turns: int = 2000, sessions: int = 200) -> None:
+    import asyncio
+    import tracemalloc
+    from typing import List
+    from typing_extensions import TypedDict
+    from langgraph.graph import StateGraph, END
+
+    class BenchState(TypedDict):
+        user_text: str
+        selected_tool: str
+        final_output: str
+        debug_info: Dict[str, Any]
+        tool_history: List[str]
+        session_id: str
+        history_snippets: List[str]
+
+    async def router(state: BenchState) -> Dict[str, Any]:
+        return {"selected_tool": "positive_conversation_handler", "debug_info": {"tool": "positive_conversation_handler"}}
+
+    async def executor(state: BenchState) -> Dict[str, Any]:
+        return {"final_output": "That sounds like a really good day. What made it special?"}
+
+    def build(checkpointer: Optional[InMemorySaver]) -> Any:
+        graph = StateGraph(BenchState)
+        graph.add_node("router", router)
+        graph.add_node("tool_executor", executor)
+        graph.set_entry_point("router")
+        graph.add_edge("router", "tool_executor")
+        graph.add_edge("tool_executor", END)
+        return graph.compile(checkpointer=checkpointer)
+
+    snippets = [f"User: message {i} about exams, friends and how the week has been going so far" for i in range(80)]
+
+    def state_for(turn: int) -> Dict[str, Any]:
+        return {
+            "user_text": f"today was good {turn}", "selected_tool": "", "final_output": "", "debug_info": {},
+            "tool_history": ["positive_conversation_handler"] * 10,
+            "session_id": f"s{turn % sessions}", "history_snippets": snippets
+        }
+
+    async def run(graph: Optional[Any]) -> None:
+        for turn in range(turns):
+            state = state_for(turn)
+            if graph is None:
+                state.update(await router(state))  # type: ignore[arg-type]
+                state.update(await executor(state))  # type: ignore[arg-type]
+            else:
+                await graph.ainvoke(state, {"configurable": {"thread_id": state["session_id"]}})
+
+    variants = [
+        ("MemorySaver (current)", lambda: build(MemorySaver())),
+        ("BoundedMemorySaver", lambda: build(BoundedMemorySaver(max_threads=50, max_bytes=8 << 20))),
+        ("no checkpointer", lambda: build(None)),
+        ("direct router→tool", lambda: None),
+    ]
+    print(f"{turns} turns over {sessions} sessions, {len(snippets)} history snippets per state")
+    for name, make_graph in variants:
+        # Timing and memory in separate runs: tracemalloc slows allocation-heavy paths
+        graph = make_graph()
+        start = time.perf_counter()
+        asyncio.run(run(graph))
+        per_turn = (time.perf_counter() - start) / turns * 1e6
+        tracemalloc.start()
+        graph = make_graph()  # Kept alive until measured, like the process-wide compiled_graph
+        asyncio.run(run(graph))
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del graph
+        print(f"{name:>22}: {per_turn:8.1f} µs/turn   retained after run: {retained / 1024:8.0f} KiB")
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        _benchmark()
+    else:
+        print("Usage: python graph_checkpointer.py bench")
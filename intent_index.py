@@ -0,0 +1,135 @@
+"""
+Intent Index
+Compiles the intent datasets once at startup:
+- normalized pattern → intent hash map for exact matches
+- tag → responses map
+- Aho-Corasick automaton over word tokens for whole-word keyword (partial) matches
+
+Lookups cost O(len(text)) regardless of how many patterns the intent files hold.
+"""
+import logging
+from collections import deque
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+from text_features import TextFeatures, normalize as normalize_text, tokenize as word_tokens
+
+logger = logging.getLogger("zenark.intent_index")
+
+
+class TokenAutomaton:
+    """Aho-Corasick automaton whose alphabet is word tokens, so every match is whole-word"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Hashable]] = [[]]
+        self._built = False
+
+    def add(self, tokens: Sequence[str], value: Hashable) -> None:
+        if not tokens:
+            return
+        state = 0
+        for token in tokens:
+            nxt = self._goto[state].get(token)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][token] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(value)
+        self._built = False
+
+    def build(self) -> None:
+        """Compute failure links (BFS) and merge outputs along them."""
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for token, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(token, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+
+    def find_all(self, tokens: Sequence[str]) -> List[Hashable]:
+        """Values of every pattern occurring in `tokens` (in order of match end)."""
+        if not self._built:
+            self.build()
+        found: List[Hashable] = []
+        state = 0
+        for token in tokens:
+            while state and token not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token, 0)
+            if self._out[state]:
+                found.extend(self._out[state])
+        return found
+
+
+class IntentIndex:
+    """Exact + whole-word keyword intent lookup over the empathic and general intent datasets"""
+
+    def __init__(
+        self,
+        empathic_intents: List[Dict[str, Any]],
+        general_intents: List[Dict[str, Any]],
+        keyword_intents: Dict[str, List[str]]
+    ):
+        # Exact matches: first pattern wins (empathic dataset before general, file order within each)
+        self.exact: Dict[str, Dict[str, Any]] = {}
+        for intent_obj in empathic_intents:
+            match = {
+                'dataset': 'empathic',
+                'tag': intent_obj.get('tag', ''),
+                'responses': intent_obj.get('responses', []),
+                'match_type': 'exact'
+            }
+            for pattern in intent_obj.get('patterns', []):
+                self.exact.setdefault(normalize_text(pattern), match)
+        for intent_obj in general_intents:
+            match = {
+                'dataset': 'general',
+                'intent': intent_obj.get('intent', ''),
+                'responses': intent_obj.get('responses', []),
+                'match_type': 'exact'
+            }
+            for pattern in intent_obj.get('text', []):
+                self.exact.setdefault(normalize_text(pattern), match)
+
+        # Partial matches answer with the first empathic intent carrying the keyword's tag
+        self.tag_responses: Dict[str, List[str]] = {}
+        for intent_obj in empathic_intents:
+            self.tag_responses.setdefault(intent_obj.get('tag', ''), intent_obj.get('responses', []))
+
+        self.keyword_tags = list(keyword_intents)
+        self.automaton = TokenAutomaton()
+        for tag, keywords in keyword_intents.items():
+            for keyword in keywords:
+                self.automaton.add(word_tokens(keyword), tag)
+        self.automaton.build()
+        logger.info(f"✅ Intent index built: {len(self.exact)} exact patterns, {len(self.tag_responses)} tags")
+
+    def match(self, user_text: str, features: Optional[TextFeatures] = None) -> Optional[Dict[str, Any]]:
+        """Exact pattern match first, then the highest-priority keyword tag with an empathic intent."""
+        normalized = features["normalized"] if features is not None else normalize_text(user_text)
+        exact = self.exact.get(normalized)
+        if exact is not None:
+            return dict(exact)
+
+        tokens = features["tokens"] if features is not None else word_tokens(user_text)
+        matched_tags = set(self.automaton.find_all(tokens))
+        for tag in self.keyword_tags:
+            if tag in matched_tags and tag in self.tag_responses:
+                return {
+                    'dataset': 'empathic',
+                    'tag': tag,
+                    'responses': self.tag_responses[tag],
+                    'match_type': 'partial'
+                }
+        return None
@@ -0,0 +1,382 @@
+"""
+Local Intent Router
+Hashed word n-gram features + multinomial logistic regression (NumPy only) that
+predicts the routing tool for a message. Router uses it to skip the router LLM
+call when the prediction is confident, and falls back to the LLM otherwise.
+
+Training data (user-side messages only, so the model learns intent rather than phrasing style):
+- Router decisions logged by the LLM router in the `router_decisions` collection
+- Curated labels: JSONL lines {"text": <user message>, "tool": <tool>} (INTENT_ROUTER_LABELS)
+- The user patterns of the intent datasets, as a small seed
+
+Precision is measured on held-out real traffic (logged decisions and curated labels,
+never the seed patterns) and stored in the model file. The router only bypasses the
+LLM when that precision, at a threshold no lower than the serving threshold, meets
+INTENT_ROUTER_MIN_PRECISION over at least INTENT_ROUTER_MIN_EVAL_EXAMPLES messages;
+otherwise the model stays disabled and every message goes to the LLM.
+
+The router is off unless INTENT_ROUTER_ENABLED=true. No model ships with the repo:
+the bundled datasets hold only a handful of user-side messages, so a model that
+passes the gate needs router decisions logged from real traffic (LOG_ROUTER_DECISIONS)
+or curated labels. Until then every non-safety turn still calls the router LLM.
+
+Train offline and write the model file loaded at startup:
+    python intent_router.py train [--model models/intent_router.npz] [--labels FILE] [--no-logs]
+"""
+
+import os
+import re
+import json
+import zlib
+import argparse
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("zenark.intent_router")
+
+ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "false").lower() == "true"
+DEFAULT_MODEL_PATH = os.getenv("INTENT_ROUTER_MODEL", "models/intent_router.npz")
+DEFAULT_THRESHOLD = float(os.getenv("INTENT_ROUTER_THRESHOLD", "0.85"))
+DEFAULT_LABELS_PATH = os.getenv("INTENT_ROUTER_LABELS", "dataset/intent_router_labels.jsonl")
+MIN_PRECISION = float(os.getenv("INTENT_ROUTER_MIN_PRECISION", "0.97"))
+MIN_EVAL_EXAMPLES = int(os.getenv("INTENT_ROUTER_MIN_EVAL_EXAMPLES", "500"))
+FEATURE_DIM = 1 << 16
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def featurize(text: str, dim: int = FEATURE_DIM) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hashed unigram+bigram features with sublinear counts, L2-normalised.
+    crc32 keeps feature indices identical across processes (unlike hash()).
+    """
+    tokens = _TOKEN_RE.findall(text.lower())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    if not grams:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    hashed = np.fromiter((zlib.crc32(g.encode("utf-8")) % dim for g in grams), dtype=np.int64, count=len(grams))
+    idx, counts = np.unique(hashed, return_counts=True)
+    vals = 1.0 + np.log(counts.astype(np.float64))
+    vals /= np.linalg.norm(vals)
+    return idx, vals
+
+
+@dataclass
+class RoutePrediction:
+    tool: str
+    confidence: float
+
+
+@dataclass
+class HeldOutEval:
+    """Held-out result on real user traffic, recorded at training time"""
+    precision: float
+    coverage: float
+    examples: int
+    threshold: float
+
+
+class IntentRouterModel:
+    """Multinomial logistic regression over hashed features"""
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, classes: Sequence[str], dim: int = FEATURE_DIM,
+                 evaluation: Optional[HeldOutEval] = None):
+        self.weights = weights
+        self.bias = bias
+        self.classes = list(classes)
+        self.dim = dim
+        self.evaluation = evaluation
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        idx, vals = featurize(text, self.dim)
+        logits = vals @ self.weights[idx] + self.bias
+        logits -= logits.max()
+        exp = np.exp(logits)
+        return exp / exp.sum()
+
+    def predict(self, text: str) -> RoutePrediction:
+        proba = self.predict_proba(text)
+        best = int(np.argmax(proba))
+        return RoutePrediction(tool=self.classes[best], confidence=float(proba[best]))
+
+    @classmethod
+    def fit(
+        cls,
+        texts: Sequence[str],
+        labels: Sequence[str],
+        sample_weights: Optional[Sequence[float]] = None,
+        dim: int = FEATURE_DIM,
+        epochs: int = 150,
+        lr: float = 0.05,
+        l2: float = 1e-5
+    ) -> "IntentRouterModel":
+        """Full-batch Adam on the softmax cross-entropy, computed sparsely."""
+        rows = [(featurize(t, dim), label, w) for t, label, w in
+                zip(texts, labels, sample_weights or [1.0] * len(texts))]
+        rows = [r for r in rows if len(r[0][0])]  # Drop texts with no tokens
+        if not rows:
+            raise ValueError("No trainable examples")
+        classes = sorted({label for _, label, _ in rows})
+        class_index = {c: i for i, c in enumerate(classes)}
+        n, k = len(rows), len(classes)
+
+        lengths = np.array([len(r[0][0]) for r in rows])
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        all_idx = np.concatenate([r[0][0] for r in rows])
+        all_val = np.concatenate([r[0][1] for r in rows])
+        row_of_nnz = np.repeat(np.arange(n), lengths)
+        y = np.zeros((n, k))
+        y[np.arange(n), [class_index[r[1]] for r in rows]] = 1.0
+        w = np.array([r[2] for r in rows], dtype=np.float64)
+        # Balance classes so the large negative dataset does not dominate the prior
+        class_mass = y.T @ w
+        w /= (y @ class_mass) * k
+
+        weights = np.zeros((dim, k))
+        bias = np.zeros(k)
+        m_w, v_w = np.zeros_like(weights), np.zeros_like(weights)
+        m_b, v_b = np.zeros_like(bias), np.zeros_like(bias)
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+
+        for step in range(1, epochs + 1):
+            logits = np.add.reduceat(all_val[:, None] * weights[all_idx], offsets, axis=0) + bias
+            logits -= logits.max(axis=1, keepdims=True)
+            proba = np.exp(logits)
+            proba /= proba.sum(axis=1, keepdims=True)
+            grad_rows = (proba - y) * w[:, None]
+
+            grad_w = l2 * weights
+            np.add.at(grad_w, all_idx, all_val[:, None] * grad_rows[row_of_nnz])
+            grad_b = grad_rows.sum(axis=0)
+
+            m_w = beta1 * m_w + (1 - beta1) * grad_w
+            v_w = beta2 * v_w + (1 - beta2) * grad_w ** 2
+            m_b = beta1 * m_b + (1 - beta1) * grad_b
+            v_b = beta2 * v_b + (1 - beta2) * grad_b ** 2
+            correction1, correction2 = 1 - beta1 ** step, 1 - beta2 ** step
+            weights -= lr * (m_w / correction1) / (np.sqrt(v_w / correction2) + eps)
+            bias -= lr * (m_b / correction1) / (np.sqrt(v_b / correction2) + eps)
+
+        return cls(weights.astype(np.float32), bias.astype(np.float32), classes, dim)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = dict(weights=self.weights, bias=self.bias, classes=np.array(self.classes), dim=np.array(self.dim))
+        if self.evaluation is not None:
+            e = self.evaluation
+            arrays["evaluation"] = np.array([e.precision, e.coverage, e.examples, e.threshold], dtype=np.float64)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "IntentRouterModel":
+        data = np.load(path, allow_pickle=False)
+        evaluation = None
+        if "evaluation" in data.files:
+            precision, coverage, examples, threshold = (float(v) for v in data["evaluation"])
+            evaluation = HeldOutEval(precision, coverage, int(examples), threshold)
+        return cls(data["weights"], data["bias"], [str(c) for c in data["classes"]], int(data["dim"]), evaluation)
+
+
+def validated(evaluation: Optional[HeldOutEval], threshold: float) -> Tuple[bool, str]:
+    """Whether a model's held-out result on real traffic allows it to bypass the LLM at `threshold`."""
+    if evaluation is None:
+        return False, "no held-out evaluation on real traffic"
+    if evaluation.examples < MIN_EVAL_EXAMPLES:
+        return False, f"only {evaluation.examples} held-out real messages (< {MIN_EVAL_EXAMPLES})"
+    if threshold < evaluation.threshold:
+        return False, f"serving threshold {threshold} is below the evaluated {evaluation.threshold}"
+    if evaluation.precision < MIN_PRECISION:
+        return False, f"held-out precision {evaluation.precision:.1%} < {MIN_PRECISION:.1%}"
+    return True, "validated"
+
+
+class IntentRouter:
+    """Confidence-gated wrapper used by Router: returns a tool only when the model is sure"""
+
+    def __init__(self, model: Optional[IntentRouterModel], threshold: float = DEFAULT_THRESHOLD, enabled: bool = ENABLED):
+        self.model = model
+        self.threshold = threshold
+        if not enabled:
+            self.active, self.reason = False, "INTENT_ROUTER_ENABLED is off"
+        elif model is None:
+            self.active, self.reason = False, "no model"
+        else:
+            self.active, self.reason = validated(model.evaluation, threshold)
+        self.confident = 0
+        self.deferred = 0
+
+    @classmethod
+    def from_path(cls, path: str = DEFAULT_MODEL_PATH, threshold: float = DEFAULT_THRESHOLD) -> "IntentRouter":
+        """Load the trained model if present; without one every message defers to the LLM."""
+        model = None
+        if not ENABLED:
+            logger.info("Local intent router disabled: INTENT_ROUTER_ENABLED is off")
+            return cls(None, threshold)
+        if os.path.exists(path):
+            try:
+                model = IntentRouterModel.load(path)
+            except Exception as e:
+                logger.warning(f"Failed to load intent router model {path}: {e}")
+        else:
+            logger.info(f"Local intent router disabled: no model at {path}")
+        router = cls(model, threshold)
+        if model is not None and router.active:
+            logger.info(f"✅ Local intent router loaded ({len(model.classes)} tools, threshold {threshold})")
+        elif model is not None:
+            logger.warning(f"⚠️ Local intent router disabled: {router.reason}")
+        return router
+
+    def route(self, text: str) -> Optional[RoutePrediction]:
+        """Confident prediction, or None when the text is ambiguous (caller asks the LLM)."""
+        if self.model is None or not self.active:
+            return None
+        prediction = self.model.predict(text)
+        if prediction.confidence >= self.threshold:
+            self.confident += 1
+            return prediction
+        self.deferred += 1
+        return None
+
+    def stats(self) -> Dict[str, object]:
+        total = self.confident + self.deferred
+        evaluation = self.model.evaluation if self.model is not None else None
+        return {
+            "enabled": self.active,
+            "reason": self.reason,
+            "held_out": vars(evaluation) if evaluation is not None else None,
+            "threshold": self.threshold,
+            "confident": self.confident,
+            "deferred_to_llm": self.deferred,
+            "coverage": round(self.confident / total, 4) if total else 0.0
+        }
+
+
+# ===================================================
+# TRAINING DATA
+# ===================================================
+
+def _load_json(path: str, key: str) -> list:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)[key]
+    except FileNotFoundError:
+        logger.warning(f"{path} not found")
+        return []
+
+
+def build_seed_examples() -> List[Tuple[str, str, float]]:
+    """
+    (text, tool, weight) seed examples: the user patterns of the intent datasets.
+    Bot-authored text (combined_dataset.json empathic questions) and conversation
+    contexts (positive_conversation.json) are not used: they teach phrasing style,
+    not what a student's message is asking for.
+    """
+    examples: List[Tuple[str, str, float]] = []
+    intent_tools = {"exam_stress": "exam_tips_tool", "general": "llm_generate", "anxiety": "negative_conversation_handler"}
+    for path in ("dataset/Intent.json", "dataset/combined_intents_empathic.json"):
+        for intent in _load_json(path, "intents"):
+            tool = intent_tools.get(intent.get("tag"))
+            if tool:
+                examples.extend((pattern, tool, 1.0) for pattern in intent.get("patterns", []))
+    return examples
+
+
+def load_curated_labels(path: str = DEFAULT_LABELS_PATH) -> List[Tuple[str, str, float]]:
+    """(text, tool, weight) from reviewed JSONL labels of real user messages."""
+    if not os.path.exists(path):
+        logger.warning(f"{path} not found; training without curated labels")
+        return []
+    examples: List[Tuple[str, str, float]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                if item.get("text") and item.get("tool"):
+                    examples.append((item["text"], item["tool"], 3.0))
+    return examples
+
+
+def load_logged_decisions(limit: int = 200000) -> List[Tuple[str, str, float]]:
+    """(text, tool, weight) examples from decisions logged by the LLM router."""
+    from pymongo import MongoClient
+
+    mongo_uri = os.getenv("MONGO_DB_OFFICIAL")
+    db_name = os.getenv("MONGO_DB_NAME_OFFICIAL")
+    if not mongo_uri or not db_name:
+        logger.warning("MONGO_DB_OFFICIAL/MONGO_DB_NAME_OFFICIAL not set; skipping logged decisions")
+        return []
+    client = MongoClient(mongo_uri, tls=True, tlsAllowInvalidCertificates=True)
+    try:
+        cursor = client[db_name]["router_decisions"].find(
+            {"source": "llm"}, {"text": 1, "tool": 1}
+        ).sort("timestamp", -1).limit(limit)
+        # Real traffic labelled by the LLM router outweighs the dataset proxies
+        return [(d["text"], d["tool"], 3.0) for d in cursor if d.get("text") and d.get("tool")]
+    finally:
+        client.close()
+
+
+def evaluate(model: IntentRouterModel, rows: Sequence[Tuple[str, str, float]], threshold: float) -> HeldOutEval:
+    correct = covered = 0
+    for text, label, _ in rows:
+        prediction = model.predict(text)
+        if prediction.confidence >= threshold:
+            covered += 1
+            correct += prediction.tool == label
+    return HeldOutEval(
+        precision=correct / covered if covered else 0.0,
+        coverage=covered / len(rows) if rows else 0.0,
+        examples=len(rows),
+        threshold=threshold
+    )
+
+
+def train(
+    model_path: str = DEFAULT_MODEL_PATH,
+    use_logs: bool = True,
+    threshold: float = DEFAULT_THRESHOLD,
+    labels_path: str = DEFAULT_LABELS_PATH
+) -> None:
+    seed = build_seed_examples()
+    real = load_curated_labels(labels_path) + (load_logged_decisions() if use_logs else [])
+
+    # Only real user traffic is held out: precision on dataset patterns says nothing about /chat
+    rng = np.random.default_rng(7)
+    order = rng.permutation(len(real))
+    split = int(len(order) * 0.8)
+    train_rows = seed + [real[i] for i in order[:split]]
+    test_rows = [real[i] for i in order[split:]]
+
+    model = IntentRouterModel.fit([t for t, _, _ in train_rows], [l for _, l, _ in train_rows], [w for _, _, w in train_rows])
+    evaluation = evaluate(model, test_rows, threshold)
+    logger.info(
+        f"📊 Held-out real traffic: coverage {evaluation.coverage:.1%} at threshold {threshold}, "
+        f"precision {evaluation.precision:.1%} ({evaluation.examples} messages)"
+    )
+
+    examples = seed + real
+    final = IntentRouterModel.fit([t for t, _, _ in examples], [l for _, l, _ in examples], [w for _, _, w in examples])
+    final.evaluation = evaluation
+    final.save(model_path)
+    logger.info(f"✅ Saved intent router ({len(examples)} examples, tools: {final.classes}) to {model_path}")
+    active, reason = validated(evaluation, threshold)
+    if not active:
+        logger.warning(f"⚠️ This model will stay disabled when served: {reason}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Train the local intent router")
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Output model path")
+    parser.add_argument("--labels", default=DEFAULT_LABELS_PATH, help="Curated JSONL labels of real user messages")
+    parser.add_argument("--no-logs", action="store_true", help="Skip logged router decisions")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Confidence threshold for the held-out report")
+    args = parser.parse_args()
+    train(model_path=args.model, use_logs=not args.no_logs, threshold=args.threshold, labels_path=args.labels)
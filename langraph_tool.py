@@ -22,23 +22,26 @@ from contextlib import asynccontextmanager
 from bson import ObjectId
 from typing_extensions import TypedDict
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from langgraph.graph import StateGraph, END
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage, HumanMessage, BaseMessage
 from langchain_core.tools import tool
+from langchain_core.runnables import RunnableConfig
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_community.chat_message_histories import ChatMessageHistory
 from dataclasses import dataclass
-from typing import List, Dict, Optional, Any, cast
+from typing import List, Dict, Optional, Any, AsyncIterator, AbstractSet, Callable, Tuple, cast
 import json
 from functools import wraps
-from langgraph.checkpoint.memory import MemorySaver
 from dotenv import load_dotenv
 import uuid
 import logging
 import datetime
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+import time
+from collections import OrderedDict
+from fastapi import FastAPI, Request, HTTPException, Header
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi import FastAPI, HTTPException
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
@@ -49,19 +52,37 @@ import uuid
 import base64
 from pydantic import BaseModel
 import uvicorn
-from aiocache import Cache, cached
 import numpy as np
 from Guideliness import action_scoring_guidelines
-from autogen_report import generate_autogen_report
-from api_key_rotator import get_api_key
+from autogen_report import agenerate_autogen_report
+from api_key_rotator import get_key_pool
+from llm_clients import LLM_PROVIDER, get_llm, llm_registry, provider_stats
+from request_queue import Priority, llm_priority, openai_queue
+from chat_buckets import BUCKETS_COLLECTION, bucket_updates, load_session_messages
+from intent_router import IntentRouter
+from dataset_index import BM25Index
+from degraded_mode import DegradedModeMonitor, compose_retrieval_reply
+from rule_engine import RuleEngine
+from intent_index import IntentIndex, normalize_text
+from text_features import TextFeatures, text_features, tokenize
+import student_memory
+from pipeline_stages import run_stage, stage_stats, timed_stage
+from graph_checkpointer import GRAPH_CHECKPOINTER, checkpointer_stats, make_checkpointer
+from single_flight import Completed, SingleFlight, request_key
+from metrics import (
+    CACHE_LOOKUPS, CHAT_REQUEST_SECONDS, MONGO_WRITE_SECONDS, ROUTING_SECONDS,
+    TOOL_SECONDS, TOOL_SELECTIONS, render as render_metrics
+)
+from cache_backend import L1_TTL_SECONDS, TieredCache, close_caches, namespace_stats, shared_l2
 from exam_buddy import get_exam_buddy_response
 # Journaling Module
 from journaling import router as journaling_router, init_journaling_db
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Init in-memory cache for token savings (TTL: 10 min, scalable with horizontal if needed)
-cache = Cache(Cache.MEMORY)
+# Two-tier caches (per-worker L1 + shared L2 from CACHE_L2_URL), namespaced per use
+response_cache = TieredCache.shared("response", ttl=600)  # generate_response replies (token savings)
+analytics_cache = TieredCache.shared("analytics", ttl=float(os.getenv("ANALYTICS_CACHE_TTL_SECONDS", "60")))
 
 logger = logging.getLogger("zenark.routes")
 # ============================================================
@@ -112,17 +133,16 @@ def safe_json(o):
 @dataclass
 class Config:
     """Centralized configuration with validation"""
-    openai_key: str = os.getenv('OPENAI_API_KEY', '')
+    openai_key: str = os.getenv('OPENAI_API_KEY', '') or os.getenv('OPENAI_API_KEYS', '')
     hf_token: str = os.getenv('HF_TOKEN', '')
     mongo_uri: str = os.getenv('MONGO_DB_OFFICIAL', '')
     
     def validate(self) -> List[str]:
         """Return list of missing required env vars"""
         missing = []
-        required = {
-            'OPENAI_API_KEY': self.openai_key,
-            'MONGO_URI': self.mongo_uri
-        }
+        required = {'MONGO_URI': self.mongo_uri}
+        if LLM_PROVIDER != "simulator":  # The simulator draws synthetic keys (api_key_rotator)
+            required['OPENAI_API_KEY'] = self.openai_key
         for key, value in required.items():
             if not value:
                 missing.append(key)
@@ -133,21 +153,22 @@ MISSING_ENVS = CONFIG.validate()
 if MISSING_ENVS:
     raise ValueError(f"Missing required environment variables: {MISSING_ENVS}")
 
-llm_exam = ChatOpenAI(model="gpt-4o-mini", temperature=0, openai_api_key=get_api_key())
 
 # Global MongoDB setup (initialized at startup)
 client: Optional[AsyncIOMotorClient] = None
 chats_col: Optional[AsyncIOMotorCollection] = None
 marks_col: Optional[AsyncIOMotorCollection] = None
-router_memory_col: Optional[AsyncIOMotorCollection] = None  # NEW: Router memory collection
+student_memory_col: Optional[AsyncIOMotorCollection] = None  # Per-student router LTM (one document per student)
 reports_col: Optional[AsyncIOMotorCollection] = None  # NEW: Reports collection
+chat_buckets_col: Optional[AsyncIOMotorCollection] = None  # Fixed-size message buckets per session
+router_decisions_col: Optional[AsyncIOMotorCollection] = None  # LLM router decisions (intent router training data)
 
 # Global graph (compiled once at startup for scalability)
 compiled_graph = None
 
 async def init_db() -> None:
     """Initialize MongoDB collections asynchronously using Motor (called at startup)."""
-    global client, chats_col, marks_col, router_memory_col,reports_col
+    global client, chats_col, marks_col, student_memory_col,reports_col, chat_buckets_col, router_decisions_col
     try:
         # Motor uses built-in connection pooling for high concurrency (1M+ users)
         client = AsyncIOMotorClient(CONFIG.mongo_uri, maxPoolSize=200, minPoolSize=10, tls=True,
@@ -157,16 +178,19 @@ async def init_db() -> None:
         chats_col = db["chat_sessions"]
         marks_col = db["student_marks"]
         reports_col = db["reports"]
-        router_memory_col = db["router_memory"]  # NEW: Router memory collection
+        student_memory_col = db[student_memory.STUDENT_MEMORY_COLLECTION]  # Keyed by _id = student_id
+        chat_buckets_col = db[BUCKETS_COLLECTION]
+        router_decisions_col = db["router_decisions"]
 
         # Create indexes for fast queries (O(1) lookups for sessions/marks)
         await chats_col.create_index([("session_id", 1)], unique=True, sparse=True)
+        await chats_col.create_index([("userId", 1), ("timestamp", -1)])  # Cross-session history lookups
+        await chat_buckets_col.create_index([("session_id", 1), ("seq", 1)], unique=True)
+        await chat_buckets_col.create_index([("userId", 1), ("last_ts", -1)])
         await marks_col.create_index([("_id", 1)])
-        await router_memory_col.create_index([("session_id", 1)])
-        await router_memory_col.create_index([("student_id", 1)])
-        await router_memory_col.create_index([("session_id", 1), ("student_id", 1)], unique=True)
         await reports_col.create_index([("userId", 1)])
         await reports_col.create_index([("timestamp", 1)])
+        await router_decisions_col.create_index([("source", 1), ("timestamp", -1)])
 
         # Initialize journaling database
         await init_journaling_db(client, DB_NAME)
@@ -184,20 +208,121 @@ async def lifespan(app: FastAPI):
     await init_db() 
     global compiled_graph 
     compiled_graph = build_graph() 
+    router_memory_store.start()  # Batched router memory writes
     logging.info("Zenark API started - Ready for production scale.")
     yield
     # -------------------------------------------
     # SHUTDOWN
     # -------------------------------------------
+    await router_memory_store.stop()  # Flush pending router memory deltas before closing Mongo
     if client:
         client.close()
-    await cache.close()  # Close cache on shutdown
+    await close_caches()  # Close cache backends on shutdown
     logging.info("Zenark API shutdown complete.")
 
+class HistoryCache:
+    """
+    Bounded in-process LRU cache of each student's recent cross-session messages.
+    Entries are written through on every append and expire after `ttl_seconds` idle,
+    so bursts of messages from an active student never go back to MongoDB for history.
+    With a shared L2, `max_age_seconds` also expires entries by age, since another
+    worker may have appended to the student's history in the meantime.
+    """
+
+    def __init__(
+        self,
+        max_users: int = 5000,
+        ttl_seconds: float = 900.0,
+        window: int = 50,
+        max_age_seconds: Optional[float] = None
+    ):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.window = window  # Messages kept per student (matches the history load limit)
+        self.max_age_seconds = max_age_seconds
+        self._entries: "OrderedDict[str, tuple[List[BaseMessage], float, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, student_id: str) -> Optional[List[BaseMessage]]:
+        """Return a copy of the cached messages (oldest first) or None on miss/expiry."""
+        entry = self._entries.get(student_id)
+        now = time.monotonic()
+        expired = entry is not None and (
+            now - entry[1] > self.ttl_seconds
+            or (self.max_age_seconds is not None and now - entry[2] > self.max_age_seconds)
+        )
+        if entry is None or expired:
+            if entry is not None:
+                del self._entries[student_id]
+                self.evictions += 1
+            self.misses += 1
+            CACHE_LOOKUPS.labels(namespace="history_worker", result="miss").inc()
+            return None
+        self._entries[student_id] = (entry[0], now, entry[2])
+        self._entries.move_to_end(student_id)
+        self.hits += 1
+        CACHE_LOOKUPS.labels(namespace="history_worker", result="l1_hit").inc()
+        return list(entry[0])
+
+    def put(self, student_id: str, messages: List[BaseMessage]) -> None:
+        """Store the newest `window` messages for a student, evicting the LRU entry if full."""
+        now = time.monotonic()
+        self._entries[student_id] = (list(messages[-self.window:]), now, now)
+        self._entries.move_to_end(student_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def append(self, student_id: str, message: BaseMessage) -> None:
+        """Write-through: extend a cached entry (no-op if the student is not cached)."""
+        entry = self._entries.get(student_id)
+        if entry is None:
+            return
+        messages = entry[0]
+        messages.append(message)
+        if len(messages) > self.window:
+            del messages[:-self.window]
+        self._entries[student_id] = (messages, time.monotonic(), entry[2])
+        self._entries.move_to_end(student_id)
+
+    def invalidate(self, student_id: str) -> None:
+        self._entries.pop(student_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_users": self.max_users,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
 class AsyncMongoChatMemory:
-    def __init__(self, session_id: str, chats_col: AsyncIOMotorCollection, student_id: Optional[str] = None):
+    # Process-wide history cache shared by all instances in this worker
+    history_cache = HistoryCache(
+        max_users=int(os.getenv("HISTORY_CACHE_MAX_USERS", "5000")),
+        ttl_seconds=float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "900")),
+        max_age_seconds=L1_TTL_SECONDS if shared_l2() is not None else None
+    )
+    # Shared L2 copy of the same window as {"role", "content"} items, appended by every worker
+    history_l2 = TieredCache.shared("history", ttl=float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "900")))
+
+    def __init__(
+        self,
+        session_id: str,
+        chats_col: AsyncIOMotorCollection,
+        student_id: Optional[str] = None,
+        buckets_col: Optional[AsyncIOMotorCollection] = None
+    ):
         """
         Initialize async MongoDB chat memory for session persistence.
+        Messages live in chat_buckets; sessions not yet migrated may still carry an inline
+        `messages` array, which every reader merges in front of the bucketed messages.
         Note: History loading is done explicitly via _load_existing_chats_no_session() in the endpoint
         """
         self.session_id = session_id
@@ -205,11 +330,16 @@ class AsyncMongoChatMemory:
         self.history = ChatMessageHistory()
         self.tool_history: List[str] = []
         self.chats_col = chats_col
+        self.buckets_col = buckets_col if buckets_col is not None else chat_buckets_col
+        # Turn buffer: staged messages/tools are written together by commit_turn()
+        self._pending_messages: List[Dict[str, Any]] = []
+        self._pending_tools: List[str] = []
         # DO NOT auto-load here - we explicitly call _load_existing_chats_no_session() in the endpoint
 
-    async def _load_existing(self) -> None:
+    async def _load_existing(self, max_chars: Optional[int] = None) -> None:
         """
         Load existing chat history and tool history from MongoDB asynchronously.
+        With max_chars, only the leading buckets needed to cover that much content are read.
         """
         try:
             # Build query with ObjectId conversion for userId
@@ -223,61 +353,151 @@ class AsyncMongoChatMemory:
             
             doc: Optional[Dict[str, Any]] = await self.chats_col.find_one(query)
             if doc:
-                if "messages" in doc:
-                    for msg in doc["messages"]:
-                        if msg.get("role") == "user":
-                            self.history.add_user_message(msg["content"])
-                        elif msg.get("role") == "assistant":
-                            self.history.add_ai_message(msg["content"])
+                for msg in await self.load_session_messages(doc, max_chars=max_chars):
+                    if msg.get("role") == "user":
+                        self.history.add_user_message(msg["content"])
+                    elif msg.get("role") == "assistant":
+                        self.history.add_ai_message(msg["content"])
                 if "tool_history" in doc:
                     self.tool_history = doc["tool_history"]
         except Exception as e:
             logging.warning(f"Failed to load chat history for session {self.session_id}: {e}")
 
+    async def load_session_messages(
+        self,
+        session_doc: Dict[str, Any],
+        max_chars: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Return this session's messages in order: legacy inline messages first, then buckets by seq.
+        Stops fetching buckets once `max_chars` of content has been collected.
+        """
+        return await load_session_messages(
+            self.buckets_col, {**session_doc, "session_id": self.session_id}, max_chars=max_chars
+        )
+
+    def _user_filter(self) -> Dict[str, Any]:
+        """Match this user's sessions whether userId was stored as ObjectId or string."""
+        if not self.student_id:
+            return {}
+        try:
+            # Try both ObjectId and string formats
+            return {
+                "$or": [
+                    {"userId": ObjectId(self.student_id)},
+                    {"userId": self.student_id}
+                ]
+            }
+        except Exception:
+            # Fallback to string only if ObjectId conversion fails
+            return {"userId": self.student_id}
 
-    async def _load_existing_chats_no_session(self) -> None:
+    @staticmethod
+    def _recent_messages_pipeline(query: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
         """
-        Load ALL chat history for this user from ALL sessions, ignoring session_id.
+        Aggregation returning only the newest `limit` messages across all matched sessions,
+        oldest first. Each session is trimmed to its own last `limit` messages before the
+        unwind, so the work is bounded by sessions * limit rather than total message count.
+        """
+        return [
+            {"$match": {**query, "messages.0": {"$exists": True}}},
+            {"$project": {
+                "_id": 0,
+                "session_ts": "$timestamp",
+                "messages": {"$slice": [{"$ifNull": ["$messages", []]}, -limit]}
+            }},
+            {"$unwind": {"path": "$messages", "includeArrayIndex": "idx"}},
+            # Newest first so $limit keeps the tail; ties broken by session then array order
+            {"$sort": {"messages.timestamp": -1, "session_ts": -1, "idx": -1}},
+            {"$limit": limit},
+            {"$sort": {"messages.timestamp": 1, "session_ts": 1, "idx": 1}},
+            {"$project": {
+                "role": "$messages.role",
+                "content": "$messages.content",
+                "timestamp": "$messages.timestamp"
+            }}
+        ]
+
+    @staticmethod
+    def _recent_bucket_messages_pipeline(query: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
+        """
+        Bucketed counterpart of _recent_messages_pipeline: every bucket holds at least one
+        message, so the newest `limit` buckets (by last_ts) always cover the newest `limit` messages.
+        """
+        return [
+            {"$match": query},
+            {"$sort": {"last_ts": -1}},
+            {"$limit": limit},
+            {"$project": {"_id": 0, "messages": {"$slice": ["$messages", -limit]}}},
+            {"$unwind": "$messages"},
+            {"$sort": {"messages.timestamp": -1, "messages.i": -1}},
+            {"$limit": limit},
+            {"$sort": {"messages.timestamp": 1, "messages.i": 1}},
+            {"$project": {
+                "role": "$messages.role",
+                "content": "$messages.content",
+                "timestamp": "$messages.timestamp"
+            }}
+        ]
+
+    async def _query_recent_messages(self, limit: int) -> List[Dict[str, Any]]:
+        """Newest `limit` messages across bucketed and legacy inline sessions, oldest first."""
+        query = self._user_filter()
+        reads = [self.chats_col.aggregate(self._recent_messages_pipeline(query, limit)).to_list(length=None)]
+        if self.buckets_col is not None:
+            reads.append(
+                self.buckets_col.aggregate(self._recent_bucket_messages_pipeline(query, limit)).to_list(length=None)
+            )
+        results = await asyncio.gather(*reads)
+        merged = [msg for result in results for msg in result]
+        if len(results) > 1 and results[0] and results[1]:
+            merged.sort(key=lambda m: m.get("timestamp") or datetime.datetime.min)
+        return merged[-limit:]
+
+    async def _load_existing_chats_no_session(self, limit: int = 50) -> None:
+        """
+        Load the newest `limit` messages for this user from ALL sessions, ignoring session_id.
         This ensures memory persists across different session_ids.
+        Selection and ordering run server-side, so latency stays flat as history grows.
         """
+        cache = AsyncMongoChatMemory.history_cache
+        use_cache = bool(self.student_id) and limit <= cache.window
+        if use_cache:
+            cached_messages = cache.get(self.student_id)
+            if cached_messages is not None:
+                for msg in cached_messages[-limit:]:
+                    self.history.add_message(msg)
+                logging.info(f"⚡ History cache hit for user {self.student_id}: {len(self.history.messages)} messages")
+                return
+            shared_messages = await AsyncMongoChatMemory.history_l2.get_list(self.student_id)
+            if shared_messages is not None:
+                loaded = ChatMessageHistory()
+                for msg in shared_messages:
+                    if msg.get("role") == "user":
+                        loaded.add_user_message(msg["content"])
+                    elif msg.get("role") == "assistant":
+                        loaded.add_ai_message(msg["content"])
+                cache.put(self.student_id, loaded.messages)
+                for msg in loaded.messages[-limit:]:
+                    self.history.add_message(msg)
+                logging.info(f"⚡ Shared history cache hit for user {self.student_id}: {len(self.history.messages)} messages")
+                return
+
         try:
-            # Build query with ObjectId conversion for userId
-            query = {}
-            if self.student_id:
-                try:
-                    # Try both ObjectId and string formats
-                    query = {
-                        "$or": [
-                            {"userId": ObjectId(self.student_id)},
-                            {"userId": self.student_id}
-                        ]
-                    }
-                except Exception:
-                    # Fallback to string only if ObjectId conversion fails
-                    query = {"userId": self.student_id}
-            
-            # Find ALL documents for this user, sorted by timestamp
-            # Use find() instead of find_one() to get all sessions
-            cursor = self.chats_col.find(query).sort("timestamp", 1)  # Ascending order (oldest first)
-            
-            # Collect all messages from all sessions
-            all_messages = []
-            async for doc in cursor:
-                if "messages" in doc:
-                    for msg in doc["messages"]:
-                        # Add timestamp to each message for sorting
-                        msg_with_time = {
-                            "role": msg.get("role"),
-                            "content": msg.get("content"),
-                            "timestamp": msg.get("timestamp", datetime.datetime.min)
-                        }
-                        all_messages.append(msg_with_time)
-            
-            # Sort all messages by timestamp to maintain chronological order
-            all_messages.sort(key=lambda x: x["timestamp"])
-            
-            # Load the last 50 messages (to avoid memory overflow)
-            recent_messages = all_messages[-50:] if len(all_messages) > 50 else all_messages
+            recent_messages = await self._query_recent_messages(cache.window if use_cache else limit)
+            if use_cache:
+                loaded = ChatMessageHistory()
+                for msg in recent_messages:
+                    if msg.get("role") == "user":
+                        loaded.add_user_message(msg["content"])
+                    elif msg.get("role") == "assistant":
+                        loaded.add_ai_message(msg["content"])
+                cache.put(self.student_id, loaded.messages)
+                await AsyncMongoChatMemory.history_l2.set_list(self.student_id, [
+                    {"role": m["role"], "content": m["content"]}
+                    for m in recent_messages if m.get("role") in ("user", "assistant")
+                ][-cache.window:])
+            recent_messages = recent_messages[-limit:]
             
             # Add to history
             for msg in recent_messages:
@@ -293,66 +513,133 @@ class AsyncMongoChatMemory:
 
     async def append_user(self, text: str) -> None:
         """
-        Append user message to history and MongoDB (async upsert for concurrency).
+        Append user message to history and MongoDB (single-message turn commit).
+        """
+        self.stage_user(text)
+        await self.commit_turn()
+
+    async def append_ai(self, text: str) -> None:
+        """
+        Append AI message to history and MongoDB (single-message turn commit).
+        """
+        self.stage_ai(text)
+        await self.commit_turn()
+
+    async def append_tool(self, tool: str) -> None:
         """
-        self.history.add_user_message(text)
+        Append tool usage to history and MongoDB.
+        """
+        self.stage_tool(tool)
+        await self.commit_turn()
+
+    # ---------------------------------------------
+    # TURN COMMIT (one upsert per chat turn instead of three)
+    # ---------------------------------------------
+
+    def _stage_message(self, role: str, text: str) -> None:
+        if role == "user":
+            self.history.add_user_message(text)
+        else:
+            self.history.add_ai_message(text)
+        if self.student_id:
+            AsyncMongoChatMemory.history_cache.append(self.student_id, self.history.messages[-1])
+        self._pending_messages.append({"role": role, "content": text, "timestamp": datetime.datetime.utcnow()})
+
+    def stage_user(self, text: str) -> None:
+        """Add the user message to in-memory history now; persist it with commit_turn()."""
+        self._stage_message("user", text)
+
+    def stage_ai(self, text: str) -> None:
+        """Add the AI reply to in-memory history now; persist it with commit_turn()."""
+        self._stage_message("assistant", text)
+
+    def stage_tool(self, tool: str) -> None:
+        """Record tool usage now; persist it with commit_turn()."""
+        if tool:
+            self.tool_history.append(tool)
+            self._pending_tools.append(tool)
+
+    def _owner_fields(self) -> Dict[str, Any]:
+        """userId/timestamp $set fields (ObjectId when possible, string fallback)."""
+        if not self.student_id:
+            return {}
+        try:
+            return {"userId": ObjectId(self.student_id), "timestamp": datetime.datetime.utcnow()}
+        except Exception:
+            return {"userId": self.student_id}
+
+    async def commit_turn(self) -> None:
+        """
+        Persist everything staged this turn (user message, tool, AI reply).
+        Bucketed layout: one session-metadata update that reserves message positions, then
+        one bulk_write into chat_buckets. Without a buckets collection, falls back to a single
+        atomic update_one pushing into the inline messages array.
+        """
+        if not self._pending_messages and not self._pending_tools:
+            return
+        with MONGO_WRITE_SECONDS.labels(operation="chat_turn").time():
+            await self._commit_turn()
+
+    async def _commit_turn(self) -> None:
+        messages = self._pending_messages
+        if self.buckets_col is not None:
+            await self._commit_turn_bucketed()
+        else:
+            await self._commit_turn_inline()
+        if self.student_id and messages and not self._pending_messages:
+            # Only once MongoDB has the turn: a failed write is retried with the same messages,
+            # which must not already be in the shared window (every worker would see them twice)
+            await AsyncMongoChatMemory.history_l2.push_list(
+                self.student_id,
+                [{"role": m["role"], "content": m["content"]} for m in messages],
+                AsyncMongoChatMemory.history_cache.window
+            )
+
+    async def _commit_turn_inline(self) -> None:
+        update_data: Dict[str, Any] = {"$push": {}}
+        if self._pending_messages:
+            update_data["$push"]["messages"] = {"$each": self._pending_messages}
+        if self._pending_tools:
+            update_data["$push"]["tool_history"] = {"$each": self._pending_tools}
+        owner = self._owner_fields()
+        if owner:
+            update_data["$set"] = owner
         try:
-            update_data = {"$push": {"messages": {"role": "user", "content": text, "timestamp": datetime.datetime.utcnow()}}}
-            if self.student_id:
-                # Convert student_id string to MongoDB ObjectId
-                try:
-                    user_id_obj = ObjectId(self.student_id)
-                    update_data["$set"] = {"userId": user_id_obj,"timestamp": datetime.datetime.utcnow()}
-                except Exception:
-                    # If conversion fails, store as string (fallback)
-                    update_data["$set"] = {"userId": self.student_id}
-            
             await self.chats_col.update_one(
                 {"session_id": self.session_id},
                 update_data,
                 upsert=True
             )
+            self._pending_messages = []
+            self._pending_tools = []
         except Exception as e:
-            logging.warning(f"Failed to save user message for session {self.session_id}: {e}")
-
-    async def append_ai(self, text: str) -> None:
-        """
-        Append AI message to history and MongoDB (async upsert for concurrency).
-        """
-        self.history.add_ai_message(text)
+            logging.warning(f"Failed to commit turn for session {self.session_id}: {e}")
+
+    async def _commit_turn_bucketed(self) -> None:
+        messages = self._pending_messages
+        update_data: Dict[str, Any] = {"$inc": {"message_count": len(messages)}}
+        if self._pending_tools:
+            update_data["$push"] = {"tool_history": {"$each": self._pending_tools}}
+        owner = self._owner_fields()
+        if owner:
+            update_data["$set"] = owner
         try:
-            update_data = {"$push": {"messages": {"role": "assistant", "content": text, "timestamp": datetime.datetime.utcnow()}}}
-            if self.student_id:
-                # Convert student_id string to MongoDB ObjectId
-                try:
-                    user_id_obj = ObjectId(self.student_id)
-                    update_data["$set"] = {"userId": user_id_obj,"timestamp": datetime.datetime.utcnow()}
-                except Exception:
-                    # If conversion fails, store as string (fallback)
-                    update_data["$set"] = {"userId": self.student_id}
-            
-            await self.chats_col.update_one(
+            # $inc hands out a contiguous range of positions even under concurrent commits
+            meta = await self.chats_col.find_one_and_update(
                 {"session_id": self.session_id},
                 update_data,
-                upsert=True
+                projection={"message_count": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
             )
+            self._pending_tools = []
+            if messages:
+                start_index = meta["message_count"] - len(messages)
+                ops = bucket_updates(self.session_id, owner.get("userId"), start_index, messages)
+                await cast(AsyncIOMotorCollection, self.buckets_col).bulk_write(ops, ordered=False)
+            self._pending_messages = []
         except Exception as e:
-            logging.warning(f"Failed to save AI message for session {self.session_id}: {e}")
-
-    async def append_tool(self, tool: str) -> None:
-        """
-        Append tool usage to history and MongoDB.
-        """
-        if tool:
-            self.tool_history.append(tool)
-            try:
-                await self.chats_col.update_one(
-                    {"session_id": self.session_id},
-                    {"$push": {"tool_history": tool}},
-                    upsert=True
-                )
-            except Exception as e:
-                logging.warning(f"Failed to save tool {tool} for session {self.session_id}: {e}")
+            logging.warning(f"Failed to commit turn for session {self.session_id}: {e}")
 
     def get_history(self) -> BaseChatMessageHistory:
         """
@@ -366,6 +653,95 @@ class AsyncMongoChatMemory:
         """
         return self.tool_history
 
+# ===================================================
+# REQUEST CONTEXT (Loaded once per /chat turn, shared by every stage)
+# ===================================================
+
+@dataclass
+class ConversationContext:
+    """
+    Request-scoped conversation state for a single /chat turn.
+    History is loaded from MongoDB exactly once; the current user message is
+    appended in memory so generate_response, router_node and tool_dispatch all
+    see the same view without re-reading chat_sessions.
+    """
+    session_id: str
+    student_id: str
+    memory: AsyncMongoChatMemory
+    # Loaded with the history; updated by router_node, persistence deferred to commit()
+    router_memory: Optional["RouterMemory"] = None
+    # Marks lookup started early by router_node when the text looks like a marks query
+    marks_task: Optional["asyncio.Task[Optional[Dict[str, Any]]]"] = None
+
+    @classmethod
+    async def load(cls, session_id: str, student_id: str) -> "ConversationContext":
+        """Build the context: cross-session history (single Mongo scan) and router memory load concurrently."""
+        memory = AsyncMongoChatMemory(session_id, cast(AsyncIOMotorCollection, chats_col), student_id)
+
+        async def load_history() -> None:
+            try:
+                await run_stage("history", memory._load_existing_chats_no_session())
+            except asyncio.TimeoutError:
+                # Answer without context rather than fail the turn; the next turn retries the load
+                memory.history.clear()
+                logging.warning(f"⚠️ History load timed out for user {student_id}; continuing without history")
+
+        _, router_memory = await asyncio.gather(load_history(), load_router_memory(session_id, student_id))
+        return cls(session_id=session_id, student_id=student_id, memory=memory, router_memory=router_memory)
+
+    @property
+    def history(self) -> BaseChatMessageHistory:
+        return self.memory.get_history()
+
+    @property
+    def tool_history(self) -> List[str]:
+        return self.memory.get_tool_history()
+
+    def history_snippets(self, limit: int = 80) -> List[str]:
+        """Compressed snippets of the in-memory history (includes the current user message)."""
+        return build_history_snippets(self.history, limit=limit)
+
+    def prefetch_marks(self) -> None:
+        """Start the marks lookup in the background (overlaps the routing LLM call)."""
+        if self.marks_task is None:
+            self.marks_task = asyncio.create_task(fetch_marks(self.student_id))
+
+    async def marks(self) -> Optional[Dict[str, Any]]:
+        """Student marks document, reusing the prefetched lookup when there is one."""
+        self.prefetch_marks()
+        return await cast("asyncio.Task[Optional[Dict[str, Any]]]", self.marks_task)
+
+    async def commit(self) -> None:
+        """Flush the turn: one chat_sessions upsert and the router_memory upsert, concurrently."""
+        writes = [self.memory.commit_turn()]
+        if self.router_memory is not None:
+            writes.append(self.router_memory.persist())
+        with timed_stage("commit"):
+            await asyncio.gather(*writes)
+
+
+def get_conversation_context(config: Optional[Dict[str, Any]]) -> Optional[ConversationContext]:
+    """Fetch the request's ConversationContext from a LangGraph run config (None if absent)."""
+    if not config:
+        return None
+    ctx = config.get("configurable", {}).get("conversation")
+    return ctx if isinstance(ctx, ConversationContext) else None
+
+
+def with_text_features(config: Optional[Dict[str, Any]], features: Optional[TextFeatures]) -> RunnableConfig:
+    """Copy of a run config whose `configurable` also carries the message's TextFeatures for the tools."""
+    config = dict(config or {})
+    config["configurable"] = {**config.get("configurable", {}), "features": features}
+    return cast(RunnableConfig, config)
+
+
+def get_text_features(config: Optional[Dict[str, Any]], text: str) -> TextFeatures:
+    """TextFeatures computed by router_node for `text`, or a fresh analysis when a tool is called on its own."""
+    features = config.get("configurable", {}).get("features") if config else None
+    if features is not None and features["text"] == text:
+        return features
+    return analyze_text(text)
+
 # ===================================================
 # STATE DEFINITION (SIMPLIFIED: No messages; MongoDB handles)
 # ===================================================
@@ -383,6 +759,8 @@ class GraphState(TypedDict):
     student_id: str  # From frontend
     # Recent history snippets (injected at runtime for richer prompts)
     history_snippets: List[str]
+    # Normalized text, tokens and analyzer results (computed once in router_node)
+    features: Optional[TextFeatures]
 
 # ===================================================
 # EMOTION DETECTION (Lightweight keyword-based for free tier)
@@ -412,14 +790,17 @@ class EmotionDetector:
             logging.info("✅ Lightweight emotion detector initialized")
         return cls._instance
     
-    def detect(self, text: str) -> str:
-        """Detect emotion using keyword matching"""
+    def lexicon_counts(self, words: AbstractSet[str]) -> Tuple[int, int]:
+        """(positive, negative) keyword hits in a token set"""
+        return len(words & self.POSITIVE_KEYWORDS), len(words & self.NEGATIVE_KEYWORDS)
+    
+    def detect(self, text: str, features: Optional[TextFeatures] = None) -> str:
+        """Detect emotion using keyword matching (reuses precomputed lexicon counts when given)"""
         try:
-            text_lower = text.lower()
-            words = set(text_lower.split())
-            
-            positive_count = len(words & self.POSITIVE_KEYWORDS)
-            negative_count = len(words & self.NEGATIVE_KEYWORDS)
+            if features is not None:
+                positive_count, negative_count = features["positive_count"], features["negative_count"]
+            else:
+                positive_count, negative_count = self.lexicon_counts(set(tokenize(text)))
             
             if positive_count > negative_count:
                 return "positive"
@@ -548,6 +929,31 @@ NEG_CATEGORIES = {
     'ocd','peer_relations','ptsd','rape','terrorism'
 }
 
+# BM25 retrieval over the conversation datasets (built once at startup)
+DATASET_TOP_K = int(os.getenv("DATASET_TOP_K", "3"))
+POS_INDEX = BM25Index(POS_DATA, fields=["patient_context"])
+NEG_INDEX = BM25Index(
+    NEG_DATA,
+    fields=["category", "empathic_question", "empathic_response", "next_question"],
+    filter_fields=["category"]
+)
+
+# Retrieval-only answers when the LLM path is saturated (queue depth, latency, no healthy keys)
+degraded_mode = DegradedModeMonitor.from_env(openai_queue, lambda: get_key_pool().available_keys())
+
+
+def degraded_reply(
+    hits: List[Any],
+    text: str,
+    history_snippets: List[str],
+    fallback: str,
+    language: Optional[str] = None
+) -> str:
+    """Answer from the retrieved dataset records without an LLM call (`language` from the message's TextFeatures)."""
+    degraded_mode.degraded_responses += 1
+    reply = compose_retrieval_reply([hit.item for hit in hits], text, history_snippets, language)
+    return reply or fallback
+
 
 # Exam-specific tips
 EXAM_TIPS = [
@@ -609,7 +1015,7 @@ async def moral_risk_handler(text: str, session_id: str = "", history_snippets:
     """Handle violence or illegal intent with AI-driven de-escalation and empathy."""
     # Use context internally but don't show to user
     context_info = f"\nRecent conversation: {' '.join(history_snippets[-2:])}" if history_snippets else ""
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.6, openai_api_key=get_api_key())
+    llm = get_llm("gpt-4o-mini", temperature=0.6)
     system_prompt = (
         f"You are Zenark, a caring AI for teens facing tough urges. User mentioned: '{{text}}' (e.g., harm, cheating, drugs).{context_info}\n\n"
         "Respond in 2-3 sentences: 1) Acknowledge their feelings warmly (e.g., 'I hear the anger/pain/curiosity—it's real and valid'). "
@@ -676,27 +1082,35 @@ async def end_chat_handler(text: str, session_id: str = "", history_snippets: Li
     return result
 
 @tool
-async def positive_conversation_handler(text: str, session_id: str = "", history_snippets: List[str] = []) -> str:
+async def positive_conversation_handler(
+    text: str,
+    session_id: str = "",
+    history_snippets: List[str] = [],
+    config: RunnableConfig = {}
+) -> str:
     """Handle positive emotions with concise, AI-generated encouragement."""
 
-    # --- Dataset scoring ---
-    def score_item(item: dict) -> int:
-        if not isinstance(item, dict):
-            return 0
-        ctx = item.get("patient_context", "")
-        if not isinstance(ctx, str):
-            return 0
-        return len(
-            set(re.findall(r"\w+", text.lower())) &
-            set(re.findall(r"\w+", ctx.lower()))
-        )
+    # --- Dataset retrieval (BM25 top-k over the tokens router_node already computed) ---
+    features = get_text_features(config, text)
+    hits = POS_INDEX.search(text, k=DATASET_TOP_K, tokens=features["tokens"])
 
-    best = max(POS_DATA, key=score_item, default=None)
+    if degraded_mode.active():
+        return degraded_reply(
+            hits, text, history_snippets,
+            "That's really good to hear! 🌟 What's been the best part of it for you?",
+            features["language"]
+        )
 
-    if best and isinstance(best, dict):
-        p = best.get("system_prompt", "general positivity")
-        p = p if isinstance(p, str) else "general positivity"
-        dataset_context = f"Theme: {p[:50]}..."
+    if hits:
+        examples = []
+        for hit in hits:
+            p = hit.item.get("system_prompt", "general positivity")
+            p = p if isinstance(p, str) else "general positivity"
+            example = f"- Theme: {p[:80]}"
+            if isinstance(hit.item.get("empathic_response"), str):
+                example += f" | Example reply: {hit.item['empathic_response']}"
+            examples.append(example)
+        dataset_context = "Similar conversations:\n" + "\n".join(examples)
     else:
         dataset_context = "General positive vibe—focus on celebration."
 
@@ -707,7 +1121,7 @@ async def positive_conversation_handler(text: str, session_id: str = "", history
     # LLM CALL (With memory context)
     # ============================================================
 
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.8, openai_api_key=get_api_key())
+    llm = get_llm("gpt-4o-mini", temperature=0.8)
 
     system_prompt = (
         f"You are Zenark, a mental health support bot. The user just said: '{text}'.{history_context}\n\n"
@@ -732,24 +1146,31 @@ async def positive_conversation_handler(text: str, session_id: str = "", history
     return out if isinstance(out, str) else str(out)
 
 @tool
-async def negative_conversation_handler(text: str, session_id: str = "", history_snippets: List[str] = []) -> str:
+async def negative_conversation_handler(
+    text: str,
+    session_id: str = "",
+    history_snippets: List[str] = [],
+    config: RunnableConfig = {}
+) -> str:
     """Handle negative emotions with concise, AI-generated empathy."""
 
-    # --- Dataset scoring ---
-    def score(item: dict) -> int:
-        if not isinstance(item, dict):
-            return 0
-        q = set(re.findall(r"\w+", text.lower()))
-        dumped = json.dumps(item).lower()
-        iwords = set(re.findall(r"\w+", dumped))
-        base = len(q & iwords)
-        bonus = 10 if item.get("category") in NEG_CATEGORIES else 0
-        return base + bonus
+    # --- Dataset retrieval (BM25 top-k over the tokens router_node already computed) ---
+    features = get_text_features(config, text)
+    hits = NEG_INDEX.search(text, k=DATASET_TOP_K, filters={"category": NEG_CATEGORIES}, tokens=features["tokens"])
 
-    best = max(NEG_DATA, key=score, default=None)
+    if degraded_mode.active():
+        return degraded_reply(
+            hits, text, history_snippets,
+            "That sounds really hard, and it's okay to feel this way. 💙 Would you like to tell me a little more about it?",
+            features["language"]
+        )
 
-    if best and isinstance(best, dict):
-        dataset_context = f"Category: {best.get('category', 'general')}"
+    if hits:
+        examples = [
+            f"- [{hit.item.get('category', 'general')}] {hit.item.get('empathic_response', '')}"
+            for hit in hits
+        ]
+        dataset_context = f"Category: {hits[0].item.get('category', 'general')}\nSimilar conversations:\n" + "\n".join(examples)
     else:
         dataset_context = "General negative emotion—focus on validation."
 
@@ -760,7 +1181,7 @@ async def negative_conversation_handler(text: str, session_id: str = "", history
     # LLM CALL (With memory context)
     # ============================================================
 
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.7, openai_api_key=get_api_key())
+    llm = get_llm("gpt-4o-mini", temperature=0.7)
 
     system_prompt = (
         f"You are Zenark, a mental health support bot. The user just said: '{text}'.{history_context}\n\n"
@@ -789,33 +1210,44 @@ async def negative_conversation_handler(text: str, session_id: str = "", history
     out = response.content
     return out if isinstance(out, str) else str(out)
 
-@tool
-async def marks_tool(text: str, student_id: str, session_id: str = "", history_snippets: List[str] = []) -> str:
-    """Fetch marks and generate a memory-aware response."""
-
-    # Inject context if available
-    history_context = f"\nRecent history: {'; '.join(history_snippets[-2:])}" if history_snippets else ""
-
-    # ============================================================
-    # FETCH MARKS FROM MONGO
-    # ============================================================
+async def fetch_marks(student_id: str) -> Optional[Dict[str, Any]]:
+    """Marks document for the student (None if the id is not an ObjectId, missing, slow or failing)."""
     try:
         actual_id = ObjectId(student_id)
 
         if marks_col is None:
             raise RuntimeError("MongoDB marks_col not initialized")
 
-        doc = await marks_col.find_one({"_id": actual_id})
+        return await run_stage("marks", marks_col.find_one({"_id": actual_id}))
 
     except Exception:
-        doc = None
+        return None
+
+@tool
+async def marks_tool(
+    text: str,
+    student_id: str,
+    session_id: str = "",
+    history_snippets: List[str] = [],
+    config: RunnableConfig = {}
+) -> str:
+    """Fetch marks and generate a memory-aware response."""
+
+    # Inject context if available
+    history_context = f"\nRecent history: {'; '.join(history_snippets[-2:])}" if history_snippets else ""
+
+    # ============================================================
+    # FETCH MARKS FROM MONGO (prefetched by router_node during routing when possible)
+    # ============================================================
+    ctx = get_conversation_context(config)
+    doc = await ctx.marks() if ctx else await fetch_marks(student_id)
 
 
     # ============================================================
     # NO MARKS → PURE EMOTIONAL SUPPORT
     # ============================================================
     if not doc:
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.7, openai_api_key=get_api_key())
+        llm = get_llm("gpt-4o-mini", temperature=0.7)
         prompt = (
             f"You are Zenark, A conversational Exam mark analyzer{history_context}\n"
             "User said: '{{text}}'.\n"
@@ -848,7 +1280,7 @@ async def marks_tool(text: str, student_id: str, session_id: str = "", history_s
     existing = {k: v for k, v in totals.items() if v > 0}
 
     if not existing:
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.7, openai_api_key=get_api_key())
+        llm = get_llm("gpt-4o-mini", temperature=0.7)
         prompt = (
             f"You are Zenark.{history_context}\n"
             "User said: '{{text}}'.\n"
@@ -877,7 +1309,7 @@ async def marks_tool(text: str, student_id: str, session_id: str = "", history_s
     # ============================================================
     # FINAL LLM RESPONSE
     # ============================================================
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.7, openai_api_key=get_api_key())
+    llm = get_llm("gpt-4o-mini", temperature=0.7)
 
     prompt = (
         f"You are Zenark.{history_context}\n"
@@ -935,7 +1367,7 @@ Write a short response that:
 Do not add decoration, emojis, motivation, or filler.
 """
 
-        response = await llm_exam.ainvoke(prompt)
+        response = await get_llm("gpt-4o-mini", temperature=0).ainvoke(prompt)
         content = response.content if isinstance(response.content, str) else str(response.content)
         return content.strip()
 
@@ -982,7 +1414,7 @@ Your output must:
 Do not add decoration, emojis, or conversational softening.
 """
 
-    response = await llm_exam.ainvoke(prompt)
+    response = await get_llm("gpt-4o-mini", temperature=0).ainvoke(prompt)
     content = response.content if isinstance(response.content, str) else str(response.content)
     return content.strip()
 
@@ -996,7 +1428,7 @@ async def llm_generate(text: str, session_id: str = "", history_snippets: List[s
     # ============================================================
     # LLM RESPONSE (With memory context)
     # ============================================================
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.7, openai_api_key=get_api_key())
+    llm = get_llm("gpt-4o-mini", temperature=0.7)
 
     system_prompt = (
         f"You are Zenark, a mental health support bot.{history_context}\n\n"
@@ -1022,9 +1454,14 @@ async def llm_generate(text: str, session_id: str = "", history_snippets: List[s
     return out if isinstance(out, str) else str(out)
 
 @tool
-async def multilingual_handler(text: str, session_id: str = "", history_snippets: List[str] = []) -> str:
+async def multilingual_handler(
+    text: str,
+    session_id: str = "",
+    history_snippets: List[str] = [],
+    config: RunnableConfig = {}
+) -> str:
     """Handle non-English Indian language inputs with cultural sensitivity."""
-    detected_lang = MultilingualDetector.detect_language(text)
+    detected_lang = get_text_features(config, text)["language"]
     
     if detected_lang:
         logging.info(f"🌐 Multilingual: Detected {detected_lang} language")
@@ -1032,7 +1469,7 @@ async def multilingual_handler(text: str, session_id: str = "", history_snippets
         return response
     
     # Fallback to generic LLM handler if no Indian language detected
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.7, openai_api_key=get_api_key())
+    llm = get_llm("gpt-4o-mini", temperature=0.7)
     history_context = f"\nRecent history: {'; '.join(history_snippets[-3:])}" if history_snippets else ""
     
     system_prompt = (
@@ -1129,49 +1566,67 @@ class MultilingualDetector:
         }
     }
     
+    # Lookup tables compiled once from INDIAN_LANGUAGE_PATTERNS (see _compile_tables)
+    _SCRIPT_BY_CODEPOINT: Dict[int, int] = {}       # codepoint → index of first language using that block
+    _LEXICON: Dict[str, List[int]] = {}             # romanized word → language indexes (one per occurrence)
+    _MULTIWORD: List[tuple] = []                    # (compiled word-boundary regex, language index) for multi-word entries
+    _PHRASES: List[tuple] = []                      # (phrase, language index), matched as substrings
+    _LANGUAGES: List[str] = []
+    
+    @classmethod
+    def _compile_tables(cls) -> None:
+        """Build the codepoint table and romanized lexicon (called once at import)."""
+        cls._LANGUAGES = list(cls.INDIAN_LANGUAGE_PATTERNS)
+        for index, (lang, config) in enumerate(cls.INDIAN_LANGUAGE_PATTERNS.items()):
+            for lo, hi in re.findall(r'\\u([0-9A-Fa-f]{4})-\\u([0-9A-Fa-f]{4})', config['unicode_range']):
+                for codepoint in range(int(lo, 16), int(hi, 16) + 1):
+                    cls._SCRIPT_BY_CODEPOINT.setdefault(codepoint, index)  # Earlier language wins shared blocks
+            for word in config.get('romanized_words', []):
+                if re.fullmatch(r'\w+', word):
+                    cls._LEXICON.setdefault(word, []).append(index)
+                else:
+                    cls._MULTIWORD.append((re.compile(rf'\b{re.escape(word)}\b'), index))
+            for phrase in config.get('romanized_phrases', []):
+                cls._PHRASES.append((phrase, index))
+    
     @staticmethod
-    def detect_language(text: str) -> Optional[str]:
-        """Detect if text contains Indian language (Unicode or Romanized)"""
+    def detect_language(text: str, tokens: Optional[AbstractSet[str]] = None) -> Optional[str]:
+        """
+        Detect if text contains Indian language (Unicode or Romanized).
+        Called once per message by analyze_text (`tokens` = its token set); everything
+        downstream reads TextFeatures["language"].
+        """
+        cls = MultilingualDetector
+        
+        # Native script (highest priority): first language, in declaration order, whose block appears
+        if not text.isascii():
+            script_hits = [cls._SCRIPT_BY_CODEPOINT[cp] for cp in map(ord, text) if cp in cls._SCRIPT_BY_CODEPOINT]
+            if script_hits:
+                return cls._LANGUAGES[min(script_hits)]
+        
         text_lower = text.lower()
+        scores = [0] * len(cls._LANGUAGES)
         
-        # Track language match scores
-        language_scores: Dict[str, int] = {}
+        # Romanized words (whole words, counted once per message)
+        for token in set(re.findall(r'\w+', text_lower)) if tokens is None else tokens:
+            for index in cls._LEXICON.get(token, ()):
+                scores[index] += 2
+        for pattern, index in cls._MULTIWORD:
+            if pattern.search(text_lower):
+                scores[index] += 2
         
-        for lang, config in MultilingualDetector.INDIAN_LANGUAGE_PATTERNS.items():
-            score = 0
-            
-            # Check Unicode range (highest priority)
-            if re.search(config['unicode_range'], text):
-                return lang  # Immediate return for Unicode match
-            
-            # Check common Unicode words
-            for word in config['common_words']:
-                if word in text:
-                    return lang  # Immediate return for Unicode word match
-            
-            # Check romanized words
-            romanized_words = config.get('romanized_words', [])
-            for word in romanized_words:
-                # Use word boundaries to avoid partial matches (e.g., 'main' in 'remain')
-                if re.search(rf'\b{re.escape(word)}\b', text_lower):
-                    score += 2  # Higher weight for romanized word match
-            
-            # Check romanized phrases
-            romanized_phrases = config.get('romanized_phrases', [])
-            for phrase in romanized_phrases:
-                if phrase in text_lower:
-                    score += 5  # Highest weight for phrase match
-            
-            if score > 0:
-                language_scores[lang] = score
+        # Romanized phrases (highest weight)
+        for phrase, index in cls._PHRASES:
+            if phrase in text_lower:
+                scores[index] += 5
         
         # Return language with highest score (minimum threshold: 6 to avoid false positives)
         # This requires at least 3 romanized words or 1 phrase + 1 word
-        if language_scores:
-            best_lang = max(language_scores.items(), key=lambda x: x[1])[0]
-            if language_scores[best_lang] >= 6:
-                logging.info(f"🌐 Romanized language detected: {best_lang} (score: {language_scores[best_lang]})")
-                return best_lang
+        best = max(range(len(scores)), key=scores.__getitem__) if scores else 0
+        if scores and scores[best] >= 6:
+            best_lang = cls._LANGUAGES[best]
+            logging.info(f"🌐 Romanized language detected: {best_lang} (score: {scores[best]})")
+            return best_lang
         
         return None
     
@@ -1189,69 +1644,30 @@ class MultilingualDetector:
         )
         return response
 
+MultilingualDetector._compile_tables()
+
 class IntentClassifier:
     """Pre-process user input with intent classification before routing"""
     
+    # Whole-word keywords for common conversational intents (answered from the empathic dataset)
+    COMMON_INTENTS = {
+        'greeting': ['hi', 'hello', 'hey', 'hola', 'namaste', 'vanakkam'],
+        'thanks': ['thanks', 'thank you', 'thx', 'appreciate'],
+        'goodbye': ['bye', 'goodbye', 'see you', 'later']
+    }
+    
     @staticmethod
     def normalize_text(text: str) -> str:
         """Normalize text for matching"""
-        return text.lower().strip()
+        return normalize_text(text)
     
     @staticmethod
-    def match_intent(user_text: str) -> Optional[Dict[str, Any]]:
-        """Match user input against predefined intent patterns"""
-        import re
-        normalized_text = IntentClassifier.normalize_text(user_text)
-        
-        # Priority 1: Check empathic intents (mental health focused)
-        for intent_obj in INTENT_DATA_EMPATHIC:
-            patterns = intent_obj.get('patterns', [])
-            for pattern in patterns:
-                if IntentClassifier.normalize_text(pattern) == normalized_text:
-                    return {
-                        'dataset': 'empathic',
-                        'tag': intent_obj.get('tag', ''),
-                        'responses': intent_obj.get('responses', []),
-                        'match_type': 'exact'
-                    }
-        
-        # Priority 2: Check general intents
-        for intent_obj in INTENT_DATA_GENERAL:
-            patterns = intent_obj.get('text', [])
-            for pattern in patterns:
-                if IntentClassifier.normalize_text(pattern) == normalized_text:
-                    return {
-                        'dataset': 'general',
-                        'intent': intent_obj.get('intent', ''),
-                        'responses': intent_obj.get('responses', []),
-                        'match_type': 'exact'
-                    }
-        
-        # Priority 3: Partial matching for common greetings/thanks (WHOLE WORDS ONLY)
-        common_intents = {
-            'greeting': ['hi', 'hello', 'hey', 'hola', 'namaste', 'vanakkam'],
-            'thanks': ['thanks', 'thank you', 'thx', 'appreciate'],
-            'goodbye': ['bye', 'goodbye', 'see you', 'later']
-        }
-        
-        for intent_tag, keywords in common_intents.items():
-            # Use word boundaries to match whole words only
-            for keyword in keywords:
-                # Match whole word with word boundaries
-                pattern = r'\b' + re.escape(keyword) + r'\b'
-                if re.search(pattern, normalized_text):
-                    # Find matching intent from empathic dataset
-                    for intent_obj in INTENT_DATA_EMPATHIC:
-                        if intent_obj.get('tag') == intent_tag:
-                            return {
-                                'dataset': 'empathic',
-                                'tag': intent_tag,
-                                'responses': intent_obj.get('responses', []),
-                                'match_type': 'partial'
-                            }
-                    break  # Stop after first keyword match
-        
-        return None
+    def match_intent(user_text: str, features: Optional[TextFeatures] = None) -> Optional[Dict[str, Any]]:
+        """
+        Match user input against predefined intent patterns.
+        Priority: empathic exact > general exact > whole-word greeting/thanks/goodbye keywords.
+        """
+        return INTENT_INDEX.match(user_text, features)
     
     @staticmethod
     def get_intent_response(intent_match: Dict[str, Any]) -> str:
@@ -1270,6 +1686,9 @@ class IntentClassifier:
         
         return response
 
+# Intent datasets compiled once (exact-match hash map + keyword automaton)
+INTENT_INDEX = IntentIndex(INTENT_DATA_EMPATHIC, INTENT_DATA_GENERAL, IntentClassifier.COMMON_INTENTS)
+
 # ===================================================
 # ROUTER CONFIGURATION (WITH MULTILINGUAL & INTENT PRE-PROCESSING)
 # ===================================================
@@ -1283,10 +1702,25 @@ TOOLS = [
 ]
 TOOL_MAP = {t.name: t for t in TOOLS}
 
+# Safety-routed tools are scheduled ahead of regular chat traffic in the LLM queue
+CRISIS_ADJACENT_TOOLS = {"crisis_handler", "substance_handler", "moral_risk_handler"}
+
+def tool_priority(tool_name: str) -> Priority:
+    """LLM queue priority for a tool's calls."""
+    return Priority.CRISIS if tool_name in CRISIS_ADJACENT_TOOLS else Priority.CHAT
+
 # NEW: Router LLM with Memori (injects session history for better routing)
-router_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, openai_api_key=get_api_key())
-# FIXED: Bind tools after fixing ObjectId type issue
-router_llm_with_tools = router_llm.bind_tools(TOOLS)
+# Bound once per shared client so every routing call goes through key rotation
+_router_bindings: Dict[int, Any] = {}
+
+def get_router_llm_with_tools() -> Any:
+    """Router LLM (tools bound) on the currently least-loaded API key."""
+    router_llm = get_llm("gpt-4o-mini", temperature=0)
+    bound = _router_bindings.get(id(router_llm))
+    if bound is None:
+        # FIXED: Bind tools after fixing ObjectId type issue
+        bound = _router_bindings[id(router_llm)] = router_llm.bind_tools(TOOLS)
+    return bound
 
 ROUTER_SYSTEM_PROMPT = """You are a strict routing system. Your ONLY job is to select ONE tool.
 
@@ -1319,10 +1753,10 @@ REMEMBER: Mental health is our focus. Even academic queries deserve empathetic h
 class RouterMemory:
     """Intelligent router memory with STM (session) and LTM (persistent) capabilities"""
     
-    def __init__(self, session_id: str, student_id: str, router_memory_col: AsyncIOMotorCollection):
+    def __init__(self, session_id: str, student_id: str, student_memory_col: AsyncIOMotorCollection):
         self.session_id = session_id
         self.student_id = student_id
-        self.router_memory_col = router_memory_col
+        self.student_memory_col = student_memory_col
         
         # Short-term memory (current session)
         self.stm_tool_sequence: List[str] = []  # Tool usage sequence in current session
@@ -1334,32 +1768,45 @@ class RouterMemory:
         self.ltm_dominant_emotions: List[str] = []  # Dominant emotions across sessions
         self.ltm_recurring_topics: List[str] = []  # Recurring topics across sessions
         self.ltm_conversation_count: int = 0  # Total conversations across sessions
+        self.ltm_emotion_weights: Dict[str, float] = {}  # Decayed emotion histogram (observation units)
+        self.ltm_recent_topics: List[str] = []  # Last LTM_RECENT_TOPICS topics across sessions
         
         # Contextual insights
         self.last_tool: Optional[str] = None
         self.last_emotion: Optional[str] = None
         self.conversation_flow: List[Dict[str, str]] = []  # Track conversation flow
         
+        # When True, update_memory() only mutates state; the caller persists via persist()
+        self.defer_persist = False
+        
+        # Deltas not yet written to MongoDB ($inc counters, $push flow entries)
+        self._pending_tool_counts: Dict[str, int] = {}
+        self._pending_conversations = 0
+        self._pending_flow: List[Dict[str, str]] = []
+        self._pending_emotions: Dict[str, Dict[str, float]] = {}  # {decay period: {emotion: weight}}
+        self._pending_topics: List[str] = []
+        # Set when the instance lives in RouterMemoryStore: persist() then batches through the store
+        self.store: Optional["RouterMemoryStore"] = None
+        
     async def load_ltm(self) -> None:
-        """Load long-term memory from MongoDB"""
+        """Load long-term memory from the student's document (single _id lookup)"""
         try:
-            doc = await self.router_memory_col.find_one({
-                "session_id": self.session_id,
-                "student_id": self.student_id
-            })
+            doc = await self.student_memory_col.find_one({"_id": self.student_id})
             
             if doc:
-                self.ltm_tool_preferences = doc.get("tool_preferences", {})
-                self.ltm_dominant_emotions = doc.get("dominant_emotions", [])
-                self.ltm_recurring_topics = doc.get("recurring_topics", [])
+                self.ltm_tool_preferences = student_memory.top_tools(doc.get("tool_preferences", {}))
+                self.ltm_emotion_weights = student_memory.emotion_histogram(doc)
+                self.ltm_recent_topics = doc.get("recent_topics", [])
+                self.ltm_dominant_emotions = student_memory.dominant_emotions(self.ltm_emotion_weights)
+                self.ltm_recurring_topics = student_memory.recurring_topics(self.ltm_recent_topics)
                 self.ltm_conversation_count = doc.get("conversation_count", 0)
                 self.last_tool = doc.get("last_tool")
                 self.last_emotion = doc.get("last_emotion")
                 self.conversation_flow = doc.get("conversation_flow", [])[-10:]  # Last 10 interactions
                 
-                logging.info(f"📚 LTM loaded for session {self.session_id}: {self.ltm_conversation_count} conversations")
+                logging.info(f"📚 LTM loaded for student {self.student_id}: {self.ltm_conversation_count} conversations")
         except Exception as e:
-            logging.warning(f"Failed to load LTM for session {self.session_id}: {e}")
+            logging.warning(f"Failed to load LTM for student {self.student_id}: {e}")
     
     async def update_memory(self, tool_used: str, emotion: str, topic: str, user_text: str) -> None:
         """Update both STM and LTM after routing decision"""
@@ -1371,15 +1818,26 @@ class RouterMemory:
         # Update LTM counters
         self.ltm_tool_preferences[tool_used] = self.ltm_tool_preferences.get(tool_used, 0) + 1
         self.ltm_conversation_count += 1
+        self._pending_tool_counts[tool_used] = self._pending_tool_counts.get(tool_used, 0) + 1
+        self._pending_conversations += 1
+        period, weight = student_memory.decay_weight(datetime.datetime.utcnow())
+        self.ltm_emotion_weights[emotion] = self.ltm_emotion_weights.get(emotion, 0.0) + 1.0
+        self._pending_emotions = student_memory.merge_emotion_deltas(self._pending_emotions, {period: {emotion: weight}})
+        self.ltm_recent_topics = (self.ltm_recent_topics + [topic])[-student_memory.RECENT_TOPICS:]
+        self._pending_topics.append(topic)
+        self.ltm_dominant_emotions = student_memory.dominant_emotions(self.ltm_emotion_weights)
+        self.ltm_recurring_topics = student_memory.recurring_topics(self.ltm_recent_topics)
         
         # Update conversation flow
-        self.conversation_flow.append({
+        flow_entry = {
             "timestamp": datetime.datetime.utcnow().isoformat(),
             "tool": tool_used,
             "emotion": emotion,
             "topic": topic,
             "text_snippet": user_text[:50]
-        })
+        }
+        self.conversation_flow.append(flow_entry)
+        self._pending_flow.append(flow_entry)
         
         # Keep only last 10 interactions in flow
         self.conversation_flow = self.conversation_flow[-10:]
@@ -1388,42 +1846,73 @@ class RouterMemory:
         self.last_tool = tool_used
         self.last_emotion = emotion
         
-        # Persist to MongoDB
+        # Persist to MongoDB (deferred to the turn commit when running inside /chat)
+        if not self.defer_persist:
+            await self.persist()
+    
+    async def persist(self) -> None:
+        """Write pending deltas to MongoDB (batched by RouterMemoryStore when cached)"""
+        if self.store is not None:
+            self.store.mark_dirty(self)
+            return
+        delta = self.take_delta()
+        if delta is None:
+            return
         try:
-            await self.router_memory_col.update_one(
-                {"session_id": self.session_id, "student_id": self.student_id},
-                {
-                    "$set": {
-                        "tool_preferences": self.ltm_tool_preferences,
-                        "dominant_emotions": self._calculate_dominant_emotions(),
-                        "recurring_topics": self._calculate_recurring_topics(),
-                        "conversation_count": self.ltm_conversation_count,
-                        "last_tool": self.last_tool,
-                        "last_emotion": self.last_emotion,
-                        "conversation_flow": self.conversation_flow,
-                        "updated_at": datetime.datetime.utcnow()
-                    }
-                },
-                upsert=True
-            )
+            with MONGO_WRITE_SECONDS.labels(operation="router_memory").time():
+                await self.student_memory_col.update_one(self.key_filter(), self.delta_update(delta), upsert=True)
         except Exception as e:
+            self.requeue_delta(delta)
             logging.warning(f"Failed to persist router memory: {e}")
     
-    def _calculate_dominant_emotions(self) -> List[str]:
-        """Calculate dominant emotions from STM pattern"""
-        from collections import Counter
-        if not self.stm_emotion_pattern:
-            return []
-        emotion_counts = Counter(self.stm_emotion_pattern)
-        return [emotion for emotion, _ in emotion_counts.most_common(3)]
-    
-    def _calculate_recurring_topics(self) -> List[str]:
-        """Calculate recurring topics from STM focus"""
-        from collections import Counter
-        if not self.stm_topic_focus:
-            return []
-        topic_counts = Counter(self.stm_topic_focus)
-        return [topic for topic, _ in topic_counts.most_common(3)]
+    def key_filter(self) -> Dict[str, str]:
+        return {"_id": self.student_id}
+    
+    def take_delta(self) -> Optional[Dict[str, Any]]:
+        """Detach the pending deltas (None if nothing changed since the last write)."""
+        if not self._pending_conversations and not self._pending_flow:
+            return None
+        delta = {
+            "tool_counts": self._pending_tool_counts,
+            "conversations": self._pending_conversations,
+            "emotions": self._pending_emotions,
+            "topics": self._pending_topics,
+            "flow": self._pending_flow
+        }
+        self._pending_tool_counts, self._pending_conversations, self._pending_flow = {}, 0, []
+        self._pending_emotions, self._pending_topics = {}, []
+        return delta
+    
+    def requeue_delta(self, delta: Dict[str, Any], in_front: bool = True) -> None:
+        """
+        Put back a delta whose write failed (merged in front of newer changes), or with
+        in_front=False append a newer delta recorded on another instance of this session.
+        """
+        for tool_name, count in delta["tool_counts"].items():
+            self._pending_tool_counts[tool_name] = self._pending_tool_counts.get(tool_name, 0) + count
+        self._pending_emotions = student_memory.merge_emotion_deltas(self._pending_emotions, delta["emotions"])
+        self._pending_conversations += delta["conversations"]
+        if in_front:
+            topics, flow = delta["topics"] + self._pending_topics, delta["flow"] + self._pending_flow
+        else:
+            topics, flow = self._pending_topics + delta["topics"], self._pending_flow + delta["flow"]
+        self._pending_topics = topics[-student_memory.RECENT_TOPICS:]
+        self._pending_flow = flow[-10:]  # $slice keeps 10 anyway
+    
+    def delta_update(self, delta: Dict[str, Any]) -> Dict[str, Any]:
+        """Incremental update: $inc counters and emotion weights, capped $push lists, $set last state."""
+        return student_memory.student_update(
+            delta["tool_counts"],
+            delta["conversations"],
+            delta["emotions"],
+            delta["topics"],
+            delta["flow"],
+            {
+                "last_tool": self.last_tool,
+                "last_emotion": self.last_emotion,
+                "last_session_id": self.session_id
+            }
+        )
     
     def get_context_summary(self) -> Dict[str, Any]:
         """Get summarized context for routing decision"""
@@ -1442,59 +1931,193 @@ class RouterMemory:
             "recent_flow": self.conversation_flow[-3:]  # Last 3 interactions
         }
 
+class RouterMemoryStore:
+    """
+    Write-back cache of RouterMemory per (session, student) for this worker.
+    Keeps STM across turns (LRU + idle TTL) so LTM is read from MongoDB once per session,
+    and flushes pending deltas of all dirty memories in one bulk_write every `flush_interval`.
+    """
+    
+    def __init__(self, max_sessions: int = 5000, ttl_seconds: float = 1800.0, flush_interval: float = 2.0):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.flush_interval = flush_interval
+        self._entries: "OrderedDict[tuple[str, str], tuple[RouterMemory, float]]" = OrderedDict()
+        self._dirty: Dict[tuple[str, str], RouterMemory] = {}
+        # One LTM load per key: concurrent first requests for a session share it
+        self._loading: Dict[tuple[str, str], "asyncio.Task[RouterMemory]"] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushed_writes = 0
+        self.failed_writes = 0
+    
+    async def get(self, session_id: str, student_id: str, col: AsyncIOMotorCollection) -> RouterMemory:
+        """Cached memory for the session, loading LTM from MongoDB only on a miss."""
+        key = (session_id, student_id)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[1] <= self.ttl_seconds:
+            self._entries[key] = (entry[0], now)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        
+        self.misses += 1
+        task = self._loading.get(key)
+        if task is None:
+            # Own task, shielded: a caller timing out (run_stage) must not cancel the shared load
+            task = asyncio.ensure_future(self._load(key, col))
+            self._loading[key] = task
+            task.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await asyncio.shield(task)
+    
+    async def _load(self, key: tuple[str, str], col: AsyncIOMotorCollection) -> RouterMemory:
+        memory = self._dirty.get(key)  # Evicted but not flushed yet: its state is newer than MongoDB
+        if memory is None:
+            memory = RouterMemory(key[0], key[1], col)
+            memory.store = self
+            await memory.load_ltm()
+        self._entries[key] = (memory, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)  # Dirty evictees stay in _dirty until flushed
+            self.evictions += 1
+        return memory
+    
+    def mark_dirty(self, memory: RouterMemory) -> None:
+        """
+        Queue the memory's deltas for the next flush. If another instance is already the
+        registered one for this session (e.g. this one was held across a TTL reload), the
+        changes are folded into it so both are written.
+        """
+        key = (memory.session_id, memory.student_id)
+        registered = self._dirty.get(key)
+        if registered is None:
+            entry = self._entries.get(key)
+            registered = entry[0] if entry is not None else memory
+        if registered is not memory:
+            delta = memory.take_delta()
+            if delta is not None:
+                registered.requeue_delta(delta, in_front=False)
+                registered.last_tool, registered.last_emotion = memory.last_tool, memory.last_emotion
+        self._dirty[key] = registered
+    
+    async def flush(self) -> int:
+        """Write every pending delta in one unordered bulk_write; failed deltas are requeued."""
+        dirty, self._dirty = self._dirty, {}
+        batch = [(m, d) for m in dirty.values() for d in [m.take_delta()] if d is not None]
+        if not batch:
+            return 0
+        ops = [UpdateOne(m.key_filter(), m.delta_update(d), upsert=True) for m, d in batch]
+        failed: set = set()
+        try:
+            with MONGO_WRITE_SECONDS.labels(operation="router_memory_flush").time():
+                await batch[0][0].student_memory_col.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+            logging.warning(f"Router memory flush: {len(failed)}/{len(ops)} writes failed")
+        except Exception as e:
+            failed = set(range(len(ops)))
+            logging.warning(f"Router memory flush failed: {e}")
+        for index in failed:
+            memory, delta = batch[index]
+            memory.requeue_delta(delta)
+            self.mark_dirty(memory)
+        self.flushed_writes += len(ops) - len(failed)
+        self.failed_writes += len(failed)
+        return len(ops) - len(failed)
+    
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Router memory flusher error: {e}")
+    
+    def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+    
+    async def stop(self) -> None:
+        """Stop the flusher and write whatever is still pending (called at shutdown)."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "dirty": len(self._dirty),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "flushed_writes": self.flushed_writes,
+            "failed_writes": self.failed_writes
+        }
+
+router_memory_store = RouterMemoryStore(
+    max_sessions=int(os.getenv("ROUTER_MEMORY_CACHE_MAX_SESSIONS", "5000")),
+    ttl_seconds=float(os.getenv("ROUTER_MEMORY_CACHE_TTL_SECONDS", "1800")),
+    flush_interval=float(os.getenv("ROUTER_MEMORY_FLUSH_SECONDS", "2"))
+)
+
+async def load_router_memory(session_id: str, student_id: str) -> RouterMemory:
+    """Cached router memory; if the LTM lookup times out, an uncached one that writes its deltas directly."""
+    if student_memory_col is None:
+        raise RuntimeError("Router memory collection not initialized")
+    try:
+        return await run_stage("router_memory", router_memory_store.get(session_id, student_id, student_memory_col))
+    except asyncio.TimeoutError:
+        return RouterMemory(session_id, student_id, student_memory_col)
+
 # ============================================
 # INTELLIGENT ROUTER (CONTEXT-AWARE BRAIN)
 # ============================================
 
+# Local classifier consulted before the router LLM (off unless INTENT_ROUTER_ENABLED and a trained model passes its held-out gate)
+intent_router = IntentRouter.from_path()
+_decision_log_tasks: set = set()
+LOG_ROUTER_DECISIONS = os.getenv("LOG_ROUTER_DECISIONS", "true").lower() == "true"
+
+
+def log_router_decision(text: str, tool_name: str, emotion: str) -> None:
+    """Record an LLM routing decision in the background as intent router training data."""
+    if not LOG_ROUTER_DECISIONS or router_decisions_col is None:
+        return
+    doc = {
+        "text": text[:500],
+        "tool": tool_name,
+        "emotion": emotion,
+        "source": "llm",
+        "timestamp": datetime.datetime.now(datetime.timezone.utc)
+    }
+    task = asyncio.create_task(router_decisions_col.insert_one(doc))
+    _decision_log_tasks.add(task)
+    task.add_done_callback(_decision_log_tasks.discard)
+
+
 class Router:
     """Intelligent router with contextual memory (STM + LTM) and adaptive decision-making"""
     
-    SAFETY_PATTERNS = {
-        'crisis_handler': [
-            r'\b(kill|end|hurt)\s+(myself|yourself|themselves|life)\b',
-            r'\bsuicid(e|al|e)\b', r'\bself.?harm\b', r'\bcut(ting)?\s+myself\b'
-        ],
-        'substance_handler': [
-            r'\b(weed|smok(e|ing)|drug(s)?|alcohol|vape|puff|cigar(ette)?)\b'
-        ],
-        'moral_risk_handler': [
-            r'\b(kill|hurt|beat|attack)\s+(someone|him|her|them)\b',
-            r'\b(illegal|steal|rob|cheat)\b'
-        ],
-        'end_chat_handler': [
-            r'\b(bye|goodbye|exit|quit|see you|later)\b'
-        ]
-    }
-    
-    ACADEMIC_PATTERNS = {
-        'marks_tool': [
-            r'\b(marks|score|grades?|results?|percentage)\b',
-            r'\b(physics|chemistry|math|biology|botany|zoology)\b'
-        ],
-        'exam_tips_tool': [
-            r'\b(JEE|NEET|IAS|BITSAT|CUET|SAT|exam|study method|revision|mock test)\b'
-        ]
-    }
+    # Safety / academic / topic rules: router_rules.json, compiled once and hot-reloaded
+    rules = RuleEngine()
     
     @staticmethod
-    def extract_topic(text: str) -> str:
+    def extract_topic(text: str, features: Optional[TextFeatures] = None) -> str:
         """Extract primary topic from user text"""
-        text_lower = text.lower()
-        
-        # Academic topics
-        if re.search(r'\b(marks|score|grades?|exam|study)\b', text_lower):
-            return "academic"
-        # Emotional topics
-        elif re.search(r'\b(sad|happy|angry|fear|anxiety|depress)\b', text_lower):
-            return "emotional"
-        # Crisis topics
-        elif re.search(r'\b(hurt|harm|suicide|kill)\b', text_lower):
-            return "crisis"
-        # Substance topics
-        elif re.search(r'\b(smoke|drug|alcohol|weed)\b', text_lower):
-            return "substance"
-        else:
-            return "general"
+        return features["topic"] if features is not None else Router.rules.topic(text)
     
     @staticmethod
     async def route_with_memory(
@@ -1503,10 +2126,12 @@ class Router:
         history: List[str],
         tool_history: List[str],
         router_memory: RouterMemory,
-        router_llm_with_tools: Any  # LLM with bound tools
+        router_llm_with_tools: Any,  # LLM with bound tools
+        features: Optional[TextFeatures] = None
     ) -> tuple[str, str]:
         """Intelligent LLM-based routing with contextual memory awareness"""
         text_lower = text.lower()
+        start = time.perf_counter()
         
         # Get memory context
         memory_context = router_memory.get_context_summary()
@@ -1517,14 +2142,27 @@ class Router:
         logging.info(f"🧠 Router Memory Context: last_tool={last_tool}, emotion_pattern={memory_context['session_emotion_pattern']}, conversation_count={memory_context['conversation_count']}")
         
         # Priority 1: Safety (ALWAYS highest priority, overrides LLM)
-        for tool_name, patterns in Router.SAFETY_PATTERNS.items():
-            if any(re.search(p, text_lower, re.IGNORECASE) for p in patterns):
-                logging.info(f"🚨 Router: {tool_name} (SAFETY OVERRIDE - bypassing LLM)")
-                topic = Router.extract_topic(text)
-                await router_memory.update_memory(tool_name, emotion, topic, text)
-                return tool_name, text
-        
-        # Priority 2: LLM-based intelligent tool selection with context
+        tool_name = features["safety_tool"] if features is not None else Router.rules.safety_tool(text_lower)
+        if tool_name:
+            logging.info(f"🚨 Router: {tool_name} (SAFETY OVERRIDE - bypassing LLM)")
+            topic = Router.extract_topic(text, features)
+            await router_memory.update_memory(tool_name, emotion, topic, text)
+            return Router._routed("safety_regex", tool_name, text, start)
+        
+        # Priority 2: Local intent classifier (skips the LLM call when confident)
+        prediction = intent_router.route(text)
+        if prediction is not None:
+            logging.info(f"🧮 Router: {prediction.tool} (local classifier p={prediction.confidence:.2f})")
+            topic = Router.extract_topic(text, features)
+            await router_memory.update_memory(prediction.tool, emotion, topic, text)
+            return Router._routed("classifier", prediction.tool, text, start)
+        
+        # Degraded mode: skip the router LLM entirely
+        if degraded_mode.active():
+            tool_name, tool_input = await Router.fallback_route(text, emotion, router_memory, features)
+            return Router._routed("fallback_regex", tool_name, tool_input, start)
+        
+        # Priority 3: LLM-based intelligent tool selection with context
         try:
             # Build context-rich prompt for LLM
             recent_history = "\n".join(history[-3:]) if history else "No previous history"
@@ -1583,10 +2221,11 @@ Select ONE tool that best matches the user's current need and conversation flow.
                 tool_name = selected_tool_call['name']
                 
                 logging.info(f"🤖 Router: {tool_name} (LLM-selected based on context)")
+                log_router_decision(text, tool_name, emotion)
                 
-                topic = Router.extract_topic(text)
+                topic = Router.extract_topic(text, features)
                 await router_memory.update_memory(tool_name, emotion, topic, text)
-                return tool_name, text
+                return Router._routed("llm", tool_name, text, start)
             else:
                 # Fallback: No tool call returned, use emotion-based routing
                 logging.warning("⚠️ Router: LLM did not return tool call, using fallback")
@@ -1597,36 +2236,55 @@ Select ONE tool that best matches the user's current need and conversation flow.
                 else:
                     tool_name = "llm_generate"
                 
-                topic = Router.extract_topic(text)
+                topic = Router.extract_topic(text, features)
                 await router_memory.update_memory(tool_name, emotion, topic, text)
-                return tool_name, text
+                return Router._routed("llm", tool_name, text, start)
                 
         except Exception as e:
             logging.error(f"❌ Router: LLM routing failed: {e}")
-            
-            # Fallback to regex-based routing
-            logging.info("🔄 Router: Falling back to regex-based routing")
-            
-            # Academic patterns
-            for tool_name, patterns in Router.ACADEMIC_PATTERNS.items():
-                if any(re.search(p, text_lower, re.IGNORECASE) for p in patterns):
-                    logging.info(f"🔍 Router: {tool_name} (FALLBACK regex match)")
-                    topic = Router.extract_topic(text)
-                    await router_memory.update_memory(tool_name, emotion, topic, text)
-                    return tool_name, text
-            
-            # Emotion-based fallback
-            if emotion == "positive":
-                tool_name = "positive_conversation_handler"
-            elif emotion == "negative":
-                tool_name = "negative_conversation_handler"
-            else:
-                tool_name = "llm_generate"
-            
-            logging.info(f"😊 Router: {tool_name} (FALLBACK emotion-based)")
-            topic = Router.extract_topic(text)
+            tool_name, tool_input = await Router.fallback_route(text, emotion, router_memory, features)
+            return Router._routed("fallback_regex", tool_name, tool_input, start)
+    
+    @staticmethod
+    def _routed(source: str, tool_name: str, tool_input: str, start: float) -> tuple[str, str]:
+        """Record the routing decision (latency by source, tool selection count) and pass it through."""
+        ROUTING_SECONDS.labels(source=source).observe(time.perf_counter() - start)
+        TOOL_SELECTIONS.labels(tool=tool_name, source=source).inc()
+        return tool_name, tool_input
+    
+    @staticmethod
+    async def fallback_route(
+        text: str,
+        emotion: str,
+        router_memory: RouterMemory,
+        features: Optional[TextFeatures] = None
+    ) -> tuple[str, str]:
+        """Rule-based routing used when the router LLM fails or is skipped (degraded mode)"""
+        text_lower = text.lower()
+        
+        # Fallback to regex-based routing
+        logging.info("🔄 Router: Falling back to regex-based routing")
+        
+        # Academic patterns
+        tool_name = features["academic_tool"] if features is not None else Router.rules.academic_tool(text_lower)
+        if tool_name:
+            logging.info(f"🔍 Router: {tool_name} (FALLBACK regex match)")
+            topic = Router.extract_topic(text, features)
             await router_memory.update_memory(tool_name, emotion, topic, text)
             return tool_name, text
+        
+        # Emotion-based fallback
+        if emotion == "positive":
+            tool_name = "positive_conversation_handler"
+        elif emotion == "negative":
+            tool_name = "negative_conversation_handler"
+        else:
+            tool_name = "llm_generate"
+        
+        logging.info(f"😊 Router: {tool_name} (FALLBACK emotion-based)")
+        topic = Router.extract_topic(text, features)
+        await router_memory.update_memory(tool_name, emotion, topic, text)
+        return tool_name, text
     
     @staticmethod
     def route(text: str, emotion: str) -> tuple[str, str]:
@@ -1634,16 +2292,16 @@ Select ONE tool that best matches the user's current need and conversation flow.
         text_lower = text.lower()
 
         # Priority 1: Safety (regex matching) - Overrides context
-        for tool_name, patterns in Router.SAFETY_PATTERNS.items():
-            if any(re.search(p, text_lower, re.IGNORECASE) for p in patterns):
-                logging.info(f"🔍 Router: {tool_name} (safety match)")
-                return tool_name, text
+        tool_name = Router.rules.safety_tool(text_lower)
+        if tool_name:
+            logging.info(f"🔍 Router: {tool_name} (safety match)")
+            return tool_name, text
 
         # Priority 2: Academic
-        for tool_name, patterns in Router.ACADEMIC_PATTERNS.items():
-            if any(re.search(p, text_lower, re.IGNORECASE) for p in patterns):
-                logging.info(f"🔍 Router: {tool_name} (academic match)")
-                return tool_name, text
+        tool_name = Router.rules.academic_tool(text_lower)
+        if tool_name:
+            logging.info(f"🔍 Router: {tool_name} (academic match)")
+            return tool_name, text
 
         # Priority 3: Emotion
         if emotion == "positive":
@@ -1661,15 +2319,28 @@ Select ONE tool that best matches the user's current need and conversation flow.
 # GRAPH NODES (WITH ROUTER MEMORY INTEGRATION)
 # ============================================
 
-async def router_node(state: GraphState) -> Dict[str, Any]:
+def analyze_text(text: str) -> TextFeatures:
+    """Normalize/tokenize the message once and run the shared analyzers over it."""
+    features = text_features(text)
+    rules = Router.rules.rules
+    normalized = features["normalized"]
+    features["language"] = MultilingualDetector.detect_language(text, features["token_set"])
+    features["topic"] = rules.topics.first(normalized) or "general"
+    features["safety_tool"] = rules.safety.first(normalized)
+    features["academic_tool"] = rules.academic.first(normalized)
+    features["positive_count"], features["negative_count"] = emotion_detector.lexicon_counts(features["token_set"])
+    return features
+
+async def router_node(state: GraphState, config: RunnableConfig) -> Dict[str, Any]:
     """Route user input with intent classification pre-processing and intelligent memory-aware router"""
     text = state["user_text"]
     session_id = state["session_id"]
     student_id = state["student_id"]
     
-    # Extract recent history for context
+    # Extract recent history for context (request context is authoritative when present)
+    ctx = get_conversation_context(config)
     history = state.get("history_snippets", [])
-    tool_history = state.get("tool_history", [])
+    tool_history = list(ctx.tool_history) if ctx else state.get("tool_history", [])
     
     # ============================================================
     # PRIORITY 0: MULTILINGUAL DETECTION (DISABLED - Using natural language matching instead)
@@ -1677,7 +2348,12 @@ async def router_node(state: GraphState) -> Dict[str, Any]:
     # We no longer route to multilingual_handler
     # Instead, conversation handlers have Hinglish/Kanglish instructions
     # This allows natural language matching without forced greetings
-    detected_lang = MultilingualDetector.detect_language(text)
+    with timed_stage("analysis"):
+        features = analyze_text(text)
+        emotion = emotion_detector.detect(text, features)
+    with timed_stage("intent_match"):
+        intent_match = IntentClassifier.match_intent(text, features)
+    detected_lang = features["language"]
     if detected_lang:
         logging.info(f"🌐 Language detected: {detected_lang} - will respond naturally in same language")
         # Don't route to multilingual_handler - let normal routing handle it
@@ -1685,7 +2361,6 @@ async def router_node(state: GraphState) -> Dict[str, Any]:
     # ============================================================
     # PRIORITY 1: INTENT CLASSIFICATION PRE-PROCESSING
     # ============================================================
-    intent_match = IntentClassifier.match_intent(text)
     if intent_match:
         # Skip greeting intents if conversation already started (has history)
         is_greeting = intent_match.get('tag') == 'greeting'
@@ -1709,6 +2384,7 @@ async def router_node(state: GraphState) -> Dict[str, Any]:
                 "tool_input": text,
                 "tool_history": tool_history + ["intent_classifier"],
                 "final_output": intent_response,  # Set response directly
+                "features": features,
                 "debug_info": {
                     "emotion": "neutral",
                     "tool": "intent_classifier",
@@ -1720,30 +2396,36 @@ async def router_node(state: GraphState) -> Dict[str, Any]:
     # ============================================================
     # PRIORITY 2: NORMAL EMOTION DETECTION & ROUTING
     # ============================================================
-    emotion = emotion_detector.detect(text)
-    
-    # Initialize RouterMemory for this request
-    if router_memory_col is None:
-        raise RuntimeError("Router memory collection not initialized")
-    
-    router_memory = RouterMemory(session_id, student_id, router_memory_col)
-    await router_memory.load_ltm()  # Load long-term memory from MongoDB
+    # Router memory was loaded alongside the history in ConversationContext.load()
+    if ctx and ctx.router_memory is not None:
+        router_memory = ctx.router_memory
+    else:
+        router_memory = await load_router_memory(session_id, student_id)
+    if ctx:
+        # Persisted together with the chat turn in ConversationContext.commit()
+        router_memory.defer_persist = True
+        ctx.router_memory = router_memory
+        if features["academic_tool"] == "marks_tool":
+            ctx.prefetch_marks()  # Marks lookup runs while the router decides
     
     # Use intelligent routing with memory
-    tool_name, tool_input = await Router.route_with_memory(
-        text=text,
-        emotion=emotion,
-        history=history,
-        tool_history=tool_history,
-        router_memory=router_memory,
-        router_llm_with_tools=router_llm_with_tools  # Pass LLM with bound tools
-    )
+    with timed_stage("routing"):
+        tool_name, tool_input = await Router.route_with_memory(
+            text=text,
+            emotion=emotion,
+            history=history,
+            tool_history=tool_history,
+            router_memory=router_memory,
+            router_llm_with_tools=get_router_llm_with_tools(),  # Pass LLM with bound tools
+            features=features
+        )
     
     return {
         "emotion": emotion,
         "selected_tool": tool_name,
         "tool_input": tool_input,
         "tool_history": tool_history + [tool_name],
+        "features": features,
         "debug_info": {
             "emotion": emotion,
             "tool": tool_name,
@@ -1752,12 +2434,13 @@ async def router_node(state: GraphState) -> Dict[str, Any]:
         }
     }
 
-async def tool_dispatch(state: GraphState) -> Dict[str, Any]:
+async def tool_dispatch(state: GraphState, config: RunnableConfig) -> Dict[str, Any]:
     """Execute selected tool with proper arguments (handles intent classifier special case)"""
     tool_name = state["selected_tool"]
     text = state["tool_input"]
-    session_id = state["session_id"]
-    student_id = state["student_id"]
+    ctx = get_conversation_context(config)
+    session_id = ctx.session_id if ctx else state["session_id"]
+    student_id = ctx.student_id if ctx else state["student_id"]
     history_snippets = state["history_snippets"]
     
     # Special case: Intent classifier already set response in router_node
@@ -1769,7 +2452,21 @@ async def tool_dispatch(state: GraphState) -> Dict[str, Any]:
     tool_func = TOOL_MAP.get(tool_name, llm_generate)
     logging.info(f"⚙️ Executing: {tool_name}")
     
-    # Build kwargs based on tool signature - all get session_id and history_snippets
+    kwargs = build_tool_kwargs(tool_name, text, session_id, student_id, history_snippets)
+    # config carries the ConversationContext (marks prefetch) and the router's TextFeatures
+    tool_config = with_text_features(config, state.get("features"))
+    with llm_priority(tool_priority(tool_name)), timed_stage("tool"), TOOL_SECONDS.labels(tool=tool_name).time():
+        result = await tool_func.ainvoke(kwargs, tool_config)
+    return {"final_output": result}
+
+def build_tool_kwargs(
+    tool_name: str,
+    text: str,
+    session_id: str,
+    student_id: str,
+    history_snippets: List[str]
+) -> Dict[str, Any]:
+    """Build kwargs based on tool signature - all get session_id and history_snippets"""
     kwargs: Dict[str, Any] = {
         "text": text,
         "session_id": session_id,
@@ -1777,9 +2474,7 @@ async def tool_dispatch(state: GraphState) -> Dict[str, Any]:
     }
     if tool_name == "marks_tool":
         kwargs["student_id"] = student_id  # Already str
-    
-    result = await tool_func.ainvoke(kwargs)
-    return {"final_output": result}
+    return kwargs
 
 # ===================================================
 # LANGGRAPH CONSTRUCTION
@@ -1796,10 +2491,11 @@ def build_graph() -> Any:
     graph.add_edge("tool_executor", END)
 
     # -------------------------------------------------------
-    # Use in-memory saver for checkpoints (stateless per request; scalable with horizontal scaling)
-    # For distributed persistence, consider langgraph-checkpoint-mongo or Redis
+    # Checkpoint-free by default: every turn passes its full state and conversation state
+    # lives in MongoDB, so an in-memory saver only grew per-worker RSS with every session.
+    # GRAPH_CHECKPOINTER=bounded keeps recent runs (LRU/TTL) for debugging.
     # -------------------------------------------------------
-    checkpointer = MemorySaver()
+    checkpointer = make_checkpointer()
 
     # -------------------------------------------------------
     # Compile graph
@@ -1899,34 +2595,36 @@ def build_history_snippets(history: BaseChatMessageHistory, limit: int = 80) ->
     
     return snippets
 
-# The @cached and generate_response remain the same
-@cached(ttl=600, cache=Cache.MEMORY, key_builder=make_cache_key)
-async def generate_response(user_text: str, session_id: str, student_id: str = "anonymous") -> str:
+# Cached in the "response" namespace: per-worker L1 + shared L2 (10 min)
+@response_cache.cached(key_builder=make_cache_key)
+async def generate_response(
+    user_text: str,
+    session_id: str,
+    student_id: str = "anonymous",
+    context: Optional[ConversationContext] = None
+) -> str:
     """
     Generate AI response using LangGraph pipeline.
-    Cached by session_id + student_id + hashed user_text (TTL: 10 min) to save tokens on repeats.
-    Scalable: Async, shared compiled_graph, per-request MemorySaver.
+    Cached by session_id + student_id + hashed user_text (TTL: 10 min, shared across workers) to save tokens on repeats.
+    Scalable: Async, shared compiled_graph (or direct router → tool dispatch), no checkpoint growth.
+    Pass the /chat ConversationContext to reuse its already-loaded history (no second Mongo scan).
     """
     global compiled_graph
     if compiled_graph is None:
         raise RuntimeError("Graph not compiled. Call init_app first.")
 
     # ---------------------------------------------
-    # INIT MONGODB-BASED MEMORY (Per request) WITH STUDENT_ID
+    # REQUEST CONTEXT (loaded once by chat_endpoint; loaded here only for direct callers)
     # ---------------------------------------------
-    mongo_memory = AsyncMongoChatMemory(session_id, cast(AsyncIOMotorCollection, chats_col), student_id)
-
-    # Load ALL conversation history by user_id (not session_id)
-    # This ensures the LLM can see previous conversations
-    await mongo_memory._load_existing_chats_no_session()
-    loaded_count = len(mongo_memory.history.messages)
-    logging.info(f"🧠 LLM Context: Loaded {loaded_count} messages for user {student_id}")
+    owns_turn = context is None
+    if context is None:
+        context = await ConversationContext.load(session_id, student_id)
+    logging.info(f"🧠 LLM Context: {len(context.history.messages)} messages for user {student_id}")
 
     # ---------------------------------------------
-    # BUILD SHORT HISTORY SNIPPETS FROM MONGODB HISTORY
+    # BUILD SHORT HISTORY SNIPPETS FROM IN-MEMORY HISTORY
     # ---------------------------------------------
-    history = mongo_memory.get_history()
-    history_snippets = build_history_snippets(history, limit=80)  # 80 messages for long conversations
+    history_snippets = context.history_snippets(limit=80)  # 80 messages for long conversations
 
     # ---------------------------------------------
     # GRAPH INPUT
@@ -1938,27 +2636,125 @@ async def generate_response(user_text: str, session_id: str, student_id: str = "
         "tool_input": "",
         "final_output": "",
         "debug_info": {},
-        "tool_history": mongo_memory.get_tool_history(),
+        "tool_history": list(context.tool_history),
         "session_id": session_id,
         "student_id": student_id,
         "history_snippets": history_snippets
     }
 
-    config = {"configurable": {"thread_id": session_id}}
+    # The context rides in `configurable` so it is visible to every node but never checkpointed
+    config = {"configurable": {"thread_id": session_id, "conversation": context}}
 
     # ---------------------------------------------
     # RUN GRAPH (Async, concurrent-safe)
     # ---------------------------------------------
-    result = await compiled_graph.ainvoke(state_input, config)
+    if GRAPH_CHECKPOINTER == "direct":
+        # Same two steps as the graph without LangGraph's per-run channel machinery (see graph_checkpointer bench)
+        result: Dict[str, Any] = dict(state_input)
+        result.update(await router_node(cast(GraphState, result), cast(RunnableConfig, config)))
+        result.update(await tool_dispatch(cast(GraphState, result), cast(RunnableConfig, config)))
+    else:
+        result = await compiled_graph.ainvoke(state_input, config)
 
     selected_tool = result.get("selected_tool", "")
     output = result.get("final_output", "")
 
-    # Save tool usage to memory
-    await mongo_memory.append_tool(selected_tool)
+    # Stage tool usage (persisted with the turn commit)
+    context.memory.stage_tool(selected_tool)
+    if owns_turn:
+        await context.commit()
 
     return output
 
+async def stream_response(context: ConversationContext, user_text: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of generate_response: runs the router, then yields the selected tool's
+    LLM tokens as they arrive. Nested llm.ainvoke calls inside a tool stream through
+    astream_events because the callback config propagates into them.
+    Yields {"type": "token", "content": ...} events and a final {"type": "done", ...} event;
+    the caller persists the assembled reply. Shares generate_response's "response" cache:
+    a cached reply is sent as one token (done["tool"] is None, as no tool ran).
+    """
+    cache_key = make_cache_key(user_text, context.session_id, context.student_id)
+    cached = await response_cache.get(cache_key)
+    if cached is not None:
+        yield {"type": "token", "content": cached}
+        yield {"type": "done", "tool": None, "response": cached}
+        return
+
+    state: Dict[str, Any] = {
+        "user_text": user_text,
+        "emotion": "",
+        "selected_tool": "",
+        "tool_input": "",
+        "final_output": "",
+        "debug_info": {},
+        "tool_history": list(context.tool_history),
+        "session_id": context.session_id,
+        "student_id": context.student_id,
+        "history_snippets": context.history_snippets(limit=80)
+    }
+    config = cast(RunnableConfig, {"configurable": {"thread_id": context.session_id, "conversation": context}})
+    state.update(await router_node(cast(GraphState, state), config))
+    tool_name = state["selected_tool"]
+
+    if tool_name == "intent_classifier":
+        output = state.get("final_output", "")
+        await response_cache.set(cache_key, output)
+        yield {"type": "token", "content": output}
+        yield {"type": "done", "tool": tool_name, "response": output}
+        return
+
+    tool_func = TOOL_MAP.get(tool_name, llm_generate)
+    logging.info(f"⚙️ Streaming: {tool_name}")
+    kwargs = build_tool_kwargs(
+        tool_name, state["tool_input"], context.session_id, context.student_id, state["history_snippets"]
+    )
+
+    streamed: List[str] = []
+    output: Optional[str] = None
+    # Only time spent waiting on the tool counts (not the client reading tokens), and the
+    # priority is set just while the tool runs, never while the consumer holds a yield
+    priority = tool_priority(tool_name)
+    events = tool_func.astream_events(kwargs, with_text_features(config, state.get("features")), version="v2")
+    tool_seconds = 0.0
+    outcome = "ok"
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                with llm_priority(priority):
+                    event = await events.__anext__()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                tool_seconds += time.perf_counter() - start
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                chunk = event["data"]["chunk"].content
+                if isinstance(chunk, str) and chunk:
+                    streamed.append(chunk)
+                    yield {"type": "token", "content": chunk}
+            elif kind == "on_tool_end":
+                result = event["data"].get("output")
+                output = result if isinstance(result, str) else str(result)
+    finally:
+        await events.aclose()
+        TOOL_SECONDS.labels(tool=tool_name).observe(tool_seconds)
+        stage_stats.record("tool", tool_seconds, outcome)
+
+    if output is None:
+        output = "".join(streamed)
+    if not streamed and output:
+        # Template-only tools (crisis, substance, end_chat) have no LLM tokens to stream
+        yield {"type": "token", "content": output}
+    if output:
+        await response_cache.set(cache_key, output)
+    yield {"type": "done", "tool": tool_name, "response": output}
+
 async def generate_report(user_id, session_id, score) -> Dict[str, Any]:
     if chats_col is None or reports_col is None:
         return {"error": "Database not initialized"}
@@ -1978,17 +2774,22 @@ async def generate_report(user_id, session_id, score) -> Dict[str, Any]:
         if not record:
             return {"error": f"No conversation found for user in this session"}
 
+        # Only the leading buckets are needed: the report prompts use the first 5000 chars
+        memory = AsyncMongoChatMemory(session_id, chats_col)
+        messages = await memory.load_session_messages(record, max_chars=5000)
+
         # SUCCESS — generate report
         conv_text = "\n".join(
         f"{turn['role'].capitalize()}: {turn['content']}"
-        for turn in record['messages']
+        for turn in messages
         if turn.get("content")
         ).strip()
 
         if not conv_text:
             return {"error": "Conversation is empty"}
 
-        report_data = await asyncio.to_thread(generate_autogen_report, conv_text,  "Student")
+        with llm_priority(Priority.BACKGROUND):
+            report_data = await agenerate_autogen_report(conv_text, "Student")
 
         # Save report
         report_data["userId"] = user_id
@@ -2153,6 +2954,7 @@ class ChatRequest(BaseModel):
     session_id: str
     token: Optional[str] = None
     text: Optional[str] = None
+    idempotency_key: Optional[str] = None  # Or the Idempotency-Key header
 
 class SaveRequest(BaseModel):
     conversation: List[Dict]
@@ -2221,68 +3023,165 @@ def sanitize(obj: Any) -> Any:
     # primitive / unknown -> returned as-is (str/int/float/bool/None)
     return obj
 
+def resolve_chat_request(chat_request: ChatRequest) -> tuple[str, str, str]:
+    """Validate a chat request and return (session_id, user_text, student_id)."""
+    session_id = chat_request.session_id  # Required, no default
+    user_text = chat_request.text
+    token = chat_request.token  # From body
+
+    if not user_text or not user_text.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty.")
+
+    if not token:
+        raise HTTPException(status_code=400, detail="Token is required from frontend.")
+
+    # NEW: Decode JWT to extract student_id
+    payload = decode_jwt(token)
+    student_id = payload.get("id") # Assuming 'sub' claim holds student_id
+    if not student_id:
+        raise HTTPException(status_code=401, detail="Token missing 'sub' (student_id) claim.")
+    return session_id, user_text, student_id
+
+# Duplicate /chat submits share one in-flight pipeline run (per worker; idempotent results shared via the cache L2)
+chat_single_flight = SingleFlight.from_env()
+
 @app.post("/chat")
-async def chat_endpoint(chat_request: ChatRequest):
+async def chat_endpoint(chat_request: ChatRequest, idempotency_key: Optional[str] = Header(default=None)):
     """
     Chat endpoint: Handles user messages asynchronously.
     Scalable for 1M+ users: Async I/O, connection pooling, horizontal scaling ready.
+    Duplicates that arrive while the first request is still running (same session, student
+    and text, or the same idempotency key) get the reply of that single run and are stored
+    once. Once a turn has finished, only a request with the same idempotency key is answered
+    from it; the same text sent again is a new message.
     """
     try:
-        session_id = chat_request.session_id  # Required, no default
-        user_text = chat_request.text
-        token = chat_request.token  # From body
-
-        if not user_text.strip():
-            raise HTTPException(status_code=400, detail="Message cannot be empty.")
+        session_id, user_text, student_id = resolve_chat_request(chat_request)
+        key, idempotent = request_key(
+            session_id, student_id, user_text, chat_request.idempotency_key or idempotency_key
+        )
+        with CHAT_REQUEST_SECONDS.labels(endpoint="/chat").time():
+            ai_response, deduplicated = await chat_single_flight.run(
+                key, lambda: run_chat_turn(session_id, user_text, student_id), idempotent=idempotent
+            )
+        if deduplicated:
+            logging.info(f"🔁 Duplicate /chat for session {session_id} answered from the original request")
 
-        if not token:
-            raise HTTPException(status_code=400, detail="Token is required from frontend.")
+        return JSONResponse(content={"response": ai_response, "session_id": session_id})
 
-        # NEW: Decode JWT to extract student_id
-        payload = decode_jwt(token)
-        student_id = payload.get("id") # Assuming 'sub' claim holds student_id
-        if not student_id:
-            raise HTTPException(status_code=401, detail="Token missing 'sub' (student_id) claim.")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error in /chat: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
 
-        # ---------------------------------------------
-        # INIT MONGODB-BASED MEMORY (Per request) WITH STUDENT_ID
-        # ---------------------------------------------
-        mongo_memory = AsyncMongoChatMemory(session_id, cast(AsyncIOMotorCollection, chats_col), student_id)
-        
-        # ---------------------------------------------
-        # LOAD EXISTING CONVERSATION HISTORY BY USER_ID (NOT SESSION_ID)
+async def run_chat_turn(session_id: str, user_text: str, student_id: str) -> str:
+    """One /chat turn: load context, generate the reply, commit user message + tool + reply."""
+    # ---------------------------------------------
+    # LOAD CONVERSATION CONTEXT ONCE (history by user_id, not session_id)
         # This ensures memory persists across sessions even when frontend generates new session_id
         # ---------------------------------------------
-        await mongo_memory._load_existing_chats_no_session()
-        loaded_messages = len(mongo_memory.history.messages)
-        logging.info(f"💾 Loaded {loaded_messages} messages for user {student_id} (session: {session_id})")
+    context = await ConversationContext.load(session_id, student_id)
+    mongo_memory = context.memory
+    loaded_messages = len(mongo_memory.history.messages)
+    logging.info(f"💾 Loaded {loaded_messages} messages for user {student_id} (session: {session_id})")
 
-        # ---------------------------------------------
-        # SAVE USER MESSAGE TO MONGODB
-        # ---------------------------------------------
-        await mongo_memory.append_user(user_text)
+    # ---------------------------------------------
+    # STAGE USER MESSAGE (in-memory now; written with the turn commit so
+    # the Mongo round trip does not block generation)
+    # ---------------------------------------------
+    mongo_memory.stage_user(user_text)
 
-        # ---------------------------------------------
-        # Generate the AI response using your existing pipeline
-        # ---------------------------------------------
-        ai_response = await generate_response(
-            user_text=user_text,
-            session_id=session_id,
-            student_id=student_id  # NEW: Pass extracted student_id
-        )
+    # ---------------------------------------------
+    # Generate the AI response using your existing pipeline
+    # ---------------------------------------------
+    ai_response = await generate_response(
+        user_text=user_text,
+        session_id=session_id,
+        student_id=student_id,  # NEW: Pass extracted student_id
+        context=context
+    )
 
-        # ---------------------------------------------
-        # SAVE AI RESPONSE TO MONGODB
-        # ---------------------------------------------
-        await mongo_memory.append_ai(ai_response)
+    # ---------------------------------------------
+    # COMMIT TURN: user message + tool + AI reply in one chat_sessions write
+    # ---------------------------------------------
+    mongo_memory.stage_ai(ai_response)
+    await context.commit()
+    return ai_response
 
-        return JSONResponse(content={"response": ai_response, "session_id": session_id})
+def sse_event(data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event frame."""
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        logging.error(f"Error in /chat: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+async def run_stream_turn(session_id: str, user_text: str, student_id: str, emit: Callable[[Dict[str, Any]], None]) -> str:
+    """
+    One /chat/stream turn: run_chat_turn with stream_response, passing each event to `emit`
+    as it is produced. The turn is committed when generation ends (the user message is kept
+    even if it failed); returns the reply, so /chat duplicates of this turn get it too.
+    """
+    context = await ConversationContext.load(session_id, student_id)
+    context.memory.stage_user(user_text)
+    response = ""
+    try:
+        async for event in stream_response(context, user_text):
+            if event["type"] == "done":
+                if event["tool"]:
+                    context.memory.stage_tool(event["tool"])
+                context.memory.stage_ai(event["response"])
+                event["session_id"] = session_id
+                response = event["response"]
+            emit(event)
+    finally:
+        await context.commit()
+    return response
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(chat_request: ChatRequest, idempotency_key: Optional[str] = Header(default=None)):
+    """
+    Streaming chat endpoint (Server-Sent Events).
+    Same request body as /chat. Emits {"type": "token"} frames as the selected tool generates,
+    then a {"type": "done"} frame with the full reply; the turn is persisted after the stream ends.
+    Deduplicated like /chat, on the same keys: a duplicate of a turn still in flight (from
+    /chat or /chat/stream), or a retry with a used idempotency key, does not run or store the
+    turn again and receives the reply as one token frame and a done frame with "deduplicated": true.
+    """
+    session_id, user_text, student_id = resolve_chat_request(chat_request)
+    key, idempotent = request_key(
+        session_id, student_id, user_text, chat_request.idempotency_key or idempotency_key
+    )
+
+    async def event_stream() -> AsyncIterator[str]:
+        started = time.perf_counter()
+        try:
+            async for item in chat_single_flight.stream(
+                key, lambda emit: run_stream_turn(session_id, user_text, student_id, emit), idempotent
+            ):
+                if not isinstance(item, Completed):
+                    yield sse_event(item)
+                elif item.deduplicated:
+                    logging.info(f"🔁 Duplicate /chat/stream for session {session_id} answered from the original request")
+                    yield sse_event({"type": "token", "content": item.result})
+                    yield sse_event({
+                        "type": "done", "tool": None, "response": item.result,
+                        "session_id": session_id, "deduplicated": True
+                    })
+        except Exception as e:
+            logging.error(f"Error in /chat/stream: {e}")
+            yield sse_event({"type": "error", "detail": "Internal server error"})
+        finally:
+            CHAT_REQUEST_SECONDS.labels(endpoint="/chat/stream").observe(time.perf_counter() - started)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus exposition: chat pipeline latency histograms and counters (see metrics.py)."""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
 
 @app.get("/health")
 @app.head("/health")
@@ -2290,15 +3189,39 @@ async def health_check():
     """Health check endpoint (supports GET and HEAD for monitoring services)."""
     return {"status": "healthy", "timestamp": datetime.datetime.utcnow().isoformat()}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """In-process cache counters for this worker (for debugging/insights)."""
+    return {
+        "history_cache": AsyncMongoChatMemory.history_cache.stats(),
+        "router_memory": router_memory_store.stats(),
+        "graph_checkpointer": checkpointer_stats(compiled_graph.checkpointer if compiled_graph is not None else None),
+        "tiered": namespace_stats(),
+        "chat_single_flight": chat_single_flight.stats()
+    }
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """Shared LLM client registry statistics for this worker."""
+    return {
+        "llm_clients": llm_registry.stats(),
+        "llm_provider": provider_stats(),
+        "api_keys": get_key_pool().stats(),
+        "queue": openai_queue.stats(),
+        "intent_router": intent_router.stats(),
+        "degraded_mode": degraded_mode.stats(),
+        "router_rules_version": Router.rules.version,
+        "pipeline_stages": stage_stats.stats()
+    }
+
 @app.get("/router-memory/{session_id}/{student_id}")
 async def get_router_memory(session_id: str, student_id: str):
     """Get router memory context for a user session (for debugging/insights)"""
     try:
-        if router_memory_col is None:
+        if student_memory_col is None:
             raise HTTPException(status_code=500, detail="Router memory not initialized")
         
-        router_memory = RouterMemory(session_id, student_id, router_memory_col)
-        await router_memory.load_ltm()
+        router_memory = await router_memory_store.get(session_id, student_id, student_memory_col)
         
         context = router_memory.get_context_summary()
         
@@ -2315,6 +3238,7 @@ async def get_router_memory(session_id: str, student_id: str):
                 "tool_preferences": router_memory.ltm_tool_preferences,
                 "dominant_emotions": router_memory.ltm_dominant_emotions,
                 "recurring_topics": router_memory.ltm_recurring_topics,
+                "emotion_histogram": {e: round(w, 4) for e, w in router_memory.ltm_emotion_weights.items()},
                 "conversation_count": router_memory.ltm_conversation_count
             }
         })
@@ -2349,7 +3273,7 @@ async def score_conversation(req: ScoreRequest):
     student_id = payload.get("id") # Assuming 'sub' claim holds student_id
     # Load the full session conversation (async)
     memory = AsyncMongoChatMemory(session_id, chats_col)
-    await memory._load_existing()  # Ensure history is loaded
+    await memory._load_existing(max_chars=4000)  # Only the buckets the 4000-char summary needs
     history = memory.get_history()
 
     if not history.messages:
@@ -2371,8 +3295,9 @@ Conversation SUMMARY:
 Return only a single integer (1–10) as the Global Distress Score."""
 
     # Low-temperature deterministic LLM call (async)
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, openai_api_key=get_api_key())
-    result = await llm.ainvoke([HumanMessage(content=scoring_prompt)])  # Use ainvoke for async
+    llm = get_llm("gpt-4o-mini", temperature=0)
+    with llm_priority(Priority.BACKGROUND):  # Scoring must not starve live chat
+        result = await llm.ainvoke([HumanMessage(content=scoring_prompt)])  # Use ainvoke for async
 
     # Extract numeric score safely
     try:
@@ -2464,7 +3389,7 @@ async def generate_report_endpoint(req: ReportRequest):
             # Load session and calculate score
             session_id = latest_chat["session_id"]
             memory = AsyncMongoChatMemory(session_id, chats_col)
-            await memory._load_existing()
+            await memory._load_existing(max_chars=4000)
             history = memory.get_history()
             
             if history.messages:
@@ -2479,8 +3404,9 @@ Conversation SUMMARY:
 
 Return only a single integer (1–10) as the Global Distress Score."""
                 
-                llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, openai_api_key=get_api_key())
-                result = await llm.ainvoke([HumanMessage(content=scoring_prompt)])
+                llm = get_llm("gpt-4o-mini", temperature=0)
+                with llm_priority(Priority.BACKGROUND):
+                    result = await llm.ainvoke([HumanMessage(content=scoring_prompt)])
                 
                 # Extract score
                 import re
@@ -2554,8 +3480,9 @@ Conversation SUMMARY:
 Return only a single integer (1–10) as the Global Distress Score."""
 
     # Low-temperature deterministic LLM call (async)
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, openai_api_key=get_api_key())
-    result = await llm.ainvoke([HumanMessage(content=scoring_prompt)])  # Use ainvoke for async
+    llm = get_llm("gpt-4o-mini", temperature=0)
+    with llm_priority(Priority.BACKGROUND):  # Scoring must not starve live chat
+        result = await llm.ainvoke([HumanMessage(content=scoring_prompt)])  # Use ainvoke for async
 
     # Extract numeric score safely
     try:
@@ -2606,11 +3533,15 @@ def merge_therapist_and_analyst(data: dict) -> dict:
 
 @app.get("/analytics/active_users")
 async def get_active_users():
-    """Get real-time active user count - NO AUTH REQUIRED"""
+    """Get real-time active user count - NO AUTH REQUIRED (shared cache, ANALYTICS_CACHE_TTL_SECONDS)"""
     try:
         if chats_col is None:
             raise HTTPException(status_code=500, detail="Database not initialized")
         
+        cached_content = await analytics_cache.get("active_users")
+        if cached_content is not None:
+            return JSONResponse(content=cached_content)
+        
         from datetime import datetime, timedelta
         
         # Active in last 10 minutes
@@ -2637,7 +3568,7 @@ async def get_active_users():
         # Total conversations
         total_conversations = await chats_col.count_documents({})
         
-        return JSONResponse(content={
+        content = {
             "status": "success",
             "active_now": active_now,
             "active_last_hour": users_last_hour,
@@ -2645,7 +3576,9 @@ async def get_active_users():
             "total_users": total_users,
             "total_conversations": total_conversations,
             "timestamp": datetime.utcnow().isoformat()
-        })
+        }
+        await analytics_cache.set("active_users", content)
+        return JSONResponse(content=content)
         
     except Exception as e:
         logging.error(f"Error getting active users: {e}")
@@ -2654,11 +3587,15 @@ async def get_active_users():
 
 @app.get("/analytics/dashboard")
 async def analytics_dashboard():
-    """Complete analytics dashboard - NO AUTH REQUIRED"""
+    """Complete analytics dashboard - NO AUTH REQUIRED (shared cache, ANALYTICS_CACHE_TTL_SECONDS)"""
     try:
         if chats_col is None or reports_col is None:
             raise HTTPException(status_code=500, detail="Database not initialized")
         
+        cached_content = await analytics_cache.get("dashboard")
+        if cached_content is not None:
+            return JSONResponse(content=cached_content)
+        
         from datetime import datetime, timedelta
         
         # Get various metrics
@@ -2693,7 +3630,7 @@ async def analytics_dashboard():
         avg_score_result = await reports_col.aggregate(pipeline_avg_score).to_list(length=1)
         avg_score = round(avg_score_result[0]['avg_score'], 2) if avg_score_result else 0
         
-        return JSONResponse(content={
+        content = {
             "status": "success",
             "metrics": {
                 "total_users": total_users,
@@ -2710,7 +3647,9 @@ async def analytics_dashboard():
                 for item in peak_hours
             ],
             "timestamp": datetime.utcnow().isoformat()
-        })
+        }
+        await analytics_cache.set("dashboard", content)
+        return JSONResponse(content=content)
         
     except Exception as e:
         logging.error(f"Error getting analytics: {e}")
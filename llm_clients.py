@@ -0,0 +1,223 @@
+"""
+Shared LLM Client Registry
+Reuses ChatOpenAI instances (and their keep-alive HTTP connection pools)
+across requests instead of constructing a new client on every tool call.
+Every async call made through a registry client is scheduled by request_queue.openai_queue.
+
+Provider (env LLM_PROVIDER):
+    openai     (default) ChatOpenAI with API key rotation
+    simulator  llm_simulator.SimulatedChatModel: offline, deterministic, no API keys
+               (benchmarks and load tests; see llm_simulator for its settings). Clients
+               draw synthetic keys from the same key pool, so rotation, cooldown and
+               usage accounting behave as with OpenAI.
+"""
+import os
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult, LLMResult
+from langchain_openai import ChatOpenAI
+
+from api_key_rotator import get_api_key, get_key_pool, mask_key
+from llm_simulator import SimulatedChatModel, simulator_stats
+from metrics import LLM_ERRORS
+from request_queue import openai_queue
+
+logger = logging.getLogger("zenark.llm_clients")
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+if LLM_PROVIDER not in ("openai", "simulator"):
+    logger.warning(f"Unknown LLM_PROVIDER '{LLM_PROVIDER}', using openai")
+    LLM_PROVIDER = "openai"
+elif LLM_PROVIDER == "simulator":
+    logger.warning("🧪 LLM_PROVIDER=simulator: all LLM calls are answered offline by llm_simulator")
+
+ClientKey = Tuple[str, float, str]
+
+
+def _retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Read Retry-After from an OpenAI error response, if present."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _total_tokens(response: LLMResult) -> int:
+    """
+    Tokens used by a finished call: llm_output["token_usage"] for regular calls, the
+    messages' usage_metadata for streamed ones (which report usage in their last chunk).
+    """
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage.get("total_tokens"):
+        return int(usage["total_tokens"])
+    total = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            total += int(metadata.get("total_tokens") or 0)
+    return total
+
+
+class LLMErrorCallback(BaseCallbackHandler):
+    """Counts failed calls per model and error kind (zenark_llm_errors_total)"""
+
+    run_inline = True
+
+    def __init__(self, model: str = ""):
+        self.model = model
+
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        LLM_ERRORS.labels(model=self.model, kind=type(error).__name__).inc()
+
+
+class KeyUsageCallback(LLMErrorCallback):
+    """Reports token usage and 429s for one client's API key back to the key pool"""
+
+    def __init__(self, api_key: str, model: str = ""):
+        super().__init__(model)
+        self.api_key = api_key
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], **kwargs: Any) -> None:
+        get_key_pool().record_request(self.api_key)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        get_key_pool().record_request(self.api_key)
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        get_key_pool().record_tokens(self.api_key, _total_tokens(response))
+
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        super().on_llm_error(error, **kwargs)
+        if getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError":
+            get_key_pool().record_rate_limit(self.api_key, _retry_after_seconds(error))
+
+
+def estimate_tokens(messages: List[BaseMessage], completion_tokens: int = 256) -> int:
+    """Rough prompt+completion token estimate (~4 chars per token) for TPM scheduling."""
+    chars = sum(len(m.content) if isinstance(m.content, str) else len(str(m.content)) for m in messages)
+    return chars // 4 + completion_tokens
+
+
+class QueueScheduled:
+    """Mixin for chat models: async generate/stream calls wait for an openai_queue slot first"""
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        async with openai_queue.slot(tokens=estimate_tokens(messages, self.max_tokens or 256)):
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async with openai_queue.slot(tokens=estimate_tokens(messages, self.max_tokens or 256)):
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+
+
+class ScheduledChatOpenAI(QueueScheduled, ChatOpenAI):
+    """ChatOpenAI scheduled by openai_queue"""
+
+
+class ScheduledSimulatedChatModel(QueueScheduled, SimulatedChatModel):
+    """Simulator scheduled by openai_queue, so benchmarks include our own queueing overhead"""
+
+
+def new_llm(model: str = "gpt-4o-mini", temperature: float = 0.7) -> BaseChatModel:
+    """
+    Dedicated, unscheduled client from the configured provider, for callers that
+    run their own event loop or call synchronously (autogen_report, exam_buddy).
+    """
+    api_key = get_api_key()
+    if LLM_PROVIDER == "simulator":
+        return SimulatedChatModel.from_env(model, temperature, callbacks=[KeyUsageCallback(api_key, model)])
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        openai_api_key=api_key,
+        stream_usage=True,
+        callbacks=[KeyUsageCallback(api_key, model)]
+    )
+
+
+class LLMClientRegistry:
+    """Process-wide registry of chat clients keyed by (model, temperature, api key)"""
+
+    def __init__(self):
+        self._clients: Dict[ClientKey, BaseChatModel] = {}
+        self._uses: Dict[ClientKey, int] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _create(self, model: str, temperature: float, api_key: str) -> BaseChatModel:
+        if LLM_PROVIDER == "simulator":
+            return ScheduledSimulatedChatModel.from_env(model, temperature, callbacks=[KeyUsageCallback(api_key, model)])
+        return ScheduledChatOpenAI(
+            model=model,
+            temperature=temperature,
+            openai_api_key=api_key,
+            stream_usage=True,  # Streamed calls report token usage too (last chunk), for TPM accounting
+            callbacks=[KeyUsageCallback(api_key, model)]
+        )
+
+    def get(self, model: str = "gpt-4o-mini", temperature: float = 0.7) -> BaseChatModel:
+        """Return the shared client for this model/temperature and the currently selected key."""
+        api_key = get_api_key()
+        key = (model, float(temperature), api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._create(model, temperature, api_key)
+                self._clients[key] = client
+                self._uses[key] = 0
+                self.created += 1
+                logger.info(f"🔌 LLM client created: provider={LLM_PROVIDER} model={model} temperature={temperature}")
+            else:
+                self.reused += 1
+            self._uses[key] += 1
+        return client
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool statistics (api keys are never exposed, only a short suffix)."""
+        with self._lock:
+            clients = [
+                {
+                    "model": model,
+                    "temperature": temperature,
+                    "key": mask_key(api_key),
+                    "uses": self._uses.get((model, temperature, api_key), 0)
+                }
+                for model, temperature, api_key in self._clients
+            ]
+            lookups = self.created + self.reused
+            return {
+                "provider": LLM_PROVIDER,
+                "clients": len(clients),
+                "created": self.created,
+                "reused": self.reused,
+                "reuse_ratio": round(self.reused / lookups, 4) if lookups else 0.0,
+                "by_client": clients
+            }
+
+
+# Global registry instance
+llm_registry = LLMClientRegistry()
+
+
+def get_llm(model: str = "gpt-4o-mini", temperature: float = 0.7) -> BaseChatModel:
+    """Shortcut for llm_registry.get()"""
+    return llm_registry.get(model=model, temperature=temperature)
+
+
+def provider_stats() -> Dict[str, Any]:
+    """Provider in use, plus the simulator's call/token/failure counters when it is active."""
+    if LLM_PROVIDER == "simulator":
+        return {"provider": LLM_PROVIDER, **simulator_stats.stats()}
+    return {"provider": LLM_PROVIDER}
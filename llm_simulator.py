@@ -0,0 +1,389 @@
+"""
+Offline LLM Simulator
+Deterministic stand-in for ChatOpenAI used for benchmarks and load tests
+(LLM_PROVIDER=simulator, see llm_clients). No network, no API keys, no cost:
+what remains of a /chat turn's latency is our own pipeline plus the simulated delay.
+
+- Replies are a pure function of (model, messages): the same prompt gives the same
+  text on every run and every worker. Scoring prompts ("Return only a single
+  integer") get a digit 1-10.
+- bind_tools() works: a bound call returns one tool call (picked from the bound
+  tools by the same hash) or, with LLM_SIM_TOOL_CALL_RATE < 1, sometimes plain text
+  so the router's fallback path gets exercised too.
+- Latency is drawn from a seeded distribution; streaming sends the first chunk
+  after that delay and then one word per 1/LLM_SIM_STREAM_TOKENS_PER_S.
+- Errors are injected as real openai.RateLimitError (429 with Retry-After) and
+  openai.InternalServerError, so key cooldown, degraded mode and the error
+  counters react exactly as they do in production.
+- Token usage (~4 chars per token) is reported in llm_output["token_usage"] and
+  in usage_metadata, like ChatOpenAI.
+
+Settings (env):
+    LLM_SIM_LATENCY_DIST          fixed | uniform | normal | lognormal (default lognormal)
+    LLM_SIM_LATENCY_MS            mean latency to first token (default 600)
+    LLM_SIM_LATENCY_JITTER_MS     stddev (normal, lognormal) or half-range (uniform) (default 200)
+    LLM_SIM_STREAM_TOKENS_PER_S   streaming speed after the first chunk (default 60)
+    LLM_SIM_REPLY_WORDS           approximate reply length (default 60)
+    LLM_SIM_ERROR_RATE            fraction of calls failing with a 500 (default 0)
+    LLM_SIM_RATE_LIMIT_RATE       fraction of calls failing with a 429 (default 0)
+    LLM_SIM_RETRY_AFTER_S         Retry-After sent with simulated 429s (default 1)
+    LLM_SIM_TOOL_CALL_RATE        fraction of tool-bound calls returning a tool call (default 1)
+    LLM_SIM_SEED                  seed for latency and error draws (default 0)
+    LLM_SIM_KEYS                  synthetic keys in the API key pool (default 1, see api_key_rotator)
+
+Overhead benchmark (shared registry clients, openai_queue scheduling included):
+    LLM_PROVIDER=simulator python llm_simulator.py bench [calls] [concurrency]
+"""
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import httpx
+import openai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+logger = logging.getLogger("zenark.llm_simulator")
+
+_SIM_REQUEST = httpx.Request("POST", "http://llm-simulator.local/v1/chat/completions")
+
+# Reply vocabulary: sentences are chosen by hash, so replies vary per prompt but never per run
+_SENTENCES = [
+    "That sounds like a lot to carry right now.",
+    "Thank you for telling me about this.",
+    "It makes sense that you feel this way after everything that happened.",
+    "What part of it has been the hardest for you today?",
+    "Try breaking the chapter into three short sessions with a small break between them.",
+    "Writing down the formulas you keep forgetting can make revision much easier.",
+    "You have already handled difficult weeks before, and that counts.",
+    "Would it help to talk to someone at home or at school about this?",
+    "A short walk or a glass of water can help when your mind feels crowded.",
+    "Let's focus on one small step you can take before tonight.",
+    "Practising old papers under a timer builds both speed and confidence.",
+    "How have you been sleeping over the last few days?",
+    "It is okay to take a pause when things feel overwhelming.",
+    "That is a real achievement, and you should be proud of it.",
+    "Which subject feels the most stressful at the moment?",
+    "Spaced repetition works best when you review just before you would forget.",
+]
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+def _content_text(message: BaseMessage) -> str:
+    return message.content if isinstance(message.content, str) else str(message.content)
+
+
+def count_tokens(text: str) -> int:
+    """~4 characters per token, the same estimate openai_queue uses for scheduling."""
+    return max(1, len(text) // 4)
+
+
+class SimulatorStats:
+    """Process-wide counters across all simulator instances"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.streams = 0
+        self.tool_calls = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.simulated_seconds = 0.0
+
+    def add(self, **counts: float) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "streams": self.streams,
+                "tool_calls": self.tool_calls,
+                "rate_limited": self.rate_limited,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "simulated_seconds": round(self.simulated_seconds, 3)
+            }
+
+
+simulator_stats = SimulatorStats()
+
+
+class SimulatedChatModel(BaseChatModel):
+    """Chat model with deterministic replies, simulated latency and injected failures"""
+
+    model_name: str = "gpt-4o-mini"
+    temperature: float = 0.7
+    max_tokens: Optional[int] = None
+    latency_dist: str = "lognormal"
+    latency_ms: float = 600.0
+    latency_jitter_ms: float = 200.0
+    stream_tokens_per_s: float = 60.0
+    reply_words: int = 60
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after_s: float = 1.0
+    tool_call_rate: float = 1.0
+    seed: int = 0
+
+    _rng: random.Random = PrivateAttr()
+    _rng_lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._rng = random.Random(self.seed)
+        self._rng_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, model: str = "gpt-4o-mini", temperature: float = 0.7, **kwargs: Any) -> "SimulatedChatModel":
+        settings: Dict[str, Any] = dict(
+            model_name=model,
+            temperature=temperature,
+            latency_dist=os.getenv("LLM_SIM_LATENCY_DIST", "lognormal").lower(),
+            latency_ms=_env_float("LLM_SIM_LATENCY_MS", 600),
+            latency_jitter_ms=_env_float("LLM_SIM_LATENCY_JITTER_MS", 200),
+            stream_tokens_per_s=_env_float("LLM_SIM_STREAM_TOKENS_PER_S", 60),
+            reply_words=int(os.getenv("LLM_SIM_REPLY_WORDS", "60")),
+            error_rate=_env_float("LLM_SIM_ERROR_RATE", 0),
+            rate_limit_rate=_env_float("LLM_SIM_RATE_LIMIT_RATE", 0),
+            retry_after_s=_env_float("LLM_SIM_RETRY_AFTER_S", 1),
+            tool_call_rate=_env_float("LLM_SIM_TOOL_CALL_RATE", 1),
+            seed=int(os.getenv("LLM_SIM_SEED", "0"))
+        )
+        settings.update(kwargs)
+        return cls(**settings)
+
+    @property
+    def _llm_type(self) -> str:
+        return "zenark-simulator"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "temperature": self.temperature}
+
+    # ============================================================
+    # TOOLS
+    # ============================================================
+    def bind_tools(self, tools: Sequence[Any], *, tool_choice: Optional[str] = None, **kwargs: Any) -> Any:
+        """Bind tools the way ChatOpenAI does (OpenAI tool schemas passed as the `tools` kwarg)."""
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    # ============================================================
+    # DETERMINISTIC OUTPUT
+    # ============================================================
+    def _digest(self, messages: List[BaseMessage]) -> bytes:
+        h = hashlib.sha256(self.model_name.encode("utf-8"))
+        for m in messages:
+            h.update(m.type.encode("utf-8"))
+            h.update(_content_text(m).encode("utf-8"))
+        return h.digest()
+
+    def _reply_text(self, messages: List[BaseMessage], digest: bytes) -> str:
+        prompt = _content_text(messages[-1]) if messages else ""
+        if "single integer" in prompt.lower():
+            return str(1 + digest[0] % 10)
+        words = min(self.reply_words, self.max_tokens or self.reply_words)
+        sentences: List[str] = []
+        count = 0
+        i = 0
+        while count < words:
+            sentence = _SENTENCES[digest[i % len(digest)] % len(_SENTENCES)]
+            sentences.append(sentence)
+            count += len(sentence.split())
+            i += 1
+        return " ".join(sentences)
+
+    def _tool_call(self, tools: List[Dict[str, Any]], messages: List[BaseMessage], digest: bytes) -> Optional[Dict[str, Any]]:
+        if not tools or digest[1] / 255 > self.tool_call_rate:
+            return None
+        function = tools[digest[2] % len(tools)]["function"]
+        properties = function.get("parameters", {}).get("properties", {})
+        human = [m for m in messages if m.type == "human"]
+        args = {"text": _content_text(human[-1]) if human else ""} if "text" in properties else {}
+        return {"name": function["name"], "args": args, "id": f"call_{digest[:12].hex()}", "type": "tool_call"}
+
+    def _message(self, messages: List[BaseMessage], tools: Optional[List[Dict[str, Any]]]) -> AIMessage:
+        digest = self._digest(messages)
+        tool_call = self._tool_call(tools or [], messages, digest)
+        content = "" if tool_call else self._reply_text(messages, digest)
+        prompt_tokens = sum(count_tokens(_content_text(m)) for m in messages)
+        completion_tokens = count_tokens(content) if content else count_tokens(str(tool_call))
+        simulator_stats.add(
+            calls=1, tool_calls=1 if tool_call else 0,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+        )
+        return AIMessage(
+            content=content,
+            tool_calls=[tool_call] if tool_call else [],
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            },
+            response_metadata={"model_name": self.model_name, "finish_reason": "tool_calls" if tool_call else "stop"}
+        )
+
+    def _result(self, message: AIMessage) -> ChatResult:
+        usage = message.usage_metadata or {}
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={
+                "model_name": self.model_name,
+                "token_usage": {
+                    "prompt_tokens": usage.get("input_tokens", 0),
+                    "completion_tokens": usage.get("output_tokens", 0),
+                    "total_tokens": usage.get("total_tokens", 0)
+                }
+            }
+        )
+
+    # ============================================================
+    # LATENCY AND FAILURES (seeded, so a load test run is reproducible)
+    # ============================================================
+    def sample_latency(self) -> float:
+        """Seconds to the first token, drawn from the configured distribution."""
+        mean = self.latency_ms / 1000
+        jitter = self.latency_jitter_ms / 1000
+        with self._rng_lock:
+            if self.latency_dist == "fixed" or mean <= 0:
+                value = mean
+            elif self.latency_dist == "uniform":
+                value = self._rng.uniform(mean - jitter, mean + jitter)
+            elif self.latency_dist == "normal":
+                value = self._rng.gauss(mean, jitter)
+            else:
+                # Lognormal with the requested mean and standard deviation: the long tail real APIs have
+                sigma2 = math.log(1 + (jitter / mean) ** 2)
+                value = self._rng.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+        return max(0.0, value)
+
+    def _draw_failure(self) -> Optional[Exception]:
+        with self._rng_lock:
+            roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            simulator_stats.add(rate_limited=1)
+            response = httpx.Response(429, headers={"retry-after": str(self.retry_after_s)}, request=_SIM_REQUEST)
+            return openai.RateLimitError("Simulated rate limit", response=response, body=None)
+        if roll < self.rate_limit_rate + self.error_rate:
+            simulator_stats.add(errors=1)
+            response = httpx.Response(500, request=_SIM_REQUEST)
+            return openai.InternalServerError("Simulated server error", response=response, body=None)
+        return None
+
+    def _delay(self) -> float:
+        delay = self.sample_latency()
+        simulator_stats.add(simulated_seconds=delay)
+        return delay
+
+    # ============================================================
+    # BaseChatModel HOOKS
+    # ============================================================
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, tools: Optional[List[Dict[str, Any]]] = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay())
+        failure = self._draw_failure()
+        if failure is not None:
+            raise failure
+        return self._result(self._message(messages, tools))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, tools: Optional[List[Dict[str, Any]]] = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        failure = self._draw_failure()
+        if failure is not None:
+            raise failure
+        return self._result(self._message(messages, tools))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, tools: Optional[List[Dict[str, Any]]] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._delay())
+        failure = self._draw_failure()
+        if failure is not None:
+            raise failure
+        message = self._message(messages, tools)
+        simulator_stats.add(streams=1)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": 0}
+                    for c in message.tool_calls
+                ],
+                usage_metadata=message.usage_metadata
+            ))
+            return
+        words = message.content.split(" ")
+        pause = 1 / self.stream_tokens_per_s if self.stream_tokens_per_s > 0 else 0.0
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(pause)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=message.usage_metadata))
+
+
+def _benchmark(calls: int = 500, concurrency: int = 50) -> None:
+    """Observed latency minus the (fixed) simulated latency = our own client + scheduling overhead."""
+    os.environ["LLM_SIM_LATENCY_DIST"] = "fixed"  # Every call's simulated share is then exactly LLM_SIM_LATENCY_MS
+    from langchain_core.messages import HumanMessage
+    from llm_clients import LLM_PROVIDER, get_llm, provider_stats
+
+    if LLM_PROVIDER != "simulator":
+        print("Set LLM_PROVIDER=simulator to benchmark against the simulator")
+        return
+    simulated = _env_float("LLM_SIM_LATENCY_MS", 600) / 1000
+
+    async def run() -> List[float]:
+        semaphore = asyncio.Semaphore(concurrency)
+        overheads: List[float] = []
+
+        async def one(i: int) -> None:
+            async with semaphore:
+                start = time.perf_counter()
+                await get_llm("gpt-4o-mini", temperature=0.7).ainvoke(
+                    [HumanMessage(content=f"I have my maths exam tomorrow ({i})")]
+                )
+                overheads.append(time.perf_counter() - start - simulated)
+
+        await asyncio.gather(*(one(i) for i in range(calls)), return_exceptions=True)
+        return overheads
+
+    start = time.perf_counter()
+    overheads = sorted(asyncio.run(run()))
+    wall = time.perf_counter() - start
+    if not overheads:
+        print("No call succeeded")
+        return
+    p = lambda q: overheads[min(len(overheads) - 1, int(q * len(overheads)))] * 1000
+    print(f"{len(overheads)}/{calls} calls at concurrency {concurrency} in {wall:.2f}s (simulated latency {simulated * 1000:.0f} ms)")
+    print(f"overhead beyond simulated latency: p50 {p(0.5):.2f} ms   p95 {p(0.95):.2f} ms   p99 {p(0.99):.2f} ms")
+    print(provider_stats())  # llm_clients' instance of this module, not __main__'s
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        _benchmark(*(int(a) for a in sys.argv[2:4]))
+    else:
+        print("Usage: LLM_PROVIDER=simulator python llm_simulator.py bench [calls] [concurrency]")
@@ -0,0 +1,60 @@
+"""
+Prometheus Metrics
+Latency histograms and counters for the chat pipeline, exposed at /metrics.
+
+    zenark_chat_request_seconds{endpoint}        total /chat and /chat/stream time
+    zenark_stage_seconds{stage}                  history, router_memory, analysis, intent_match,
+                                                 routing, marks, tool, commit
+    zenark_routing_seconds{source}               safety_regex | classifier | llm | fallback_regex
+    zenark_tool_seconds{tool}                    each tool in TOOL_MAP
+    zenark_mongo_write_seconds{operation}        chat_turn, router_memory_flush, router_memory
+    zenark_tool_selections_total{tool,source}
+    zenark_cache_lookups_total{namespace,result} l1_hit | l2_hit | miss
+    zenark_llm_errors_total{model,kind}          kind = exception class (RateLimitError, ...)
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by the
+workers so /metrics aggregates all of them instead of the worker that answered.
+"""
+import os
+from typing import Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+
+# 5 ms .. 60 s: covers regex routing as well as slow LLM calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CHAT_REQUEST_SECONDS = Histogram(
+    "zenark_chat_request_seconds", "Total chat request time", ["endpoint"], buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "zenark_stage_seconds", "Chat pipeline stage latency", ["stage"], buckets=LATENCY_BUCKETS
+)
+ROUTING_SECONDS = Histogram(
+    "zenark_routing_seconds", "Routing decision latency by decision source", ["source"], buckets=LATENCY_BUCKETS
+)
+TOOL_SECONDS = Histogram(
+    "zenark_tool_seconds", "Tool execution latency", ["tool"], buckets=LATENCY_BUCKETS
+)
+MONGO_WRITE_SECONDS = Histogram(
+    "zenark_mongo_write_seconds", "MongoDB write latency", ["operation"], buckets=LATENCY_BUCKETS
+)
+TOOL_SELECTIONS = Counter(
+    "zenark_tool_selections_total", "Tools selected by the router", ["tool", "source"]
+)
+CACHE_LOOKUPS = Counter(
+    "zenark_cache_lookups_total", "Cache lookups by namespace and result", ["namespace", "result"]
+)
+LLM_ERRORS = Counter(
+    "zenark_llm_errors_total", "Failed LLM calls", ["model", "kind"]
+)
+
+
+def render() -> Tuple[bytes, str]:
+    """Exposition payload and content type (all workers in multiprocess mode)."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
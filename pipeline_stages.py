@@ -0,0 +1,101 @@
+"""
+Pipeline Stages
+Per-stage timeouts and latency recording for the /chat turn pipeline
+(history load, router memory, analysis, routing, marks lookup, tool, commit).
+
+Independent I/O stages are started together under asyncio.gather by the caller;
+run_stage() bounds each one with its own timeout and records how long it took,
+so /llm/stats (and the zenark_stage_seconds histogram at /metrics) shows where a
+turn spends its time.
+
+Timeouts (env, seconds):
+    STAGE_TIMEOUT_HISTORY_S        (default 3)
+    STAGE_TIMEOUT_ROUTER_MEMORY_S  (default 1)
+    STAGE_TIMEOUT_MARKS_S          (default 1.5)
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Deque, Dict, Iterator, Optional, TypeVar
+
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger("zenark.pipeline_stages")
+
+T = TypeVar("T")
+
+STAGE_TIMEOUTS: Dict[str, float] = {
+    "history": float(os.getenv("STAGE_TIMEOUT_HISTORY_S", "3")),
+    "router_memory": float(os.getenv("STAGE_TIMEOUT_ROUTER_MEMORY_S", "1")),
+    "marks": float(os.getenv("STAGE_TIMEOUT_MARKS_S", "1.5")),
+}
+
+
+class StageStats:
+    """Rolling latency window per stage plus timeout/error counters"""
+
+    def __init__(self, window: int = 512):
+        self.window = window
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, stage: str, seconds: float, outcome: str = "ok") -> None:
+        STAGE_SECONDS.labels(stage=stage).observe(seconds)
+        self._latencies.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+        counts = self._counts.setdefault(stage, {"ok": 0, "timeout": 0, "error": 0})
+        counts[outcome] += 1
+
+    @staticmethod
+    def _percentile(ordered: list, q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for stage, latencies in self._latencies.items():
+            ordered = sorted(latencies)
+            out[stage] = {
+                **self._counts[stage],
+                "p50_ms": round(self._percentile(ordered, 0.50) * 1000, 2),
+                "p95_ms": round(self._percentile(ordered, 0.95) * 1000, 2),
+                "timeout_s": STAGE_TIMEOUTS.get(stage)
+            }
+        return out
+
+
+stage_stats = StageStats()
+
+
+async def run_stage(stage: str, awaitable: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """
+    Await one pipeline stage with its timeout (STAGE_TIMEOUTS by default) and record its latency.
+    Timeouts raise asyncio.TimeoutError; callers decide the fallback for their stage.
+    """
+    if timeout is None:
+        timeout = STAGE_TIMEOUTS.get(stage)
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        stage_stats.record(stage, time.perf_counter() - start, "timeout")
+        logger.warning(f"⏱️ Stage '{stage}' timed out after {timeout}s")
+        raise
+    except Exception:
+        stage_stats.record(stage, time.perf_counter() - start, "error")
+        raise
+    stage_stats.record(stage, time.perf_counter() - start)
+    return result
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Record the latency of a synchronous (CPU) stage or of one that has no timeout of its own."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        stage_stats.record(stage, time.perf_counter() - start, outcome)
@@ -1,70 +1,222 @@
 """
-Simple Request Queue to Handle OpenAI Rate Limits
-Queues requests and processes them at 3 RPM (free tier limit)
+Outbound LLM Request Scheduler
+Every LLM call takes a slot from this queue before it goes out. Slots are granted
+in priority order (crisis > live chat > background reports/scoring), subject to
+token-bucket RPM/TPM limits and a cap on concurrent in-flight requests.
+
+Usage:
+    async with openai_queue.slot(tokens=estimated_tokens):
+        response = await llm.ainvoke(...)
+
+    with llm_priority(Priority.BACKGROUND):
+        ...  # every LLM call made in this block is scheduled as background work
 """
 
+import os
+import time
+import heapq
 import asyncio
-from collections import deque
-from datetime import datetime, timedelta
+import itertools
 import logging
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+
+class Priority(IntEnum):
+    """Lower value is served first"""
+    CRISIS = 0       # Safety-routed turns (moral risk, crisis follow-ups)
+    CHAT = 1         # Live /chat traffic
+    BACKGROUND = 2   # /generate_report, scoring and other batch work
+
+
+# Priority of LLM calls made in the current task (set per request/stage)
+_current_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar("llm_priority", default=Priority.CHAT)
+
+
+@contextmanager
+def llm_priority(priority: Priority) -> Iterator[None]:
+    """Schedule every LLM call made inside this block at `priority`."""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> Priority:
+    return _current_priority.get()
+
+
+class TokenBucket:
+    """Continuous-refill token bucket sized to one minute of budget"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0  # units per second
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available (requests larger than capacity wait for a full bucket)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
 class RequestQueue:
-    def __init__(self, max_requests_per_minute=3):
-        self.queue = deque()
+    def __init__(self, max_requests_per_minute=3, max_tokens_per_minute=200000, max_concurrency=8):
         self.max_rpm = max_requests_per_minute
-        self.request_times = deque()
-        self.processing = False
-    
-    async def add_request(self, request_func, *args, **kwargs):
-        """Add a request to the queue and wait for it to be processed"""
-        future = asyncio.Future()
-        self.queue.append((request_func, args, kwargs, future))
-        
-        # Start processing if not already running
-        if not self.processing:
-            asyncio.create_task(self._process_queue())
-        
-        # Wait for this request to be processed
-        return await future
-    
-    async def _process_queue(self):
-        """Process queued requests at max_rpm rate"""
-        self.processing = True
-        
-        while self.queue:
-            # Clean up old request times (older than 1 minute)
-            now = datetime.now()
-            while self.request_times and self.request_times[0] < now - timedelta(minutes=1):
-                self.request_times.popleft()
-            
-            # Check if we can make a request
-            if len(self.request_times) < self.max_rpm:
-                # Process next request
-                request_func, args, kwargs, future = self.queue.popleft()
-                
-                try:
-                    # Execute the request
-                    result = await request_func(*args, **kwargs)
-                    future.set_result(result)
-                    
-                    # Record request time
-                    self.request_times.append(datetime.now())
-                    
-                    logger.info(f"✅ Processed request. Queue size: {len(self.queue)}")
-                    
-                except Exception as e:
-                    future.set_exception(e)
-                    logger.error(f"❌ Request failed: {e}")
-            
-            else:
-                # Wait before checking again
-                wait_time = 60 / self.max_rpm  # seconds between requests
-                logger.info(f"⏳ Rate limit reached. Waiting {wait_time}s. Queue: {len(self.queue)}")
-                await asyncio.sleep(wait_time)
-        
-        self.processing = False
+        self.max_tpm = max_tokens_per_minute
+        self.max_concurrency = max(1, max_concurrency)
+        self._rpm_bucket = TokenBucket(max_requests_per_minute)
+        self._tpm_bucket = TokenBucket(max_tokens_per_minute)
+        # Heap of (priority, seq, future, tokens, enqueued_at)
+        self._heap: List[Tuple[int, int, asyncio.Future, int, float]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.in_flight = 0
+        # Metrics
+        self.completed = 0
+        self.failed = 0
+        self._waits: Dict[Priority, Deque[float]] = {p: deque(maxlen=1000) for p in Priority}
+        self._granted: Dict[Priority, int] = {p: 0 for p in Priority}
+        self._latencies: Deque[Tuple[float, float]] = deque(maxlen=500)  # (finished_at, seconds held) per LLM call
+
+    # ---------------------------------------------
+    # SLOT ACQUISITION
+    # ---------------------------------------------
+
+    async def acquire(self, priority: Optional[Priority] = None, tokens: int = 0) -> float:
+        """Wait for a slot; returns the time spent queued (seconds). Pair with release()."""
+        priority = current_priority() if priority is None else priority
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future = loop.create_future()
+        enqueued_at = time.monotonic()
+        heapq.heappush(self._heap, (int(priority), next(self._seq), future, tokens, enqueued_at))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # Slot was granted just before cancellation
+            raise
+        waited = time.monotonic() - enqueued_at
+        self._waits[priority].append(waited)
+        self._granted[priority] += 1
+        if waited > 1.0:
+            logger.info(f"⏳ LLM slot granted after {waited:.1f}s ({priority.name}). Queue: {self.depth()}")
+        return waited
+
+    def release(self, failed: bool = False) -> None:
+        self.in_flight = max(0, self.in_flight - 1)
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[Priority] = None, tokens: int = 0) -> AsyncIterator[float]:
+        """Hold one scheduler slot for the duration of the block."""
+        waited = await self.acquire(priority, tokens)
+        started = time.monotonic()
+        failed = False
+        try:
+            yield waited
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            finished = time.monotonic()
+            self._latencies.append((finished, finished - started))
+            self.release(failed=failed)
+
+    def _dispatch(self) -> None:
+        """Grant slots to queued requests in priority order while limits allow."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._heap and self.in_flight < self.max_concurrency:
+            _, _, future, tokens, _ = self._heap[0]
+            if future.done():  # Cancelled while waiting
+                heapq.heappop(self._heap)
+                continue
+            now = time.monotonic()
+            wait = max(self._rpm_bucket.wait_time(1, now), self._tpm_bucket.wait_time(tokens, now))
+            if wait > 0:
+                # Head of the queue is rate limited: re-check when its budget refills
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._heap)
+            self._rpm_bucket.consume(1)
+            self._tpm_bucket.consume(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+    async def add_request(self, request_func, *args, priority: Optional[Priority] = None, tokens: int = 0, **kwargs):
+        """Run `await request_func(*args, **kwargs)` inside a scheduler slot"""
+        async with self.slot(priority, tokens):
+            return await request_func(*args, **kwargs)
+
+    # ---------------------------------------------
+    # METRICS
+    # ---------------------------------------------
+
+    def depth(self) -> int:
+        return sum(1 for entry in self._heap if not entry[2].done())
+
+    def latency_p95(self, window_s: float = 60.0) -> float:
+        """p95 of LLM call durations that finished in the last `window_s` seconds (0 when none)."""
+        cutoff = time.monotonic() - window_s
+        ordered = sorted(duration for finished, duration in self._latencies if finished >= cutoff)
+        return ordered[int(0.95 * (len(ordered) - 1))] if ordered else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        depth_by_priority = {p.name: 0 for p in Priority}
+        for priority, _, future, _, _ in self._heap:
+            if not future.done():
+                depth_by_priority[Priority(priority).name] += 1
+
+        wait_stats = {}
+        for p, waits in self._waits.items():
+            ordered = sorted(waits)
+            wait_stats[p.name] = {
+                "granted": self._granted[p],
+                "avg_wait_s": round(sum(ordered) / len(ordered), 4) if ordered else 0.0,
+                "p95_wait_s": round(ordered[int(0.95 * (len(ordered) - 1))], 4) if ordered else 0.0,
+                "max_wait_s": round(ordered[-1], 4) if ordered else 0.0
+            }
+        return {
+            "queue_depth": sum(depth_by_priority.values()),
+            "depth_by_priority": depth_by_priority,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "rpm_limit": self.max_rpm,
+            "tpm_limit": self.max_tpm,
+            "completed": self.completed,
+            "failed": self.failed,
+            "latency_p95_s": round(self.latency_p95(), 4),
+            "wait": wait_stats
+        }
+
 
 # Global queue instance
-openai_queue = RequestQueue(max_requests_per_minute=3)
+openai_queue = RequestQueue(
+    max_requests_per_minute=int(os.getenv("LLM_QUEUE_RPM", "500")),
+    max_tokens_per_minute=int(os.getenv("LLM_QUEUE_TPM", "200000")),
+    max_concurrency=int(os.getenv("LLM_QUEUE_CONCURRENCY", "16"))
+)
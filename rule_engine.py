@@ -0,0 +1,200 @@
+"""
+Router Rule Engine
+Safety, academic and topic rules for Router, loaded from a versioned JSON file
+(router_rules.json) and compiled once into a single pattern per rule group.
+
+All patterns of a group are joined into one alternation that scans the
+(lowercased) message once; categories are then confirmed only at the positions
+where the scan hit. Rules are written in lowercase and matched case-sensitively
+against lowercased text, which is several times faster than re.IGNORECASE.
+
+The rules file is re-read when its mtime changes (checked at most every
+ROUTER_RULES_RELOAD_SECONDS); an invalid file is rejected and the last good
+rules stay active.
+
+Microbenchmark (compiled engine vs. per-pattern re.search loop):
+    python rule_engine.py bench
+"""
+import os
+import re
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("zenark.rule_engine")
+
+DEFAULT_RULES_PATH = os.getenv("ROUTER_RULES_PATH", "router_rules.json")
+RULE_GROUPS = ("safety", "academic", "topics")
+
+# Uppercase letter that is not a regex escape (\S, \W, \B, \D are fine)
+_UPPERCASE_LITERAL = re.compile(r"(?<!\\)[A-Z]")
+
+
+class CompiledRuleGroup:
+    """Ordered categories → patterns, compiled into one alternation for a single scan"""
+
+    def __init__(self, rules: Dict[str, List[str]]):
+        self.categories = list(rules)
+        self.patterns = rules
+        for category, patterns in rules.items():
+            for p in patterns:
+                if _UPPERCASE_LITERAL.search(p):
+                    raise ValueError(f"Rule for '{category}' must be lowercase (text is lowercased): {p}")
+        bodies = {c: "|".join(f"(?:{p})" for p in rules[c]) for c in self.categories}
+        self._anchored = [(c, re.compile(bodies[c])) for c in self.categories]
+        # All current rules start at a word boundary: test it once per position, not once per branch
+        every = [p for patterns in rules.values() for p in patterns]
+        if every and all(p.startswith(r"\b") for p in every):
+            self.scanner = re.compile(r"\b(?:" + "|".join(f"(?:{p[2:]})" for p in every) + ")")
+        else:
+            self.scanner = re.compile("|".join(f"(?:{p})" for p in every) or "(?!)")
+
+    def matches(self, text: str) -> List[str]:
+        """
+        All categories with a match anywhere in `text`, in declared (priority) order.
+        The scanner finds each position where some rule matches; every category is then
+        checked anchored at those positions only, so results equal a per-pattern re.search.
+        """
+        text = text.lower()
+        found = set()
+        pos = 0
+        while len(found) < len(self._anchored):
+            hit = self.scanner.search(text, pos)
+            if hit is None:
+                break
+            start = hit.start()
+            for category, regex in self._anchored:
+                if category not in found and regex.match(text, start):
+                    found.add(category)
+            pos = start + 1
+        return [c for c in self.categories if c in found]
+
+    def first(self, text: str) -> Optional[str]:
+        """Highest-priority matching category, if any."""
+        matched = self.matches(text)
+        return matched[0] if matched else None
+
+
+class RuleSet:
+    """One version of the router rules file, compiled"""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.version = data.get("version", 0)
+        missing = [g for g in RULE_GROUPS if not isinstance(data.get(g), dict)]
+        if missing:
+            raise ValueError(f"Rules file missing groups: {missing}")
+        self.safety = CompiledRuleGroup(data["safety"])
+        self.academic = CompiledRuleGroup(data["academic"])
+        self.topics = CompiledRuleGroup(data["topics"])
+
+
+class RuleEngine:
+    """Hot-reloading holder for the active RuleSet"""
+
+    def __init__(
+        self,
+        path: str = DEFAULT_RULES_PATH,
+        reload_interval: float = float(os.getenv("ROUTER_RULES_RELOAD_SECONDS", "5"))
+    ):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = os.path.getmtime(path)
+        self._checked_at = time.monotonic()
+        self._rules = self._load()
+        logger.info(f"✅ Router rules v{self._rules.version} loaded from {path}")
+
+    def _load(self) -> RuleSet:
+        with open(self.path, "r", encoding="utf-8") as f:
+            return RuleSet(json.load(f))
+
+    @property
+    def rules(self) -> RuleSet:
+        now = time.monotonic()
+        if now - self._checked_at >= self.reload_interval:
+            self._checked_at = now
+            self._maybe_reload()
+        return self._rules
+
+    def _maybe_reload(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            try:
+                rules = self._load()
+            except (OSError, ValueError, re.error) as e:
+                logger.error(f"❌ Router rules reload failed, keeping v{self._rules.version}: {e}")
+                self._mtime = mtime  # Don't retry the same broken file every interval
+                return
+            self._mtime = mtime
+            self._rules = rules
+            logger.info(f"🔄 Router rules reloaded: v{rules.version}")
+
+    @property
+    def version(self) -> Any:
+        return self.rules.version
+
+    def safety_tool(self, text: str) -> Optional[str]:
+        return self.rules.safety.first(text)
+
+    def academic_tool(self, text: str) -> Optional[str]:
+        return self.rules.academic.first(text)
+
+    def topic(self, text: str) -> str:
+        return self.rules.topics.first(text) or "general"
+
+
+def _benchmark(path: str = DEFAULT_RULES_PATH, rounds: int = 20000) -> None:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    rules = RuleSet(data)
+    group = rules.safety
+    samples = [
+        "i have my physics exam tomorrow and i am really nervous about it",
+        "my friends want me to try weed at the party later",
+        "sometimes i feel like i want to hurt myself",
+        "today was a good day, i finished my project and played football with my friends " * 3
+    ]
+
+    def legacy_matches(rule_group: str, text: str) -> List[str]:
+        return [c for c, patterns in data[rule_group].items() if any(re.search(p, text, re.IGNORECASE) for p in patterns)]
+
+    def legacy(text: str) -> Optional[str]:
+        for category, patterns in data["safety"].items():
+            if any(re.search(p, text, re.IGNORECASE) for p in patterns):
+                return category
+        return None
+
+    # Equivalence check over the bundled conversation texts
+    corpus = list(samples)
+    with open("positive_conversation.json", "r", encoding="utf-8") as f:
+        corpus += [item["patient_context"] for item in json.load(f)["dataset"] if isinstance(item.get("patient_context"), str)]
+    for rule_group in RULE_GROUPS:
+        compiled = getattr(rules, rule_group)
+        for text in corpus:
+            assert legacy_matches(rule_group, text) == compiled.matches(text), (rule_group, text)
+    print(f"Equivalent to per-pattern re.search on {len(corpus)} texts x {len(RULE_GROUPS)} rule groups")
+
+    for name, fn in (("per-pattern re.search", legacy), ("compiled engine", group.first)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in samples:
+                fn(text)
+        per_call = (time.perf_counter() - start) / (rounds * len(samples)) * 1e6
+        print(f"{name:>22}: {per_call:.2f} µs/message")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        _benchmark()
+    else:
+        print("Usage: python rule_engine.py bench")
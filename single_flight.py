@@ -0,0 +1,172 @@
+"""
+Single-Flight Request Coalescing
+Concurrent duplicate /chat requests (mobile double-submits, client retries) share
+one in-flight computation instead of running the pipeline twice. Only work that is
+still running is shared: once a turn finishes, the same text from the same session
+is a new message and runs again (a student may well answer "ok" twice).
+
+Requests carrying an idempotency key are the exception: their result is kept for
+IDEMPOTENCY_TTL_SECONDS, in this worker and in a shared cache namespace (L2 from
+CACHE_L2_URL), so a retry of that request after completion, on any worker, gets the
+original reply without a second turn. Duplicates that are in flight at the same
+time on two different workers are not merged: each worker only knows its own
+in-flight work.
+
+/chat/stream uses the same keys through SingleFlight.stream(): the request that
+runs the turn streams its events, and a duplicate receives only the final reply.
+
+Settings (env):
+    IDEMPOTENCY_TTL_SECONDS      (default 86400)
+"""
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from cache_backend import TieredCache
+
+logger = logging.getLogger("zenark.single_flight")
+
+
+def request_key(session_id: str, student_id: str, text: str, idempotency_key: Optional[str] = None) -> Tuple[str, bool]:
+    """
+    (coalescing key, is_idempotent). Idempotency keys are scoped to the student; without one
+    the key is the session, student and text, which only ever matches a turn still in flight.
+    """
+    if idempotency_key:
+        return f"idem:{student_id}:{idempotency_key}", True
+    digest = hashlib.sha256(text.strip().encode("utf-8")).hexdigest()[:16]
+    return f"dup:{session_id}:{student_id}:{digest}", False
+
+
+@dataclass
+class Completed:
+    """Last item of SingleFlight.stream(): the run's result, and whether another request produced it"""
+    result: Any
+    deduplicated: bool
+
+
+_END = object()
+
+
+class SingleFlight:
+    """Per-worker in-flight map plus a store of completed idempotent results"""
+
+    def __init__(
+        self,
+        namespace: str = "single_flight",
+        idempotency_ttl: float = 86400.0,
+        max_recent: int = 10000
+    ):
+        self.idempotency_ttl = idempotency_ttl
+        self.max_recent = max_recent
+        self._inflight: Dict[str, "asyncio.Task[Tuple[Any, bool]]"] = {}
+        self._recent: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self.shared = TieredCache.shared(namespace, ttl=idempotency_ttl)
+        self.executed = 0
+        self.coalesced = 0
+        self.replayed = 0
+
+    @classmethod
+    def from_env(cls) -> "SingleFlight":
+        return cls(idempotency_ttl=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400")))
+
+    def _recent_get(self, key: str) -> Optional[Any]:
+        entry = self._recent.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self._recent[key]
+            return None
+        return entry[0]
+
+    def _remember(self, key: str, result: Any) -> None:
+        self._recent[key] = (result, time.monotonic() + self.idempotency_ttl)
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_recent:
+            self._recent.popitem(last=False)
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]], idempotent: bool = False) -> Tuple[Any, bool]:
+        """
+        Run `fn` once per key: (result, deduplicated). Callers that join an in-flight run
+        share its result or its exception. Only idempotent results are replayed after the
+        run completes; failures are never remembered.
+        """
+        recent = self._recent_get(key) if idempotent else None
+        if recent is not None:
+            self.replayed += 1
+            return recent, True
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.info(f"🔁 Coalesced duplicate request {key[:40]}")
+            result, _ = await asyncio.shield(task)
+            return result, True
+
+        # The work runs as its own task: a client that disconnects (cancelling its request)
+        # neither cancels the duplicates waiting on it nor leaves the turn half-committed
+        task = asyncio.ensure_future(self._execute(key, fn, idempotent))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._finished(key, t))
+        return await asyncio.shield(task)
+
+    async def _execute(self, key: str, fn: Callable[[], Awaitable[Any]], idempotent: bool) -> Tuple[Any, bool]:
+        if idempotent:
+            stored = await self.shared.get(key)  # Completed on another worker
+            if stored is not None:
+                self.replayed += 1
+                return stored, True
+        self.executed += 1
+        result = await fn()
+        if idempotent:
+            self._remember(key, result)
+            await self.shared.set(key, result)
+        return result, False
+
+    async def stream(
+        self,
+        key: str,
+        produce: Callable[[Callable[[Any], None]], Awaitable[Any]],
+        idempotent: bool = False
+    ) -> AsyncIterator[Any]:
+        """
+        Streaming run(): the request that executes calls `produce(emit)` and every event it emits
+        is yielded as it happens. A request that joins an in-flight run or replays a result gets
+        no events. The last item is always Completed(result, deduplicated).
+        """
+        events: "asyncio.Queue[Any]" = asyncio.Queue()
+        flight = asyncio.ensure_future(self.run(key, lambda: produce(events.put_nowait), idempotent))
+
+        def finished(f: "asyncio.Future[Tuple[Any, bool]]") -> None:
+            if not f.cancelled():
+                f.exception()  # Retrieved even if the caller went away before reading it
+            events.put_nowait(_END)
+
+        flight.add_done_callback(finished)
+        try:
+            while (event := await events.get()) is not _END:
+                yield event
+            result, deduplicated = flight.result()
+        finally:
+            flight.cancel()  # Only this caller's wait: the run itself is shielded and still commits
+        yield Completed(result, deduplicated)
+
+    def _finished(self, key: str, task: "asyncio.Task[Tuple[Any, bool]]") -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Retrieved here so an error nobody awaited is not logged as unhandled
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": len(self._inflight),
+            "recent_idempotent": len(self._recent),
+            "idempotency_ttl_seconds": self.idempotency_ttl,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed
+        }
@@ -0,0 +1,218 @@
+"""
+Per-Student Router Memory (LTM)
+One bounded document per student in `student_memory` (_id = student_id), so
+long-term router memory spans sessions and is loaded with a single _id lookup:
+- tool_preferences:  tool → count ($inc; the router's tool set is closed, read back as top-k)
+- conversation_count ($inc)
+- emotion_decay:     forward-decayed emotion histogram, {period: {emotion: weight}}. Each
+                     observation $incs 2^(age/half-life) measured from the start of its decay
+                     period (DECAY_PERIOD_HALF_LIVES half-lives long), so stored weights stay
+                     below 2^DECAY_PERIOD_HALF_LIVES and never need rewriting; readers
+                     combine the periods in log space. Periods older than the previous one
+                     are $unset as new observations arrive.
+- emotion_weights:   legacy single-epoch histogram (weights relative to EPOCH), still read
+- recent_topics:     last LTM_RECENT_TOPICS topics ($push + $slice)
+- conversation_flow: last 10 interactions ($push + $slice)
+
+The legacy `router_memory` collection held one document per (session, student).
+Fold those into per-student documents and delete them with:
+    python student_memory.py compact [--keep]
+"""
+import os
+import math
+import logging
+import datetime
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("zenark.student_memory")
+
+STUDENT_MEMORY_COLLECTION = "student_memory"
+LEGACY_COLLECTION = "router_memory"
+
+TOP_TOOLS = int(os.getenv("LTM_TOP_TOOLS", "5"))
+RECENT_TOPICS = int(os.getenv("LTM_RECENT_TOPICS", "20"))
+FLOW_LENGTH = 10
+EMOTION_HALF_LIFE_DAYS = float(os.getenv("LTM_EMOTION_HALF_LIFE_DAYS", "14"))
+
+DECAY_PERIOD_HALF_LIVES = 32
+
+# Forward decay reference point: period 0 starts here (and legacy emotion_weights are relative to it)
+EPOCH = datetime.datetime(2025, 1, 1)
+
+
+def _half_lives_since_epoch(ts: datetime.datetime) -> float:
+    return (ts - EPOCH).total_seconds() / 86400.0 / EMOTION_HALF_LIFE_DAYS
+
+
+def decay_weight(ts: datetime.datetime) -> Tuple[str, float]:
+    """(decay period, stored weight) of one observation at `ts`; the weight is in [1, 2^DECAY_PERIOD_HALF_LIVES)."""
+    half_lives = max(0.0, _half_lives_since_epoch(ts))
+    period = int(half_lives // DECAY_PERIOD_HALF_LIVES)
+    return str(period), math.pow(2.0, half_lives - period * DECAY_PERIOD_HALF_LIVES)
+
+
+def emotion_histogram(doc: Dict[str, Any], now: Optional[datetime.datetime] = None) -> Dict[str, float]:
+    """Decayed emotion weights of a student document as of `now`, in observation units (1.0 = one today)."""
+    now_half_lives = _half_lives_since_epoch(now or datetime.datetime.utcnow())
+    # (half-lives from EPOCH to the weights' base, weights)
+    sources = [(0.0, doc.get("emotion_weights") or {})]
+    for period, weights in (doc.get("emotion_decay") or {}).items():
+        sources.append((int(period) * DECAY_PERIOD_HALF_LIVES, weights))
+    histogram: Dict[str, float] = {}
+    for base, weights in sources:
+        for emotion, w in weights.items():
+            if not w or w <= 0:
+                continue
+            # log2(w) + base - now: never forms the raw growth factor, so no overflow
+            exponent = math.log2(w) + base - now_half_lives
+            if exponent > -1000:
+                histogram[emotion] = histogram.get(emotion, 0.0) + math.pow(2.0, min(exponent, 1000.0))
+    return {emotion: round(w, 4) for emotion, w in histogram.items()}
+
+
+def merge_emotion_deltas(*deltas: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """Sum {period: {emotion: weight}} deltas."""
+    merged: Dict[str, Dict[str, float]] = {}
+    for delta in deltas:
+        for period, weights in delta.items():
+            target = merged.setdefault(period, {})
+            for emotion, w in weights.items():
+                target[emotion] = target.get(emotion, 0.0) + w
+    return merged
+
+
+def top_tools(tool_counts: Dict[str, int], k: int = TOP_TOOLS) -> Dict[str, int]:
+    return dict(Counter(tool_counts).most_common(k))
+
+
+def dominant_emotions(weights: Dict[str, float], k: int = 3) -> List[str]:
+    return [emotion for emotion, _ in Counter(weights).most_common(k)]
+
+
+def recurring_topics(topics: List[str], k: int = 3) -> List[str]:
+    return [topic for topic, _ in Counter(topics).most_common(k)]
+
+
+def student_update(
+    tool_counts: Dict[str, int],
+    conversations: int,
+    emotion_weights: Dict[str, Dict[str, float]],
+    topics: List[str],
+    flow: List[Dict[str, str]],
+    last_state: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Incremental update document for one student: $inc counters/weights, capped $push lists."""
+    inc: Dict[str, Any] = {f"tool_preferences.{t}": n for t, n in tool_counts.items()}
+    inc.update({
+        f"emotion_decay.{period}.{e}": w
+        for period, weights in emotion_weights.items() for e, w in weights.items()
+    })
+    inc["conversation_count"] = conversations
+    now = datetime.datetime.utcnow()
+    update: Dict[str, Any] = {
+        "$inc": inc,
+        "$set": {**last_state, "updated_at": now},
+        "$setOnInsert": {"created_at": now}
+    }
+    if emotion_weights:
+        # Weights two periods back are below 2^-DECAY_PERIOD_HALF_LIVES of today's: drop them
+        stale = str(max(int(p) for p in emotion_weights) - 2)
+        if stale not in emotion_weights:
+            update["$unset"] = {f"emotion_decay.{stale}": ""}
+    push: Dict[str, Any] = {}
+    if topics:
+        push["recent_topics"] = {"$each": topics, "$slice": -RECENT_TOPICS}
+    if flow:
+        push["conversation_flow"] = {"$each": flow, "$slice": -FLOW_LENGTH}
+    if push:
+        update["$push"] = push
+    return update
+
+
+# ============================================
+# LEGACY COMPACTION (router_memory → student_memory)
+# ============================================
+
+def _legacy_delta(docs: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge one student's per-session documents (oldest first) into a single update."""
+    tool_counts: Counter = Counter()
+    emotion_weights: Dict[str, Dict[str, float]] = {}
+    topics: List[str] = []
+    flow: List[Dict[str, str]] = []
+    conversations = 0
+    last_state: Dict[str, Any] = {}
+    for doc in docs:
+        tool_counts.update(doc.get("tool_preferences") or {})
+        conversations += int(doc.get("conversation_count") or 0)
+        # Sessions only kept their top-3 emotions: count each once, decayed by the session's last update
+        period, weight = decay_weight(doc.get("updated_at") or EPOCH)
+        for emotion in doc.get("dominant_emotions") or []:
+            emotion_weights = merge_emotion_deltas(emotion_weights, {period: {emotion: weight}})
+        topics.extend(doc.get("recurring_topics") or [])
+        flow.extend(doc.get("conversation_flow") or [])
+        last_state = {
+            "last_tool": doc.get("last_tool"),
+            "last_emotion": doc.get("last_emotion"),
+            "last_session_id": doc.get("session_id")
+        }
+    update = student_update(
+        dict(tool_counts), conversations, emotion_weights,
+        topics[-RECENT_TOPICS:], flow[-FLOW_LENGTH:], last_state
+    )
+    # Live updates since the switch may be newer than any legacy session: don't overwrite them
+    for field in ("last_tool", "last_emotion", "last_session_id", "updated_at"):
+        update["$setOnInsert"][field] = update["$set"].pop(field)
+    # Legacy entries are older than anything pushed live: put them in front so $slice drops them first
+    for spec in update.get("$push", {}).values():
+        spec["$position"] = 0
+    update["$set"]["legacy_compacted"] = True
+    return update
+
+
+def compact_legacy(db, delete: bool = True) -> Dict[str, int]:
+    """
+    Fold per-session router_memory documents into student_memory, one student at a time.
+    The merge and the `legacy_compacted` flag land in one atomic update, so a rerun after a
+    crash skips the merge for that student and only finishes deleting its session documents.
+    Run once every worker writes per-student memory (no new legacy documents appear).
+    """
+    legacy = db[LEGACY_COLLECTION]
+    students = db[STUDENT_MEMORY_COLLECTION]
+    totals = {"students": 0, "merged": 0, "skipped": 0, "deleted": 0}
+    for student_id in legacy.distinct("student_id"):
+        docs = list(legacy.find({"student_id": student_id}).sort("updated_at", 1))
+        if not docs:
+            continue
+        totals["students"] += 1
+        target = students.find_one({"_id": student_id}, {"legacy_compacted": 1}) or {}
+        if target.get("legacy_compacted"):
+            totals["skipped"] += 1
+        else:
+            students.update_one({"_id": student_id}, _legacy_delta(docs), upsert=True)
+            totals["merged"] += 1
+        if delete:
+            result = legacy.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+            totals["deleted"] += result.deleted_count
+    return totals
+
+
+if __name__ == "__main__":
+    import sys
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if len(sys.argv) < 2 or sys.argv[1] != "compact":
+        print("Usage: python student_memory.py compact [--keep]")
+        sys.exit(1)
+    mongo_uri = os.getenv("MONGO_DB_OFFICIAL")
+    db_name = os.getenv("MONGO_DB_NAME_OFFICIAL")
+    if not mongo_uri or not db_name:
+        print("MONGO_DB_OFFICIAL and MONGO_DB_NAME_OFFICIAL must be set")
+        sys.exit(1)
+    mongo = MongoClient(mongo_uri, tls=True, tlsAllowInvalidCertificates=True)
+    try:
+        stats = compact_legacy(mongo[db_name], delete="--keep" not in sys.argv)
+        logger.info(f"🗜️ Router memory compaction done: {stats}")
+    finally:
+        mongo.close()
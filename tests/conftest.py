@@ -0,0 +1,57 @@
+"""
+Shared test fixtures.
+Mongo tests run against mongomock by default; set TEST_MONGO_URI to run them
+against a throwaway MongoDB instead (each test gets its own database, dropped afterwards).
+"""
+import os
+import uuid
+import inspect
+
+import mongomock
+import pytest
+
+TEST_MONGO_URI = os.getenv("TEST_MONGO_URI")
+
+# pymongo >= 4.11 passes `sort` to bulk update builders; mongomock 4.3 predates it
+_add_update = mongomock.collection.BulkOperationBuilder.add_update
+if "sort" not in inspect.signature(_add_update).parameters:
+    def _add_update_ignoring_sort(self, *args, sort=None, **kwargs):
+        return _add_update(self, *args, **kwargs)
+
+    mongomock.collection.BulkOperationBuilder.add_update = _add_update_ignoring_sort
+
+
+@pytest.fixture
+def db():
+    """Sync (pymongo) database"""
+    if not TEST_MONGO_URI:
+        yield mongomock.MongoClient()["zenark_test"]
+        return
+    from pymongo import MongoClient
+
+    client = MongoClient(TEST_MONGO_URI)
+    name = f"zenark_test_{uuid.uuid4().hex[:8]}"
+    try:
+        yield client[name]
+    finally:
+        client.drop_database(name)
+        client.close()
+
+
+@pytest.fixture
+async def async_db():
+    """Async (Motor) database"""
+    if not TEST_MONGO_URI:
+        from mongomock_motor import AsyncMongoMockClient
+
+        yield AsyncMongoMockClient()["zenark_test"]
+        return
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(TEST_MONGO_URI)
+    name = f"zenark_test_{uuid.uuid4().hex[:8]}"
+    try:
+        yield client[name]
+    finally:
+        await client.drop_database(name)
+        client.close()
@@ -0,0 +1,158 @@
+"""cache_backend: L2 circuit breaker, unsynced shared lists and atomic list appends"""
+import asyncio
+
+import pytest
+
+import cache_backend
+from cache_backend import L2CircuitBreaker, MemoryBackend, RedisBackend, TieredCache
+
+
+class FlakyBackend(MemoryBackend):
+    """MemoryBackend that raises while `down` is set and counts every call that reaches it"""
+
+    def __init__(self):
+        super().__init__()
+        self.down = False
+        self.calls = 0
+
+    def _reach(self) -> None:
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("connect timeout")
+
+    async def get(self, key):
+        self._reach()
+        return await super().get(key)
+
+    async def set(self, key, value, ttl):
+        self._reach()
+        await super().set(key, value, ttl)
+
+    async def delete(self, key):
+        self._reach()
+        await super().delete(key)
+
+    async def get_list(self, key):
+        self._reach()
+        return await super().get_list(key)
+
+    async def set_list(self, key, items, ttl):
+        self._reach()
+        await super().set_list(key, items, ttl)
+
+    async def push_list(self, key, items, max_len, ttl):
+        self._reach()
+        return await super().push_list(key, items, max_len, ttl)
+
+
+@pytest.fixture
+def l2(monkeypatch):
+    monkeypatch.setattr(cache_backend, "_breakers", {})
+    monkeypatch.setattr(TieredCache, "_instances", [])
+    return FlakyBackend()
+
+
+def _open_for(cache: TieredCache, seconds: float) -> None:
+    cache.breaker.retry_seconds = seconds
+
+
+async def test_breaker_skips_l2_after_an_error(l2):
+    cache = TieredCache("response", ttl=60, l2=l2)
+    _open_for(cache, 60)
+    l2.down = True
+
+    assert await cache.get("a") is None
+    assert l2.calls == 1
+    for key in "bcdef":
+        assert await cache.get(key) is None
+    await cache.set("g", {"x": 1})
+
+    assert l2.calls == 1  # Every call after the first error stayed on L1
+    assert await cache.get("g") == {"x": 1}  # L1 still serves
+    stats = cache.stats()
+    assert stats["l2_errors"] == 1
+    assert stats["l2_breaker"]["open"] and stats["l2_breaker"]["skipped"] == 6
+
+
+async def test_breaker_is_shared_by_namespaces_on_the_same_server(l2):
+    response = TieredCache("response", ttl=60, l2=l2)
+    history = TieredCache("history", ttl=60, l2=l2)
+    _open_for(response, 60)
+    l2.down = True
+
+    await response.get("a")
+    assert await history.get_list("s1") is None
+    assert l2.calls == 1
+
+
+async def test_single_probe_after_the_retry_period_then_recovers(l2):
+    cache = TieredCache("response", ttl=60, l2=l2)
+    _open_for(cache, 0.05)
+    l2.down = True
+    await cache.get("a")
+    await asyncio.sleep(0.06)
+
+    await cache.get("a")  # Probe fails: open again without letting the next call through
+    await cache.get("a")
+    assert l2.calls == 2
+
+    l2.down = False
+    await asyncio.sleep(0.06)
+    await cache.set("a", 1)
+    await cache.get("b")
+    assert l2.calls == 4
+    assert not cache.stats()["l2_breaker"]["open"]
+    assert cache.breaker.trips == 1
+
+
+def test_breaker_half_open_lets_one_caller_through():
+    breaker = L2CircuitBreaker(retry_seconds=0)
+    breaker.failure()
+    breaker.retry_seconds = 60
+
+    assert breaker.allow()      # The probe
+    assert not breaker.allow()  # Everyone else waits for its result
+    breaker.success()
+    assert breaker.allow()
+
+
+async def test_missed_append_drops_the_shared_list_once_l2_is_back(l2):
+    cache = TieredCache("history", ttl=60, l2=l2)
+    _open_for(cache, 0.05)
+    await cache.set_list("s1", [{"role": "user", "content": "hi"}])
+
+    l2.down = True
+    await cache.push_list("s1", [{"role": "assistant", "content": "hello"}], max_len=10)
+    l2.down = False
+    await asyncio.sleep(0.06)
+
+    # The list is missing a message: it must read as a miss (rebuilt from Mongo), never as complete
+    assert await cache.get_list("s1") is None
+    assert await l2.get_list("zenark:history:s1") is None
+    await cache.set_list("s1", [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}])
+    assert len(await cache.get_list("s1")) == 2
+
+
+async def test_push_list_only_extends_existing_lists(l2):
+    cache = TieredCache("history", ttl=60, l2=l2)
+
+    await cache.push_list("s1", ["a"], max_len=2)
+    assert await cache.get_list("s1") is None
+
+    await cache.set_list("s1", ["a"])
+    await cache.push_list("s1", ["b", "c"], max_len=2)
+    assert await cache.get_list("s1") == ["b", "c"]
+
+
+async def test_redis_push_list_is_conditional_and_atomic():
+    fakeredis = pytest.importorskip("fakeredis")
+    backend = RedisBackend.__new__(RedisBackend)
+    backend._client = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    assert await backend.push_list("k", ["a"], max_len=3, ttl=60) is False
+    assert await backend.get_list("k") is None
+
+    await backend.set_list("k", ["a", "b"], ttl=60)
+    assert await backend.push_list("k", ["c", "d"], max_len=3, ttl=60) is True
+    assert await backend.get_list("k") == ["b", "c", "d"]
+    assert 0 < await backend._client.pttl("k") <= 60000
@@ -0,0 +1,108 @@
+"""chat_buckets: legacy inline migration and ordered reads"""
+import datetime
+
+from chat_buckets import bucket_updates, load_session_messages, migrate_session
+
+T0 = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _msg(n: int, role: str = "user") -> dict:
+    return {"role": role, "content": f"m{n}", "timestamp": T0 + datetime.timedelta(seconds=n)}
+
+
+def _legacy_session(chats, session_id: str = "s1", count: int = 3) -> dict:
+    chats.insert_one({"session_id": session_id, "userId": "u1", "timestamp": T0,
+                      "messages": [_msg(n) for n in range(count)]})
+    return chats.find_one({"session_id": session_id})
+
+
+def _contents(buckets, session_id: str = "s1", seq_filter: dict = None) -> list:
+    query = {"session_id": session_id, **({"seq": seq_filter} if seq_filter else {})}
+    out = []
+    for bucket in buckets.find(query).sort("seq", 1):
+        out.extend(m["content"] for m in sorted(bucket["messages"], key=lambda m: m["i"]))
+    return out
+
+
+def test_migration_moves_inline_messages_to_negative_buckets(db):
+    chats, buckets = db["chat_sessions"], db["chat_buckets"]
+    doc = _legacy_session(chats)
+    # A live commit already landed at position 0 (seq 0) before the migration ran
+    buckets.bulk_write(bucket_updates("s1", "u1", 0, [_msg(10)]))
+
+    assert migrate_session(chats, buckets, doc) == 3
+
+    assert "messages" not in chats.find_one({"session_id": "s1"})
+    assert _contents(buckets, seq_filter={"$lt": 0}) == ["m0", "m1", "m2"]
+    assert [m["i"] for b in buckets.find({"seq": {"$lt": 0}}) for m in b["messages"]] == [-3, -2, -1]
+    assert _contents(buckets, seq_filter={"$gte": 0}) == ["m10"]
+
+
+def test_dry_run_writes_nothing(db):
+    chats, buckets = db["chat_sessions"], db["chat_buckets"]
+    doc = _legacy_session(chats)
+
+    assert migrate_session(chats, buckets, doc, dry_run=True) == 3
+    assert buckets.count_documents({}) == 0
+    assert len(chats.find_one({"session_id": "s1"})["messages"]) == 3
+
+
+def test_rerun_after_interrupted_run_replaces_leftover_negative_buckets(db):
+    chats, buckets = db["chat_sessions"], db["chat_buckets"]
+    doc = _legacy_session(chats, count=5)
+    # An interrupted run wrote part of the negative buckets, then died before the $unset
+    buckets.bulk_write(bucket_updates("s1", "u1", -5, [_msg(n) for n in range(2)], bucket_size=2))
+    buckets.bulk_write(bucket_updates("s1", "u1", 0, [_msg(10)]))
+
+    assert migrate_session(chats, buckets, doc) == 5
+
+    assert _contents(buckets, seq_filter={"$lt": 0}) == ["m0", "m1", "m2", "m3", "m4"]
+    assert sum(b["count"] for b in buckets.find({"seq": {"$lt": 0}})) == 5
+    assert _contents(buckets, seq_filter={"$gte": 0}) == ["m10"]
+    # Running again is a no-op: the inline array is gone
+    assert migrate_session(chats, buckets, chats.find_one({"session_id": "s1"})) == 0
+    assert _contents(buckets) == ["m0", "m1", "m2", "m3", "m4", "m10"]
+
+
+def test_inline_write_during_migration_undoes_and_is_picked_up_next_run(db):
+    chats, buckets = db["chat_sessions"], db["chat_buckets"]
+    stale = _legacy_session(chats)
+    # An old-code worker appends inline after the migration read the document
+    chats.update_one({"session_id": "s1"}, {"$push": {"messages": _msg(3)}})
+
+    assert migrate_session(chats, buckets, stale) == 0
+
+    assert buckets.count_documents({"seq": {"$lt": 0}}) == 0
+    assert [m["content"] for m in chats.find_one({"session_id": "s1"})["messages"]] == ["m0", "m1", "m2", "m3"]
+
+    assert migrate_session(chats, buckets, chats.find_one({"session_id": "s1"})) == 4
+    assert _contents(buckets) == ["m0", "m1", "m2", "m3"]
+
+
+async def _read(db, session_id: str = "s1", max_chars=None) -> list:
+    doc = await db["chat_sessions"].find_one({"session_id": session_id})
+    return [m["content"] for m in await load_session_messages(db["chat_buckets"], doc, max_chars=max_chars)]
+
+
+async def test_load_session_messages_orders_inline_then_buckets_without_duplicates(async_db):
+    chats, buckets = async_db["chat_sessions"], async_db["chat_buckets"]
+    await chats.insert_one({"session_id": "s1", "userId": "u1", "timestamp": T0,
+                            "messages": [_msg(n) for n in range(3)]})
+    await buckets.bulk_write(bucket_updates("s1", "u1", 0, [_msg(n) for n in range(10, 13)], bucket_size=2))
+    # Mid-migration: negative buckets written, inline array not yet dropped
+    await buckets.bulk_write(bucket_updates("s1", "u1", -3, [_msg(n) for n in range(3)], bucket_size=2))
+
+    assert await _read(async_db) == ["m0", "m1", "m2", "m10", "m11", "m12"]
+
+    # Migration finished: the same order now comes from the negative buckets alone
+    await chats.update_one({"session_id": "s1"}, {"$unset": {"messages": ""}})
+    assert await _read(async_db) == ["m0", "m1", "m2", "m10", "m11", "m12"]
+
+
+async def test_load_session_messages_stops_after_max_chars(async_db):
+    chats, buckets = async_db["chat_sessions"], async_db["chat_buckets"]
+    await chats.insert_one({"session_id": "s1", "userId": "u1", "timestamp": T0})
+    await buckets.bulk_write(bucket_updates("s1", "u1", 0, [_msg(n) for n in range(10, 16)], bucket_size=2))
+
+    # Each message is 3 chars: the first bucket has 6, the second reaches 12, the third is never read
+    assert await _read(async_db, max_chars=7) == ["m10", "m11", "m12", "m13"]
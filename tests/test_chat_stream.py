@@ -0,0 +1,94 @@
+"""
+/chat/stream: stream_response driven end to end with the offline LLM simulator
+(LLM_PROVIDER=simulator) against the test database, no network or API keys.
+"""
+import os
+
+os.environ["LLM_PROVIDER"] = "simulator"
+os.environ.setdefault("LLM_SIM_LATENCY_DIST", "fixed")
+os.environ.setdefault("LLM_SIM_LATENCY_MS", "5")
+os.environ.setdefault("LLM_SIM_STREAM_TOKENS_PER_S", "5000")
+os.environ.setdefault("MONGO_DB_OFFICIAL", "mongodb://localhost:27017")
+os.environ.setdefault("MONGO_DB_NAME_OFFICIAL", "zenark_test")
+os.environ.pop("CACHE_L2_URL", None)
+
+import asyncio
+import uuid
+
+import pytest
+
+import langraph_tool as app
+from single_flight import Completed
+
+TEXT = "I have been feeling really stressed about my board exams and cannot focus"
+
+
+@pytest.fixture
+async def db(async_db, monkeypatch):
+    monkeypatch.setattr(app, "chats_col", async_db["chat_sessions"])
+    monkeypatch.setattr(app, "chat_buckets_col", async_db["chat_buckets"])
+    monkeypatch.setattr(app, "student_memory_col", async_db["student_memory"])
+    yield async_db
+    await app.router_memory_store.flush()
+
+
+@pytest.fixture
+def ids():
+    return f"session-{uuid.uuid4().hex[:8]}", uuid.uuid4().hex[:24]
+
+
+async def _stored_messages(db, session_id: str) -> list:
+    doc = await db["chat_sessions"].find_one({"session_id": session_id})
+    messages = await app.load_session_messages(db["chat_buckets"], doc)
+    return [(m["role"], m["content"]) for m in messages]
+
+
+async def _collect(key: str, session_id: str, student_id: str, text: str = TEXT) -> list:
+    return [
+        item async for item in app.chat_single_flight.stream(
+            key, lambda emit: app.run_stream_turn(session_id, text, student_id, emit)
+        )
+    ]
+
+
+async def test_stream_response_tokens_concatenate_to_the_done_reply(db, ids):
+    session_id, student_id = ids
+    context = await app.ConversationContext.load(session_id, student_id)
+    context.memory.stage_user(TEXT)
+
+    events = [event async for event in app.stream_response(context, TEXT)]
+
+    tokens = [e["content"] for e in events if e["type"] == "token"]
+    done = events[-1]
+    assert done["type"] == "done" and done["tool"]
+    assert len(tokens) > 1  # Streamed word by word, not sent as one block
+    assert "".join(tokens) == done["response"] != ""
+
+
+async def test_stream_turn_is_committed_once(db, ids):
+    session_id, student_id = ids
+
+    items = await _collect(f"dup:{session_id}", session_id, student_id)
+
+    completed = items[-1]
+    events = items[:-1]
+    assert isinstance(completed, Completed) and not completed.deduplicated
+    assert "".join(e["content"] for e in events if e["type"] == "token") == completed.result
+    assert events[-1]["session_id"] == session_id
+    assert await _stored_messages(db, session_id) == [("user", TEXT), ("assistant", completed.result)]
+    session = await db["chat_sessions"].find_one({"session_id": session_id})
+    assert session["tool_history"] == [events[-1]["tool"]]
+
+
+async def test_duplicate_stream_in_flight_runs_and_stores_the_turn_once(db, ids):
+    session_id, student_id = ids
+    key = f"dup:{session_id}"
+
+    first, second = await asyncio.gather(
+        _collect(key, session_id, student_id), _collect(key, session_id, student_id)
+    )
+
+    assert [first[-1].deduplicated, second[-1].deduplicated] == [False, True]
+    assert first[-1].result == second[-1].result
+    assert second[:-1] == []  # The duplicate gets the reply only, never a second run's tokens
+    assert await _stored_messages(db, session_id) == [("user", TEXT), ("assistant", first[-1].result)]
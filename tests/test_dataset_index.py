@@ -0,0 +1,31 @@
+"""dataset_index: BM25 search over raw text and over precomputed TextFeatures tokens"""
+from dataset_index import BM25Index
+from text_features import text_features
+
+ITEMS = [
+    {"category": "anxiety", "empathic_response": "Exams can make sleep really hard."},
+    {"category": "family", "empathic_response": "Arguments at home are exhausting."},
+    {"category": "anxiety", "empathic_response": "Feeling nervous before a test is common."},
+]
+
+
+def test_search_with_feature_tokens_matches_raw_text():
+    index = BM25Index(ITEMS, fields=["empathic_response"], filter_fields=["category"])
+    text = "I can't SLEEP before my exams, so nervous!"
+    features = text_features(text)
+
+    by_text = index.search(text, k=3)
+    by_tokens = index.search(text, k=3, tokens=features["tokens"])
+
+    assert [(h.item["empathic_response"], h.score) for h in by_text] == \
+        [(h.item["empathic_response"], h.score) for h in by_tokens]
+    assert by_text[0].item is ITEMS[0]
+
+
+def test_search_filters_and_drops_zero_scores():
+    index = BM25Index(ITEMS, fields=["empathic_response"], filter_fields=["category"])
+
+    hits = index.search("home exams", k=3, filters={"category": {"family"}})
+
+    assert [h.item for h in hits] == [ITEMS[1]]
+    assert index.search("unrelated words", k=3) == []
@@ -0,0 +1,144 @@
+"""request_queue: priority order, RPM/TPM waits and cancellation"""
+import asyncio
+import time
+
+import pytest
+
+from request_queue import Priority, RequestQueue, llm_priority
+
+
+async def _settle() -> None:
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+async def test_crisis_is_served_before_chat_and_background():
+    queue = RequestQueue(max_requests_per_minute=10000, max_concurrency=1)
+    await queue.acquire(Priority.CHAT)  # Occupy the only slot so everything below queues
+    order = []
+
+    async def call(priority: Priority, name: str) -> None:
+        async with queue.slot(priority):
+            order.append(name)
+
+    tasks = [asyncio.create_task(call(p, p.name)) for p in (Priority.BACKGROUND, Priority.CHAT, Priority.CRISIS)]
+    await _settle()
+    assert queue.stats()["depth_by_priority"] == {"CRISIS": 1, "CHAT": 1, "BACKGROUND": 1}
+
+    queue.release()
+    await asyncio.gather(*tasks)
+    assert order == ["CRISIS", "CHAT", "BACKGROUND"]
+    assert queue.in_flight == 0
+
+
+async def test_equal_priority_is_first_come_first_served():
+    queue = RequestQueue(max_requests_per_minute=10000, max_concurrency=1)
+    await queue.acquire()
+    order = []
+
+    async def call(n: int) -> None:
+        async with queue.slot(Priority.BACKGROUND):
+            order.append(n)
+
+    tasks = []
+    for n in range(5):
+        tasks.append(asyncio.create_task(call(n)))
+        await _settle()
+    queue.release()
+    await asyncio.gather(*tasks)
+    assert order == [0, 1, 2, 3, 4]
+
+
+async def test_priority_defaults_to_the_context():
+    queue = RequestQueue(max_requests_per_minute=10000)
+    with llm_priority(Priority.CRISIS):
+        await queue.acquire()
+    queue.release()
+    assert queue.stats()["wait"]["CRISIS"]["granted"] == 1
+
+
+async def test_rpm_limit_rearms_the_timer_for_each_waiter():
+    # 6000 RPM refills one request every 10ms once the bucket is empty
+    queue = RequestQueue(max_requests_per_minute=6000, max_concurrency=10)
+    queue._rpm_bucket.tokens = 0
+    started = time.monotonic()
+
+    waits = await asyncio.wait_for(asyncio.gather(*(queue.acquire() for _ in range(3))), timeout=2)
+
+    assert time.monotonic() - started >= 0.025
+    assert waits == sorted(waits)
+    assert queue.in_flight == 3
+
+
+async def test_release_while_rate_limited_keeps_the_timer():
+    queue = RequestQueue(max_requests_per_minute=6000, max_concurrency=10)
+    await queue.acquire()
+    queue._rpm_bucket.tokens = 0
+    waiter = asyncio.create_task(queue.acquire())
+    await _settle()
+    assert queue._timer is not None
+
+    # release() re-dispatches and cancels the pending timer; the limited head must re-arm it
+    queue.release()
+    assert queue._timer is not None
+    await asyncio.wait_for(waiter, timeout=2)
+    assert queue.in_flight == 1
+
+
+async def test_tpm_limit_delays_large_requests():
+    # 60000 TPM refills 1000 tokens per second
+    queue = RequestQueue(max_requests_per_minute=10000, max_tokens_per_minute=60000)
+    queue._tpm_bucket.tokens = 0
+    started = time.monotonic()
+
+    await asyncio.wait_for(queue.acquire(tokens=50), timeout=2)
+
+    assert time.monotonic() - started >= 0.04
+    assert queue.in_flight == 1
+
+
+async def test_cancelled_while_queued_leaves_no_slot_behind():
+    queue = RequestQueue(max_requests_per_minute=10000, max_concurrency=1)
+    await queue.acquire()
+    waiter = asyncio.create_task(queue.acquire())
+    await _settle()
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    queue.release()
+
+    assert queue.in_flight == 0
+    assert queue.depth() == 0
+    await asyncio.wait_for(queue.acquire(), timeout=1)
+    assert queue.in_flight == 1
+
+
+async def test_cancelled_after_grant_releases_the_slot():
+    queue = RequestQueue(max_requests_per_minute=10000, max_concurrency=1)
+    await queue.acquire()
+    waiter = asyncio.create_task(queue.acquire())
+    await _settle()
+
+    # Grant the slot and cancel before the waiter gets to run
+    queue.release()
+    assert queue.in_flight == 1
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    assert queue.in_flight == 0
+    await asyncio.wait_for(queue.acquire(), timeout=1)
+
+
+async def test_slot_releases_on_error_and_counts_failures():
+    queue = RequestQueue(max_requests_per_minute=10000)
+    with pytest.raises(RuntimeError):
+        async with queue.slot():
+            raise RuntimeError("boom")
+
+    async with queue.slot():
+        pass
+
+    assert queue.in_flight == 0
+    assert (queue.completed, queue.failed) == (1, 1)
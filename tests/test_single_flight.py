@@ -0,0 +1,121 @@
+"""single_flight: in-flight coalescing and idempotent replay"""
+import asyncio
+
+import pytest
+
+from cache_backend import MemoryBackend, TieredCache
+from single_flight import SingleFlight, request_key
+
+
+class CountingBackend(MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.gets = 0
+
+    async def get(self, key):
+        self.gets += 1
+        return await super().get(key)
+
+
+@pytest.fixture
+def l2():
+    return CountingBackend()
+
+
+def _flight(l2) -> SingleFlight:
+    flight = SingleFlight(idempotency_ttl=60)
+    flight.shared = TieredCache("single_flight_test", ttl=60, l2=l2)
+    return flight
+
+
+class Turn:
+    """Counts runs; each run waits for `release` so duplicates can arrive while it is in flight"""
+
+    def __init__(self):
+        self.runs = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self) -> str:
+        self.runs += 1
+        await self.release.wait()
+        return f"reply {self.runs}"
+
+
+async def test_concurrent_duplicates_share_one_run(l2):
+    flight, turn = _flight(l2), Turn()
+    key, idempotent = request_key("s1", "u1", "ok")
+
+    first = asyncio.create_task(flight.run(key, turn, idempotent))
+    second = asyncio.create_task(flight.run(key, turn, idempotent))
+    await asyncio.sleep(0)
+    turn.release.set()
+
+    assert await first == ("reply 1", False)
+    assert await second == ("reply 1", True)
+    assert turn.runs == 1
+
+
+async def test_same_text_after_completion_is_a_new_turn(l2):
+    flight, turn = _flight(l2), Turn()
+    turn.release.set()
+    key, idempotent = request_key("s1", "u1", "ok")
+
+    assert await flight.run(key, turn, idempotent) == ("reply 1", False)
+    assert await flight.run(key, turn, idempotent) == ("reply 2", False)
+    assert turn.runs == 2
+    assert l2.gets == 0  # No shared-cache lookup for requests without an idempotency key
+    assert flight.stats()["recent_idempotent"] == 0
+
+
+async def test_idempotent_retry_is_replayed_after_completion(l2):
+    flight, turn = _flight(l2), Turn()
+    turn.release.set()
+    key, idempotent = request_key("s1", "u1", "ok", idempotency_key="abc")
+
+    assert await flight.run(key, turn, idempotent) == ("reply 1", False)
+    assert await flight.run(key, turn, idempotent) == ("reply 1", True)
+    # Another worker (own in-process state) finds the result in the shared namespace
+    assert await _flight(l2).run(key, turn, idempotent) == ("reply 1", True)
+    assert turn.runs == 1
+
+
+async def test_idempotency_keys_are_scoped_to_the_student():
+    assert request_key("s1", "u1", "a", "k")[0] != request_key("s1", "u2", "a", "k")[0]
+    assert request_key("s1", "u1", "a", "k")[0] == request_key("s2", "u1", "b", "k")[0]
+
+
+async def test_failures_are_shared_but_not_remembered(l2):
+    flight = _flight(l2)
+    calls = 0
+
+    async def failing() -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0)
+        raise RuntimeError("llm down")
+
+    key, idempotent = request_key("s1", "u1", "ok", idempotency_key="abc")
+    results = await asyncio.gather(
+        flight.run(key, failing, idempotent), flight.run(key, failing, idempotent), return_exceptions=True
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert calls == 1
+
+    with pytest.raises(RuntimeError):
+        await flight.run(key, failing, idempotent)
+    assert calls == 2
+
+
+async def test_cancelled_caller_does_not_cancel_the_run(l2):
+    flight, turn = _flight(l2), Turn()
+    key, idempotent = request_key("s1", "u1", "ok")
+
+    first = asyncio.create_task(flight.run(key, turn, idempotent))
+    second = asyncio.create_task(flight.run(key, turn, idempotent))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    turn.release.set()
+
+    assert await second == ("reply 1", True)
+    assert flight.stats()["inflight"] == 0
@@ -0,0 +1,53 @@
+"""
+Per-message Text Features
+Normalized text, tokens and analyzer results computed once per request in
+router_node and shared by the emotion detector, rule engine, language detector,
+intent index and dataset retrieval, so every analyzer sees the same tokenization.
+"""
+import re
+from typing import FrozenSet, List, Optional
+from typing_extensions import TypedDict
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Lowercased, trimmed text used by every analyzer"""
+    return text.lower().strip()
+
+
+def tokenize(text: str) -> List[str]:
+    """Word tokens (\\w+) of the lowercased text; punctuation never sticks to a word ("stressed," → "stressed")"""
+    return _WORD_RE.findall(text.lower())
+
+
+class TextFeatures(TypedDict):
+    """Plain dict (like GraphState) so it checkpoints without custom serializers"""
+    text: str
+    normalized: str
+    tokens: List[str]
+    token_set: FrozenSet[str]
+    language: Optional[str]         # MultilingualDetector result (script or romanized)
+    topic: str                      # First topic rule hit
+    safety_tool: Optional[str]      # Highest-priority safety rule hit
+    academic_tool: Optional[str]    # Highest-priority academic rule hit
+    positive_count: int             # Emotion lexicon hits
+    negative_count: int
+
+
+def text_features(text: str) -> TextFeatures:
+    """Normalized text and tokens; analyzer fields start empty and are filled by the caller."""
+    normalized = normalize(text)
+    tokens = _WORD_RE.findall(normalized)
+    return TextFeatures(
+        text=text,
+        normalized=normalized,
+        tokens=tokens,
+        token_set=frozenset(tokens),
+        language=None,
+        topic="general",
+        safety_tool=None,
+        academic_tool=None,
+        positive_count=0,
+        negative_count=0
+    )